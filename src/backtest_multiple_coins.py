@@ -1,8 +1,17 @@
-import time
 import sys
-sys.path.insert(0, './')
+import os
+import pathlib
+SCRIPT_PATH   = pathlib.Path(__file__).resolve()
+ROOT_PATH     = SCRIPT_PATH.parent.parent
+DATA_PATH     = os.path.join(ROOT_PATH.absolute(), 'data', 'crypto', 'poloniex')
+POLONIEX_PATH = os.path.join(ROOT_PATH.absolute(), 'src', 'exchanges', 'crypto')
+sys.path.insert(0, POLONIEX_PATH)
+from poloniex import Poloniex
+from price_store import PriceStore
+from history_cache import HistoryCache, PoloniexHistory
+
+import time
 import json
-from poloniex import poloniex
 from datetime import datetime
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -15,7 +24,9 @@ import numpy as np
 
 # constants
 QUERI_POLONIEX = False
-BACKTEST_DATA_FILE = '../data/price_data_multiple_coins-BTC_ETH_XRP_LTC_ZEC_XMR_STR_DASH_ETC-2hr_intervals-ONE_YEAR-08_01_2018_7am_to_08_01_2019_4am.csv'
+BACKTEST_DATA_FILE = os.path.join(ROOT_PATH.absolute(), 'data', 'price_data_multiple_coins-BTC_ETH_XRP_LTC_ZEC_XMR_STR_DASH_ETC-2hr_intervals-ONE_YEAR-08_01_2018_7am_to_08_01_2019_4am.csv')
+HISTORY_CACHE_PATH = os.path.dirname(DATA_PATH) # price data of each exchange is in <HISTORY_CACHE_PATH>/<exchange>/price_store
+PRICE_STORE_PATH = os.path.join(DATA_PATH, 'price_store') # the coins of BACKTEST_DATA_FILE are imported into it the first time the store doesn't have them
 TETHER = 'USDT'
 COINS = [
     'BTC',
@@ -104,47 +115,39 @@ def poloniex_server():
     api_key = data[account]['api_key']
     secret_key = data[account]['secret_key']
 
-    return poloniex(api_key, secret_key)
+    return Poloniex(api_key, secret_key)
 
-# get backtesting data
+# get backtesting data, only the part of it that isn't in the price store yet is fetched from poloniex
 def get_past_prices_from_poloniex(
     startTime, endTime, period, num_periods, conn):
 
-    # get history data from startTime to endTime
-    startTime_unix = time.mktime(startTime.timetuple())
-    endTime_unix = time.mktime(endTime.timetuple())
-
-    # get price history data for each pair into a dictionary
-    dct = { pair :
-        conn.api_query("returnChartData", {
-            'currencyPair': pair,
-            'start': startTime_unix,
-            'end': endTime_unix,
-            'period': period
-        }) for pair in PAIRS}
-
-    # create 'unix_date' and 'datetime' columns
-    df = pd.DataFrame()
-    dates = [dct[PAIRS[0]][t]['date'] for t in num_periods]
-    df['unix_date'] = pd.Series(dates)
-    df['datetime'] = df['unix_date'].apply(
-        lambda unix_timestamp : \
-        datetime.fromtimestamp(unix_timestamp))
-
-    # remove unneeded data
-    for pair, data in dct.items():
-        coin = pair[len(TETHER + '_'):]
-        data2 = [data[t]['close'] for t in num_periods]
-        df[coin] = pd.Series(data2)
-
-    # save df to file
-    df.to_csv(BACKTEST_DATA_FILE)
+    # the pairs are fetched at the same time, all of them share the Poloniex client's rate limiter
+    history_cache = HistoryCache(HISTORY_CACHE_PATH, [PoloniexHistory(conn)])
+    history_cache.update_pairs('poloniex', PAIRS, period, startTime.timestamp(), endTime.timestamp())
 
-    return df
+    return get_past_prices_from_price_store(startTime, endTime, period)
 
-def get_past_prices_from_csv_file():
+def get_past_prices_from_price_store(startTime=None, endTime=None, period=2 * 60 * 60):
 
-    return pd.read_csv(BACKTEST_DATA_FILE, index_col=[0])
+    price_store = PriceStore(PRICE_STORE_PATH)
+    dfs = []
+    for pair in PAIRS:
+        coin = pair[len(TETHER + '_'):]
+        if not price_store.exists(pair, period) and os.path.isfile(BACKTEST_DATA_FILE):
+            price_store.import_csv(BACKTEST_DATA_FILE, pair, coin)
+        dfs.append(price_store.load_prices(pair, period, coin, startTime, endTime).set_index('unix_date'))
+
+    # line the coins up on the union of their unix_dates (outer join, a coin is NaN at the times it has no price)
+    # every coin's prices are put in their rows of one array with searchsorted instead of joining DataFrames one by one
+    unix_dates = [df0.index.to_numpy() for df0 in dfs]
+    unix_date, first = np.unique(np.concatenate(unix_dates), return_index=True)
+    prices = np.full((unix_date.shape[0], len(COINS)), np.nan)
+    for j, (df0, coin) in enumerate(zip(dfs, COINS)):
+        prices[np.searchsorted(unix_date, unix_dates[j]), j] = df0[coin].to_numpy(dtype=np.float64)
+    df = pd.DataFrame(prices, columns=COINS)
+    df.insert(0, 'unix_date', unix_date)
+    df.insert(1, 'datetime', np.concatenate([df0['datetime'].to_numpy() for df0 in dfs])[first])
+    return df
 
 
 
@@ -165,7 +168,7 @@ if __name__ == '__main__':
 
     # import backtest data of COIN1 and COIN2 pair
     df = get_past_prices_from_poloniex(startTime, endTime, period, num_periods, conn) \
-        if QUERI_POLONIEX else get_past_prices_from_csv_file()
+        if QUERI_POLONIEX else get_past_prices_from_price_store(startTime, endTime, period)
     # columns=[unix_date, datetime, BTC, ETH, XRP, LTC, ZEC, XMR, STR, DASH, ETC]
 
     # get percent change of price each time step
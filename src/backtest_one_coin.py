@@ -14,9 +14,17 @@ POLONIEX_PATH = os.path.join(ROOT_PATH.absolute(), 'src', 'exchanges', 'crypto')
 # sys.exit()
 sys.path.insert(0, POLONIEX_PATH)
 from poloniex import Poloniex
+from logger import Logger, DEBUG, INFO, WARNING
+from id_allocator import IdAllocator
+from price_store import PriceStore
+from history_downloader import DEFAULT_PERIODS_PER_CHUNK
+from history_cache import HistoryCache, PoloniexHistory
+from fill_models import FlatFill, ImpactFill, OrderBookFill
+from event_scheduler import next_event
 
 import time
 import json
+import bisect
 from datetime import datetime
 import matplotlib.pyplot as plt
 import pandas as pd
@@ -80,12 +88,16 @@ PAIR = COIN1 + '_' + COIN2
 TF = 0.0025 # TF = trading fee
 INCLUDE_TF = True  # flag if we want to include the TF in our calculations
 MAX_LEVERAGE = 2.0
+MAINTENANCE_FRACTION = 0.4 # the margin position is force liquidated when the margin account's equity falls to this fraction of the initial margin (1 / MAX_LEVERAGE) of the position's value
+COLUMNAR_ENGINE = True # set COLUMNAR_ENGINE to True to step through numpy arrays of the price data, else step through self.df.iloc (much slower)
 
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-2hr_intervals-ONE_YEAR-03_01_2018_8am_to_05_30_2019_6am.csv' % (COIN2, COIN1)
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_DAY-02-20-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_MONTH-01-21-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 DATA_FILENAME = "price_data_one_coin-%s_%s-5min_intervals-ONE_QUARTER-11-21-2019-12am_to_02-21-2020-12am.csv" % (COIN2, COIN1)
-BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME)
+BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME) # imported into the price store the first time the store doesn't have PAIR
+HISTORY_CACHE_PATH = os.path.dirname(DATA_PATH) # price data of each exchange is in <HISTORY_CACHE_PATH>/<exchange>/price_store
+PRICE_STORE_PATH = os.path.join(DATA_PATH, 'price_store')
 API_KEYS_FILEPATH = os.path.join(SRC_PATH, "api_keys.json")
 
 
@@ -105,9 +117,9 @@ BLOCK_NET_PL = True # set BLOCK_NET_PL to True if you want to only update net_pl
 # pprint constants
 OUTPUT_TO_CONSOLE = True
 OUTPUT_TO_LOGFILE = False
+LOG_LEVEL = INFO # DEBUG also logs every order and time step (even when verbose=False), QUIET logs nothing
 STRATEGY_LOGFILE_PATH  = os.path.join(ROOT_PATH.absolute(), 'logs', 'backtest_log.txt')
 UNITTEST_LOGFILE_PATH  = os.path.join(ROOT_PATH.absolute(), 'logs', 'unittest_log.txt')
-LOGFILE_PATH = None # to be set by Strat class or StratUnitTests class
 INDENT = '|   '
 DRAW_LINE = False
 
@@ -115,6 +127,124 @@ DRAW_LINE = False
 
 
 
+class PortfolioLedger:
+
+    # balance history of every (account_type, asset) column of the portfolio
+    # stored as one structured numpy array with a row per time step, preallocated to num_periods
+    # rows are forward filled as time steps pass, so the balance at any time step is a single lookup
+    def __init__(self,
+        init_balances,
+        num_periods):
+
+        self.columns = list(init_balances.keys()) # list of (account_type, asset) tuples
+        self.fields = {column : '%s_%s' % column for column in self.columns}
+        self.history = np.zeros(
+            num_periods + 1,
+            dtype=np.dtype([(self.fields[column], np.float64) for column in self.columns]))
+        for column, balance in init_balances.items():
+            self.history[self.fields[column]][0] = balance
+        self.t_last = 0 # last time step written to, every row after it is still unset
+
+    # get the balance of asset in account_type at the end of time step t (or the most recent balance if t is None)
+    def balance(self,
+        account_type,
+        asset,
+        t=None):
+
+        if t is None or t > self.t_last:
+            t = self.t_last
+        return self.history[self.fields[(account_type, asset)]][t]
+
+    # add change to the balance of asset in account_type at time step t
+    def update(self,
+        t,
+        account_type,
+        asset,
+        change):
+
+        self.forward_fill(t)
+        self.history[self.fields[(account_type, asset)]][t] += change
+
+    # copy the last written row into every row up to and including time step t
+    def forward_fill(self, t):
+
+        if t <= self.t_last:
+            return
+        if t >= self.history.shape[0]: # only happens if we run past num_periods (ex: live trading), double the size
+            history = np.zeros(max(2 * self.history.shape[0], t + 1), dtype=self.history.dtype)
+            history[:self.t_last+1] = self.history[:self.t_last+1]
+            self.history = history
+        self.history[self.t_last+1:t+1] = self.history[self.t_last]
+        self.t_last = t
+
+
+
+class OpenOrderBook:
+
+    # order_ids of the open limit orders, split into bids (buy orders: enter long, exit short)
+    # and asks (sell orders: exit long, enter short), each side a list kept sorted with bisect
+    # so every order the price crossed is found with one binary search per side
+    # asks are keyed by -limit_price, so on both sides the orders that fill first are at the end of the list
+    # and filling pops them off the end without moving the rest
+    def __init__(self):
+
+        self.keys = {
+            'bid' : [], # limit_price of the bids, ascending
+            'ask' : []  # -limit_price of the asks, ascending
+        }
+        self.order_ids = {
+            'bid' : [],
+            'ask' : []
+        }
+
+    def __len__(self):
+        return len(self.order_ids['bid']) + len(self.order_ids['ask'])
+
+    # 'bid' if the order buys COIN2, 'ask' if it sells COIN2
+    @staticmethod
+    def side(long_or_short, enter_or_exit):
+        return 'bid' if (long_or_short == 'long') == (enter_or_exit == 'enter') else 'ask'
+
+    @staticmethod
+    def key(side, limit_price):
+        return limit_price if side == 'bid' else -limit_price
+
+    def add(self, order_id, side, limit_price):
+
+        # bids fill from the highest price down and asks from the lowest price up,
+        # orders at the same limit price fill first come first serve (a new order goes in front of the older ones)
+        key = OpenOrderBook.key(side, limit_price)
+        i = bisect.bisect_left(self.keys[side], key)
+        self.keys[side].insert(i, key)
+        self.order_ids[side].insert(i, order_id)
+
+    def remove(self, order_id, side, limit_price):
+        keys, order_ids = self.keys[side], self.order_ids[side]
+        i = bisect.bisect_left(keys, OpenOrderBook.key(side, limit_price))
+        while order_ids[i] != order_id: # the orders at the same limit price
+            i += 1
+        del keys[i], order_ids[i]
+
+    # remove and return the order_ids of every order that price crossed (bids at or above price, asks at or below price)
+    def pop_crossed(self, price):
+
+        crossed = []
+        for side in ['bid', 'ask']:
+            keys, order_ids = self.keys[side], self.order_ids[side]
+            i = bisect.bisect_left(keys, OpenOrderBook.key(side, price))
+            if i < len(keys):
+                crossed += order_ids[i:][::-1]
+                del keys[i:], order_ids[i:]
+        return crossed
+
+    # highest bid and lowest ask (None if that side is empty)
+    def best_bid(self):
+        return self.keys['bid'][-1] if len(self.keys['bid']) > 0 else None
+    def best_ask(self):
+        return -self.keys['ask'][-1] if len(self.keys['ask']) > 0 else None
+
+
+
 class Strat:
 
     # create strategy instance
@@ -123,11 +253,19 @@ class Strat:
         verbose=False,
         num_indents=0,
         logfile_path=STRATEGY_LOGFILE_PATH,
-        clear_log=True):
+        clear_log=True,
+        fill_model=None):
 
         self.logfile_path = logfile_path
-        if clear_log:
-            open(self.logfile_path, 'w').close()
+        self.fill_model = fill_model if fill_model is not None else FlatFill() # price market orders fill at, see fill_models.py
+        self.logger = Logger(
+            logfile_path=logfile_path,
+            level=LOG_LEVEL,
+            to_console=OUTPUT_TO_CONSOLE,
+            to_logfile=OUTPUT_TO_LOGFILE,
+            clear_log=clear_log,
+            indent=INDENT,
+            draw_line=DRAW_LINE)
         if verbose: self.pprint('Initializing Strategy ...', num_indents=num_indents)
 
         exchange_start_quantity, margin_start_quantity = \
@@ -147,23 +285,26 @@ class Strat:
                 COIN2 : 0.0                                   # initial quantity of money (in COIN2) in the Margin account (+ is long, - is short)
             }
         }
-        self.portfolio = {
-            'exchange' : {
-                COIN1 : [self.portfolio_init['exchange'][COIN1]], # current quantity of money (in COIN1) in the Exchange account
-                COIN2 : [self.portfolio_init['exchange'][COIN2]]  # current quantity of money (in COIN2) in the Exchange account
-            },
-            'margin' : {
-                'collateral' : [self.portfolio_init['margin']['collateral']], # current quantity of money (in COIN1) in the Margin account (aka collateral)
-                'debt'       : [self.portfolio_init['margin']['debt']],       # current quantity of money in the Margin account that has been borrowed
-                COIN1        : [self.portfolio_init['margin'][COIN1]],        # current quantity of money (in COIN1) in Margin account that can be borrowed
-                COIN2        : [self.portfolio_init['margin'][COIN2]]         # current quantity of money (in COIN2) in the Margin account (+ is long, - is short)
-            }
-        }
+        self.portfolio = PortfolioLedger({
+            ('exchange', COIN1)           : self.portfolio_init['exchange'][COIN1],       # quantity of money (in COIN1) in the Exchange account
+            ('exchange', COIN2)           : self.portfolio_init['exchange'][COIN2],       # quantity of money (in COIN2) in the Exchange account
+            ('margin',   'collateral')    : self.portfolio_init['margin']['collateral'],  # quantity of money (in COIN1) in the Margin account (aka collateral)
+            ('margin',   'debt_' + COIN1) : self.portfolio_init['margin']['debt'][COIN1], # COIN1 value of the open margin position when it was entered (borrowed to buy a long, received for selling a short)
+            ('margin',   COIN1)           : self.portfolio_init['margin'][COIN1],         # quantity of money (in COIN1) in Margin account that can be borrowed
+            ('margin',   COIN2)           : self.portfolio_init['margin'][COIN2]          # quantity of money (in COIN2) in the Margin account (+ is long, - is short)
+        }, self.num_periods)
+        # portfolio.balance(account_type, asset, t) = balance at the end of time step t
+        self.open_positions_total_coin1_cost = 0.0
+        self.liquidation_price = None # price the margin position is force liquidated at, None if there's no margin position, see update_liquidation_price()
         self.portfolio_update_reset()
         self.open_orders = {}
         # dict:
         # key = order_id
         # value = [account_type(str), long_or_short(str), enter_or_exit(str), quantity(float), limit_price(float), percent(boolean)]
+        self.open_order_book = OpenOrderBook() # order_ids of open_orders sorted by limit_price, used to fill them
+        self.order_ids = IdAllocator() # reuses the lowest order_id freed by a filled or canceled order
+        self.indicators = {} # key = name, value = incremental indicator (see indicators.py) updated with the price every time step, add them in the strategy init
+        self.triggers = None # set by the strategy to skip time steps until one fires, see backtest()
         # self.open_positions = {
         #     'exchange' : [],
         #     'margin' :   []
@@ -245,10 +386,14 @@ class Strat:
                 period,
                 self.num_periods,
                 verbose=verbose,
-                num_indends=num_indends+1) \
+                num_indents=num_indents+1) \
             if QUERI_POLONIEX else \
-            self.get_past_prices_from_csv_file(
-                verbose=verbose, num_indents=num_indents+1)
+            self.get_past_prices_from_price_store(
+                start_time_dt,
+                end_time_dt,
+                period,
+                verbose=verbose,
+                num_indents=num_indents+1)
 
         # get percent change of price each time step
         # https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.pct_change.html
@@ -264,8 +409,15 @@ class Strat:
         # plt.show()
 
         self.df = df
+        if COLUMNAR_ENGINE:
+            # pull the columns update() reads each time step into contiguous numpy arrays once
+            # indexing these is much cheaper than building a pandas Series with df.iloc every time step
+            self.unix_dates = df['unix_date'].to_numpy()
+            self.dates      = df['datetime'].to_numpy()
+            self.prices     = np.ascontiguousarray(df[COIN2].to_numpy(dtype=np.float64))
+            self.pct_chgs   = np.ascontiguousarray(df['pct_chg'].to_numpy(dtype=np.float64))
         self.t = t
-        self.unix_date, self.date, self.price, self.pct_chg = df.iloc[t]
+        self.load_timestep(t)
         if verbose:
             self.pprint('Starting Backtest at:', num_indents=num_indents+1)
             self.pprint('t ....................................... %d' % self.t,                                num_indents=num_indents+2)
@@ -279,6 +431,16 @@ class Strat:
             self.pprint('pct_chg (from previous %s' % label,                                                    num_indents=num_indents+2)
             self.pprint('Backtesting Initialized.',      num_indents=num_indents)
         return exchange_start_quantity, margin_start_quantity
+    def load_timestep(self, t):
+
+        # set unix_date, date, price and pct_chg to their values at time step t
+        if COLUMNAR_ENGINE:
+            self.unix_date = self.unix_dates[t]
+            self.date      = self.dates[t]
+            self.price     = self.prices[t]
+            self.pct_chg   = self.pct_chgs[t]
+        else:
+            self.unix_date, self.date, self.price, self.pct_chg = self.df.iloc[t]
     def reset(self,
         exchange_start_quantity,
         margin_start_quantity,
@@ -301,34 +463,25 @@ class Strat:
                 COIN2 : 0.0
             },
             'margin' : {
-                'collateral' : 0.0,
-                COIN1        : 0.0,
-                COIN2        : 0.0
+                'collateral'    : 0.0,
+                'debt_' + COIN1 : 0.0,
+                COIN1           : 0.0,
+                COIN2           : 0.0
             }
         }
         if verbose: self.pprint('Successful.', num_indents=num_indents)
     def pprint(self, string='',
+        *args,
         num_indents=0,
         new_line_start=False,
-        new_line_end=False):
-
-        def output(out_loc):
-            indent = len(INDENT)*' ' if out_loc != sys.stdout else INDENT
-            total_indent0 = ''.join([indent] * num_indents)
-            total_indent1 = ''.join([indent] * (num_indents + 1))
-            if new_line_start:
-                print(total_indent1 if DRAW_LINE else total_indent0, file=out_loc)
-            for s in string.split('\n'):
-                print(total_indent0 + s, file=out_loc)
-            if new_line_end:
-                print(total_indent1 if DRAW_LINE else total_indent0, file=out_loc)
-
-        if OUTPUT_TO_CONSOLE:
-            output(sys.stdout)
-        if OUTPUT_TO_LOGFILE:
-            logfile = open(self.logfile_path, 'a')
-            output(logfile)
-            logfile.close()
+        new_line_end=False,
+        level=INFO):
+
+        # args are only formatted into string if level is being logged, see logger.py
+        self.logger.log(level, string, *args,
+            num_indents=num_indents,
+            new_line_start=new_line_start,
+            new_line_end=new_line_end)
 
     # connect to Poloniex Exchange server
     def poloniex_server(self):
@@ -342,240 +495,121 @@ class Strat:
 
         return Poloniex(api_key, secret_key)
 
-    # get backtesting data
+    # cache of the poloniex price history in the price store
+    def history_cache(self):
+        return HistoryCache(HISTORY_CACHE_PATH, [PoloniexHistory(self.poloniex_server())])
+
+    # get backtesting data, only the part of it that isn't in the price store yet is fetched from poloniex
     def get_past_prices_from_poloniex(self,
         start_time_dt,
         end_time_dt,
         period,
         num_periods,
-        save_to_csv=False,
         verbose=False,
         num_indents=0):
 
-        # get history data from startTime to endTime
-        start_time_unix = time.mktime(start_time_dt.timetuple())
-        end_time_unix   = time.mktime(end_time_dt.timetuple())
-
-        print('Start Date: %s\t\tStart Unix: %s'   % (datetime.fromtimestamp(start_time_unix), start_time_unix))
-        print('End Date:   %s\t\tEnd Unix:   %s\n' % (datetime.fromtimestamp(end_time_unix), end_time_unix))
-
-        conn = self.poloniex_server()
-
-        def get_chunk(
-            chunk_index,
-            num_chunks,
-            chunk_start_time_unix,
-            chunk_end_time_unix,
-            periods_per_chunk):
-
-            if verbose:
-                print('chunk %d of %d:\t%s to %s' % (
-                    chunk_index, num_chunks,
-                    datetime.fromtimestamp(chunk_start_time_unix),
-                    datetime.fromtimestamp(chunk_end_time_unix)),
-                    end='\t')
-
-            # get history data of this currency into the dictionary
-            prices1 = conn.api_query("returnChartData", {
-                    'currencyPair': PAIR,
-                    'start': chunk_start_time_unix,
-                    'end': chunk_end_time_unix,
-                    'period': period
-                })
-            # print(type(prices1), prices1[0])
-            # input()
-
-            # remove unneeded data
-            prices2 = [{
-                'unix_date': price_data['date'],
-                COIN2: price_data['close'] \
-            } for price_data in prices1]
-            # print(type(prices2), prices2[0])
-            # input()
-
-            # create 'unix_date' and 'datetime' columns
-            df = pd.DataFrame(prices2)
-            df['datetime'] = df['unix_date'].apply(
-                lambda unix_timestamp : \
-                datetime.fromtimestamp(unix_timestamp))
-
-            # reorder columns and reset indeces
-            df = df[['unix_date', 'datetime', COIN2]]
-
-            return df
-
-        periods_per_chunk = int((24 * 60 * 60) / (5 * 60)) # 10000
-        chunk_duration = period * periods_per_chunk
-        current_time_unix = start_time_unix
-        df0 = pd.DataFrame({"unix_date":[], "datetime":[], COIN2:[]})
-        chunk_index = 1
-        num_chunks = (end_time_unix - start_time_unix) / int(start_time_unix/chunk_duration)
-        while current_time_unix < end_time_unix:
-            chunk_end_time_unix = current_time_unix + chunk_duration
-            df0 = df0.append(
-                get_chunk(
-                    chunk_index,
-                    num_chunks,
-                    current_time_unix,
-                    chunk_end_time_unix,
-                    periods_per_chunk),
-                ignore_index=True)
-            if verbose: print("total rows (aka periods) collected: %s" % df0.shape[0])
-            # print(df.head(10))
-            current_time_unix = chunk_end_time_unix
-            chunk_index += 1
-            time.sleep(1)
-        df0.drop_duplicates(
-            subset="unix_date",
-            keep="last",
-            inplace=True,
-            ignore_index=True)
-        df0.reset_index(
-            inplace=True,
-            drop=True)
-
-        if save_to_csv:
-    
-            # USE THIS AS A TEMPLATE TO CREATE new_data_filename (replace "APPROX_DURATION" with the approximate duration of the backtest)
-            new_data_filename = 'price_data_one_coin-%s_%s-5min_intervals-APPROX_DURATION-%S_to_%s.csv' % (
-                COIN2, COIN1,
-                start_time_dt.strftime('%Y-%m-%d-%I%p'),
-                end_time_dt.strftime('%Y-%m-%d-%I%p'))
-            new_backtest_data_file = os.path.join(DATA_PATH, new_data_filename)
-            df.to_csv(new_backtest_data_file)
+        if verbose:
+            self.pprint('Start Date: %s\t\tStart Unix: %s' % (start_time_dt, start_time_dt.timestamp()), num_indents=num_indents)
+            self.pprint('End Date:   %s\t\tEnd Unix:   %s' % (end_time_dt,   end_time_dt.timestamp()),   num_indents=num_indents)
+
+        df = self.history_cache().load_prices(
+            'poloniex',
+            PAIR,
+            period,
+            COIN2,
+            start_time_dt,
+            end_time_dt,
+            verbose=verbose)
 
         if verbose: self.pprint('Successfully aquired price data from poloniex API.',
                         num_indents=num_indents,
                         new_line_start=True)
-        return df0
+        return df
+    # get all the price data before start_time_dt, going back one chunk at a time until poloniex has no older data
     def march_into_the_past(self,
         start_time_dt,
         period,
-        num_periods,
-        save_to_csv=False,
+        periods_per_chunk=DEFAULT_PERIODS_PER_CHUNK,
         verbose=False,
         num_indents=0):
 
-        # get history data from startTime to endTime
-        start_time_unix = time.mktime(start_time_dt.timetuple())
-        print('Start Date: %s\t\tStart Unix: %s'   % (datetime.fromtimestamp(start_time_unix), start_time_unix))
-
-        conn = self.poloniex_server()
-
-        def get_chunk(
-            chunk_index,
-            chunk_start_time_unix,
-            chunk_end_time_unix,
-            periods_per_chunk):
-
-            if verbose:
-                print('chunk %d of %d:\t%s to %s' % (
-                    chunk_index, num_chunks,
-                    datetime.fromtimestamp(chunk_start_time_unix),
-                    datetime.fromtimestamp(chunk_end_time_unix)),
-                    end='\t')
-
-            # get history data of this currency into the dictionary
-            prices1 = conn.api_query("returnChartData", {
-                    'currencyPair': PAIR,
-                    'start': chunk_start_time_unix,
-                    'end': chunk_end_time_unix,
-                    'period': period
-                })
-            # print(type(prices1), prices1[0])
-            # input()
-
-            # remove unneeded data
-            prices2 = [{
-                'unix_date': price_data['date'],
-                COIN2: price_data['close'] \
-            } for price_data in prices1]
-            # print(type(prices2), prices2[0])
-            # input()
-
-            # create 'unix_date' and 'datetime' columns
-            df = pd.DataFrame(prices2)
-            df['datetime'] = df['unix_date'].apply(
-                lambda unix_timestamp : \
-                datetime.fromtimestamp(unix_timestamp))
-
-            # reorder columns and reset indeces
-            df = df[['unix_date', 'datetime', COIN2]]
-
-            return df
-
-        periods_per_chunk = int((24 * 60 * 60) / (5 * 60)) # 10000
-        chunk_duration = period * periods_per_chunk
-        current_time_unix = start_time_unix
-        df0 = pd.DataFrame({"unix_date":[], "datetime":[], COIN2:[]})
-        chunk_index = 1
-        num_chunks = (end_time_unix - start_time_unix) / int(start_time_unix/chunk_duration)
+        history_cache = self.history_cache()
+        price_store = history_cache.price_store('poloniex')
+        chunk_end_time_unix = start_time_dt.timestamp()
         while True:
-            chunk_start_time_unix = current_time_unix - chunk_duration
-            chunk_end_time_unix = current_time_unix
-            chunk = get_chunk(
-                chunk_index,
-                num_chunks,
-                chunk_start_time_unix,
-                chunk_end_time_unix,
-                periods_per_chunk)
-            df0 = df0.append(chunk, ignore_index=True)
-            if verbose: print("total rows (aka periods) collected: %s" % df0.shape[0])
-            # print(df.head(10))
-            current_time_unix = chunk_start_time_unix
-            chunk_index += 1
-            time.sleep(1)
-        df0.drop_duplicates(
-            subset="unix_date",
-            keep="last",
-            inplace=True,
-            ignore_index=True)
-        df0.reset_index(
-            inplace=True,
-            drop=True)
-
-        if save_to_csv:
-    
-            # USE THIS AS A TEMPLATE TO CREATE new_data_filename (replace "APPROX_DURATION" with the approximate duration of the backtest)
-            new_data_filename = 'price_data_one_coin-%s_%s-5min_intervals-APPROX_DURATION-%S_to_%s.csv' % (
-                COIN2, COIN1,
-                start_time_dt.strftime('%Y-%m-%d-%I%p'),
-                end_time_dt.strftime('%Y-%m-%d-%I%p'))
-            new_backtest_data_file = os.path.join(DATA_PATH, new_data_filename)
-            df.to_csv(new_backtest_data_file)
+            chunk_start_time_unix = chunk_end_time_unix - period * periods_per_chunk
+            history_cache.update('poloniex', PAIR, period, chunk_start_time_unix, chunk_end_time_unix, verbose=verbose)
+            if not price_store.exists(PAIR, period) or \
+                price_store.load(PAIR, period, chunk_start_time_unix, chunk_end_time_unix, columns=[]).shape[0] == 0:
+                break
+            chunk_end_time_unix = chunk_start_time_unix
 
         if verbose: self.pprint('Successfully aquired price data from poloniex API.',
                         num_indents=num_indents,
                         new_line_start=True)
-        return df0
-    def get_past_prices_from_csv_file(self,
+        if not price_store.exists(PAIR, period):
+            return pd.DataFrame({'unix_date' : [], 'datetime' : [], COIN2 : []})
+        return price_store.load_prices(PAIR, period, COIN2, end_time_dt=start_time_dt)
+    def get_past_prices_from_price_store(self,
+        start_time_dt=None,
+        end_time_dt=None,
+        period=5 * 60,
         verbose=False,
         num_indents=0):
-        if verbose: self.pprint('Successfully aquired price data from CSV file.',
+        price_store = PriceStore(PRICE_STORE_PATH)
+        if not price_store.exists(PAIR, period) and os.path.isfile(BACKTEST_DATA_FILE):
+            price_store.import_csv(BACKTEST_DATA_FILE, PAIR, COIN2)
+        df = price_store.load_prices(PAIR, period, COIN2, start_time_dt, end_time_dt)
+        if verbose: self.pprint('Successfully aquired price data from price store.',
                         num_indents=num_indents,
                         new_line_start=True)
-        return pd.read_csv(BACKTEST_DATA_FILE, index_col=[0])
+        return df
 
 
     # run backtest
-    def backtest(self):
+    def backtest(self,
+        pause_on_update=False):
 
         # iterate over each timestep starting at t
-        while self.t < self.num_periods:
-            self.t += 1
+        # if the strategy set self.triggers it's idle until one of them fires, then the backtest jumps straight
+        # to the next time step something can happen at instead of updating every time step, see next_update_t()
+        t_last = min(self.num_periods, self.df.shape[0] - 1)
+        while self.t < t_last:
+            self.t = self.next_update_t(t_last)
             self.update()
-            input()
-        print('Backtest Complete')
+            if pause_on_update: input()
+
+        # the portfolio is only written when it changes, carry the final balances to the last row of its history
+        self.portfolio.forward_fill(max(self.t, self.portfolio.history.shape[0] - 1))
+        self.pprint('Backtest Complete')
+        self.logger.flush()
+    def next_update_t(self, t_last):
+
+        # self.triggers = dict with any of (None or missing = not used):
+        #     'below' - update when the price falls to or below this price
+        #     'above' - update when the price rises to or above this price
+        #     't'     - update at this time step
+        # open limit orders and the liquidation price are always triggers too,
+        # the time steps in between are skipped (the portfolio is forward filled over them)
+        # strategies with self.indicators need every price, so they're updated every time step
+        if self.triggers is None or len(self.indicators) > 0:
+            return self.t + 1
+        long_position = self.portfolio.balance('margin', COIN2) > 0
+        prices = self.prices if COLUMNAR_ENGINE else self.df[COIN2].to_numpy(dtype=np.float64)
+        return next_event(prices, self.t, t_last,
+            belows=[self.triggers.get('below'), self.open_order_book.best_bid(), self.liquidation_price if long_position else None],
+            aboves=[self.triggers.get('above'), self.open_order_book.best_ask(), None if long_position else self.liquidation_price],
+            ts=[self.triggers.get('t')])
     def update(self,
         verbose=False,
         num_indents=0):
 
-        self.unix_date, self.date, self.price, self.pct_chg = self.df.iloc[self.t]
+        self.load_timestep(self.t)
         t, unix_date, date, price, pct_chg = self.t, self.unix_date, self.date, self.price, self.pct_chg
         # if verbose: self.pprint('%d   %s   %s   %.6f %s/%s    %.1f %%' % (
         #     t, unix_date, date, price, COIN1, COIN2, (100*pct_chg)), num_indents=num_indents)
 
-        self.pprint('Updating Backtest', num_indents=num_indents)
+        self.pprint('Updating Backtest', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('t ..................... %s' % t, num_indents=num_indents+1)
             self.pprint('unix_date ............. %s' % unix_date, num_indents=num_indents+1)
@@ -585,17 +619,23 @@ class Strat:
 
 
         self.check_for_forced_liquidation(verbose=verbose, num_indents=num_indents)
+        self.fill_open_orders(verbose=verbose, num_indents=num_indents+1)
+
+        # add this time step's price to the indicators, read them in the strategy as self.indicators[name].value
+        for indicator in self.indicators.values():
+            indicator.update(price)
 
         ########################################################## STRATEGY UPDATE GOES HERE ###################################################
 
         # tbd
+        # to sleep until something happens set self.triggers (ex: {'below' : 0.95 * price, 'above' : 1.05 * price}), to wake up every time step set it to None
 
         ########################################################################################################################################
 
-        self.pprint('', num_indents=num_indents+1)
+        self.pprint('', num_indents=num_indents+1, level=INFO if verbose else DEBUG)
         self.execute_net_trades(verbose=verbose, num_indents=num_indents+1)
 
-        self.pprint('Update Complete.', num_indents=num_indents)
+        self.pprint('Update Complete.', num_indents=num_indents, level=INFO if verbose else DEBUG)
 
     # place order
     def order(self,
@@ -729,7 +769,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Entering Long Market Order', num_indents=num_indents)
+        self.pprint('Entering Long Market Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -742,15 +782,15 @@ class Strat:
         # determine the actual quantity of COIN1 of portfolio in account_type to a quantity of COIN2
         if percent:
             quantity = self.convert_percent_to_quantity(
-                account_type, COIN1, COIN2, quantity,
+                account_type, COIN1, COIN2, quantity, side='buy',
                 verbose=verbose, num_indents=num_indents+1)
 
         # exit short if theres anything short
-        quantity_short = self.portfolio['margin'][COIN2][-1]
+        quantity_short = self.portfolio.balance('margin', COIN2)
         if account_type == 'margin' and quantity_short < 0:
             if quantity <= abs(quantity_short):
-                self.pprint('Currently short %.6f %s. Converting enter long to exit short' % (
-                    quantity_short, COIN2), num_indents=num_indents+1, new_line_start=True)
+                self.pprint('Currently short %.6f %s. Converting enter long to exit short', quantity_short, COIN2,
+                    num_indents=num_indents+1, new_line_start=True, level=INFO if verbose else DEBUG)
                 _, trade_message = self.exit_short_market_order(
                     account_type,
                     quantity,
@@ -758,21 +798,23 @@ class Strat:
                     num_indents=num_indents+1)
                 quantity = 0
             else: # quantity > quantity_short
-                self.pprint('Currently short %.6f %s. Exiting short and decreasing quantity' % (
-                    quantity_short, COIN2), num_indents=num_indents+1, new_line_start=True)
+                self.pprint('Currently short %.6f %s. Exiting short and decreasing quantity', quantity_short, COIN2,
+                    num_indents=num_indents+1, new_line_start=True, level=INFO if verbose else DEBUG)
                 self.exit_short_market_order(
                     account_type,
                     abs(quantity_short),
                     verbose=verbose,
                     num_indents=num_indents+1)
                 quantity -= abs(quantity_short)
-                self.pprint('quantity decreased to %.6f %s' % (
-                    quantity, COIN2), num_indents=num_indents+1)
+                self.pprint('quantity decreased to %.6f %s', quantity, COIN2,
+                    num_indents=num_indents+1, level=INFO if verbose else DEBUG)
 
         if quantity > 0:
-            coin1_cost = quantity * self.price # trading fee is not added back on here because thats done in the transfer function
+            coin1_cost = quantity * self.fill_price('buy', quantity) # trading fee is not added back on here because thats done in the transfer function
             coin2_gain = quantity
             _, trade_message = self.trade(account_type, COIN1, coin1_cost, COIN2, coin2_gain, verbose=verbose, num_indents=num_indents+1)
+            if trade_message == 'Trade Successful.' and account_type == 'margin':
+                self.margin_entered('long', coin1_cost)
             # self.open_positions[account_type].append({
             #     'long_or_short' : 'short',
             #     'coin1_cost'    : coin1_cost,
@@ -781,7 +823,8 @@ class Strat:
             # })
             self.open_positions_total_coin1_cost += coin1_cost
 
-        self.pprint('Enter Long %s.' % ('Succeeded' if trade_message == 'Trade Successful.' else 'Failed'), num_indents=num_indents)
+        self.pprint('Enter Long %s.', 'Succeeded' if trade_message == 'Trade Successful.' else 'Failed',
+            num_indents=num_indents, level=INFO if verbose else DEBUG)
         return None, trade_message
     def enter_long_limit_order(self,
         account_type,
@@ -791,7 +834,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Entering Long Limit Order', num_indents=num_indents)
+        self.pprint('Entering Long Limit Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -811,6 +854,7 @@ class Strat:
         else:
             order_id = self.get_order_id()
             self.open_orders[order_id] = [account_type, 'long', 'enter', quantity, limit_price, percent]
+            self.open_order_book.add(order_id, OpenOrderBook.side('long', 'enter'), limit_price)
             if verbose: self.pprint('Created enter long open limit order. order_id: %s' % order_id, num_indents=num_indents)
             return order_id, 'Created enter long open limit order'
     def exit_long(self,
@@ -838,7 +882,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Exiting Long Market Order', num_indents=num_indents)
+        self.pprint('Exiting Long Market Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -854,16 +898,14 @@ class Strat:
                 account_type, COIN2, COIN2, quantity,
                 deduct_tf=False, verbose=verbose, num_indents=num_indents+1)
 
+        position = self.margin_balance(COIN2) # before the trade changes it
         coin2_cost = quantity
-        coin1_gain = quantity * self.price
+        coin1_gain = quantity * self.fill_price('sell', quantity)
         order_id, trade_message = self.trade(account_type, COIN2, coin2_cost, COIN1, coin1_gain, verbose=verbose, num_indents=num_indents)
 
-        # # update collateral (with portfolio update) <-- this requires tracking open positions (which is required anyway for forced liquidation)
-        # if trade_message == 'Trade Successful.' and account_type == 'margin':
-        #     for op in self.open_positions[account_type]:
-        #         op['long_or_short']
-        #         op['quantity']
-        #         op['enter_price']
+        # move the realized P/L into the collateral
+        if trade_message == 'Trade Successful.' and account_type == 'margin':
+            self.margin_exited('long', position, quantity, coin1_gain)
 
         return None, trade_message
     def exit_long_limit_order(self,
@@ -874,7 +916,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Exiting Long Limit Order', num_indents=num_indents)
+        self.pprint('Exiting Long Limit Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -894,6 +936,7 @@ class Strat:
         else:
             order_id = self.get_order_id()
             self.open_orders[order_id] = [account_type, 'long', 'exit', quantity, limit_price, percent]
+            self.open_order_book.add(order_id, OpenOrderBook.side('long', 'exit'), limit_price)
             if verbose: self.pprint('Created exit long open limit order. order_id: %s' % order_id, num_indents=num_indents)
             return order_id, 'Created exit long open limit order'
 
@@ -923,7 +966,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Entering Short Market Order', num_indents=num_indents)
+        self.pprint('Entering Short Market Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -936,15 +979,15 @@ class Strat:
         # determine the actual quantity of COIN1 of portfolio in account_type to a quantity of COIN2
         if percent:
             quantity = self.convert_percent_to_quantity(
-                account_type, COIN1, COIN2, quantity,
+                account_type, COIN1, COIN2, quantity, side='sell',
                 verbose=verbose, num_indents=num_indents+1)
 
         # exit long if theres anything long
-        quantity_long = self.portfolio['margin'][COIN2][-1]
+        quantity_long = self.portfolio.balance('margin', COIN2)
         if account_type == 'margin' and quantity_long > 0:
             if quantity <= quantity_long:
-                self.pprint('Currently long %.6f %s. Converting enter short to exit long' % (
-                    quantity_long, COIN2), num_indents=num_indents+1, new_line_start=True)
+                self.pprint('Currently long %.6f %s. Converting enter short to exit long', quantity_long, COIN2,
+                    num_indents=num_indents+1, new_line_start=True, level=INFO if verbose else DEBUG)
                 _, trade_message = self.exit_long_market_order(
                     account_type,
                     quantity,
@@ -952,21 +995,23 @@ class Strat:
                     num_indents=num_indents+1)
                 quantity = 0
             else: # quantity > quantity_long
-                self.pprint('Currently long %.6f %s. Exiting long and decreasing quantity' % (
-                    quantity_long, COIN2), num_indents=num_indents+1, new_line_start=True)
+                self.pprint('Currently long %.6f %s. Exiting long and decreasing quantity', quantity_long, COIN2,
+                    num_indents=num_indents+1, new_line_start=True, level=INFO if verbose else DEBUG)
                 self.exit_long_market_order(
                     account_type,
                     quantity_long,
                     verbose=verbose,
                     num_indents=num_indents+1)
                 quantity -= quantity_long
-                self.pprint('quantity decreased to %.6f %s' % (
-                    quantity, COIN2), num_indents=num_indents+1)
+                self.pprint('quantity decreased to %.6f %s', quantity, COIN2,
+                    num_indents=num_indents+1, level=INFO if verbose else DEBUG)
 
         if quantity > 0:
-            coin1_cost = quantity * self.price # trading fee is not added back on here because thats done in the transfer function
+            coin1_cost = quantity * self.fill_price('sell', quantity) # trading fee is not added back on here because thats done in the transfer function
             coin2_gain = -quantity # NOTE: when you enter a short, COIN2 in the margin account goes - (or subtracts from a previously + value)
             _, trade_message = self.trade(account_type, COIN1, coin1_cost, COIN2, coin2_gain, verbose=verbose, num_indents=num_indents+1)
+            if trade_message == 'Trade Successful.' and account_type == 'margin':
+                self.margin_entered('short', coin1_cost)
             # self.open_positions[account_type].append({
             #     'long_or_short' : 'short',
             #     'coin1_cost'    : coin1_cost,
@@ -975,7 +1020,8 @@ class Strat:
             # })
             self.open_positions_total_coin1_cost += coin1_cost
             
-        self.pprint('Enter Short %s.' % ('Succeeded' if trade_message == 'Trade Successful.' else 'Failed'), num_indents=num_indents)
+        self.pprint('Enter Short %s.', 'Succeeded' if trade_message == 'Trade Successful.' else 'Failed',
+            num_indents=num_indents, level=INFO if verbose else DEBUG)
         return None, trade_message
     def enter_short_limit_order(self,
         account_type,
@@ -985,7 +1031,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Entering Short Limit Order', num_indents=num_indents)
+        self.pprint('Entering Short Limit Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -1005,6 +1051,7 @@ class Strat:
         else:
             order_id = self.get_order_id()
             self.open_orders[order_id] = [account_type, 'short', 'enter', quantity, limit_price, percent]
+            self.open_order_book.add(order_id, OpenOrderBook.side('short', 'enter'), limit_price)
             if verbose: self.pprint('Created enter short open limit order. order_id: %s' % order_id, num_indents=num_indents)
             return order_id, 'Created enter short open limit order'
     def exit_short(self,
@@ -1032,7 +1079,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Exiting Short Market Order', num_indents=num_indents)
+        self.pprint('Exiting Short Market Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -1048,46 +1095,14 @@ class Strat:
                 account_type, COIN2, COIN2, quantity,
                 deduct_tf=False, verbose=verbose, num_indents=num_indents+1)
         
-        # all_open_positions_total_coin1_cost is used later but it needs to go before self.trade
-        # because self.trade changes portfolio COIN1 value
-        all_open_positions_total_coin1_cost = \
-            (self.portfolio[account_type]['collateral'] * MAX_LEVERAGE) - \
-            self.portfolio[account_type][COIN1]
-
+        position = self.margin_balance(COIN2) # before the trade changes it
         coin2_cost = -quantity # NOTE: when you exit a short, COIN2 in the margin account increases (adds to a previously - value)
-        coin1_gain = quantity * self.price
+        coin1_gain = quantity * self.fill_price('buy', quantity)
         order_id, trade_message = self.trade(account_type, COIN2, coin2_cost, COIN1, coin1_gain, verbose=verbose, num_indents=num_indents)
 
-        # update collateral (with portfolio update) <-- this requires tracking open positions coin1 cost (which is required anyway for forced liquidation)
+        # move the realized P/L into the collateral
         if trade_message == 'Trade Successful.' and account_type == 'margin':
-
-            self.portfolio_update[account_type]['collateral'] += (coin1_gain - op['coin1_cost'])
-
-            op_i = 0
-            _coin2_cost = abs(coin2_cost)
-            indeces_of_open_positions_to_close = []
-            index_of_open_position_to_partially_close = None
-            net_original_coin1_cost = 0
-            for op_i, op in enumerate(self.open_positions[account_type]):
-                # _coin2_cost is >, =, or < quantity of op
-                if _coin2_cost >= op['quantity']:
-                    indeces_of_open_positions_to_close.append(op_i)
-                    net_original_coin1_cost += op['coin1_cost']
-                else: # _coin2_cost < op['quantity']
-                    index_of_open_position_to_partially_close = op_i
-                    net_original_coin1_cost += (_coin2_cost - op['quantity'])
-
-            # update collateral
-            _coin1_gain = coin1_gain
-            for op_i in indeces_of_open_positions_to_close:
-                op = self.open_positions[account_type][op_i]
-            self.portfolio_update[account_type]['collateral'] += (coin1_gain - op['coin1_cost'])
-
-            # update partial one
-
-
-            # exit ones to close
-
+            self.margin_exited('short', position, quantity, coin1_gain)
 
         return None, trade_message
     def exit_short_limit_order(self,
@@ -1098,7 +1113,7 @@ class Strat:
         verbose=False,
         num_indents=0):
 
-        self.pprint('Exiting Short Limit Order', num_indents=num_indents)
+        self.pprint('Exiting Short Limit Order', num_indents=num_indents, level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('account_type .......... %s' % account_type, num_indents=num_indents+1)
             self.pprint('percent ............... %s' % percent, num_indents=num_indents+1)
@@ -1118,10 +1133,39 @@ class Strat:
         else:
             order_id = self.get_order_id()
             self.open_orders[order_id] = [account_type, 'short', 'exit', quantity, limit_price, percent]
+            self.open_order_book.add(order_id, OpenOrderBook.side('short', 'exit'), limit_price)
             if verbose: self.pprint('Created exit short open limit order. order_id: %s' % order_id, num_indents=num_indents)
             return order_id, 'Created exit short open limit order'
 
     # order helper functions
+    def fill_price(self, side, quantity):
+
+        # average price a market order of quantity (of COIN2) fills at this time step, side = 'buy' or 'sell'
+        return self.fill_model.fill_price(side, quantity, self.price, self.unix_date)
+    def margin_balance(self, asset):
+
+        # balance of asset in the margin account including the trades made this time step
+        return self.portfolio.balance('margin', asset) + self.portfolio_update['margin'][asset]
+    def margin_entered(self, long_or_short, coin1_value):
+
+        # add what entering the margin position cost (long) or brought in (short), after the trading fee, to its debt
+        tf = TF if INCLUDE_TF else 0
+        self.portfolio_update['margin']['debt_' + COIN1] += \
+            coin1_value * (1 + tf) if long_or_short == 'long' else coin1_value / (1 + tf)
+    def margin_exited(self, long_or_short, position, quantity, coin1_value):
+
+        # position = margin COIN2 balance before the exit, quantity = COIN2 exited, coin1_value = quantity * fill price
+        # the exited part of the debt is paid back from what the exit brought in (long) or cost (short),
+        # the rest is the realized P/L and goes to the collateral
+        if position == 0:
+            return
+        tf = TF if INCLUDE_TF else 0
+        exited_debt = self.margin_balance('debt_' + COIN1) * min(quantity / abs(position), 1.0)
+        realized_pl = \
+            coin1_value / (1 + tf) - exited_debt if long_or_short == 'long' else \
+            exited_debt - coin1_value * (1 + tf)
+        self.portfolio_update['margin']['debt_' + COIN1] -= exited_debt
+        self.portfolio_update['margin']['collateral']    += realized_pl
     def trade(self,
         account_type,
         from_key,
@@ -1145,10 +1189,10 @@ class Strat:
         if verbose: self.pprint('Trading %.6f %s for %.6f %s' % (from_cost, from_key, to_gain, to_key), num_indents=num_indents)
 
         # if they can afford the cost
-        from_account_value = (
-            self.portfolio[account_type][from_key][-1] + \
-            self.portfolio_update[account_type][from_key]) * \
-            (MAX_LEVERAGE if account_type == 'margin' and from_key == COIN1 else 1)
+        # (the margin account's COIN1 balance starts at collateral * MAX_LEVERAGE, so it's already what can be borrowed)
+        from_account_value = \
+            self.portfolio.balance(account_type, from_key) + \
+            self.portfolio_update[account_type][from_key]
         if abs(from_account_value) >= abs(from_cost):
 
             # subtract the cost from their from_account
@@ -1164,15 +1208,7 @@ class Strat:
             if verbose: self.pprint('Cannot afford trade. Own %.6f %s' % (from_account_value, from_key), num_indents=num_indents)
             message = 'Could not afford trade.'
 
-        if message == 'Trade Successful' and account_type == 'margin':
-            if from_key == COIN1: # enter and new debt
-                self.portfolio_update[account_type]['debt'] += from_cost
-
-            elif from_key == COIN2: # exit and update collateral
-                pass # TODO
-                # self.portfolio_update[account_type]['debt'][COIN?] += ?
-                # self.portfolio_update[account_type]['collateral'] += ?
-
+        # the debt and collateral of margin trades are updated by margin_entered() and margin_exited()
         return None, message
     def convert_percent_to_quantity(self,
         account_type,
@@ -1180,11 +1216,14 @@ class Strat:
         to_key,
         percent,
         deduct_tf=True,
+        side=None,
         verbose=False,
         num_indents=0):
 
+        # side = 'buy' or 'sell' if the quantity is for a market order, then COIN1 is converted to COIN2
+        # at the order's fill price (see fill_price()) instead of self.price, so the order costs percent of the supply
         if verbose: self.pprint('converting %.1f %% of %s supply to desired quantity of %s ...' % (100*percent, from_key, to_key), num_indents=num_indents)
-        from_account_value = self.portfolio[account_type][from_key][self.t] + self.portfolio_update[account_type][from_key]
+        from_account_value = self.portfolio.balance(account_type, from_key, self.t) + self.portfolio_update[account_type][from_key]
         
         quantity0 = percent * abs(from_account_value) # convert from percentage to quantity of from_key
         if verbose: self.pprint('%.1f %% of the %.6f %s supply is ......... %.6f %s' % (
@@ -1204,61 +1243,176 @@ class Strat:
             if verbose: self.pprint('quantity of %s (post trading fee) ................ %.6f %s' % (
                 to_key, quantity, to_key), num_indents=num_indents+1)
 
+        # the fill price moves with the quantity, so find the quantity that costs what quantity costs at self.price
+        if side is not None and from_key == COIN1 and self.fill_price(side, quantity) != self.price:
+            quantity = self.quantity_for_cost(side, quantity * self.price)
+            if verbose: self.pprint('quantity of %s (at the fill price) ............... %.6f %s' % (
+                to_key, quantity, to_key), num_indents=num_indents+1)
+
         return quantity
-    def get_order_id(self):
-        i = 0
-        for order_id in self.open_orders.keys():
-            if order_id > i:
-                return i
+    def quantity_for_cost(self, side, coin1_cost, iterations=60):
+
+        # largest quantity of COIN2 a market order on side can trade for at most coin1_cost of COIN1 at its fill price,
+        # solves quantity * fill_price(side, quantity) = coin1_cost by bisection (the cost grows with the quantity)
+        # buys fill at or above self.price so the quantity is at most coin1_cost / self.price, sells at or below it so at least that
+        def cost(quantity):
+            return quantity * self.fill_price(side, quantity)
+        low = high = coin1_cost / self.price
+        if side == 'buy':
+            low = 0.0
+        else:
+            for _ in range(iterations):
+                if cost(high) >= coin1_cost:
+                    break
+                high *= 2
+        for _ in range(iterations):
+            mid = (low + high) / 2
+            if cost(mid) <= coin1_cost:
+                low = mid
             else:
-                i += 1
-        return i
+                high = mid
+        return low
+    def cancel_order(self,
+        order_id,
+        verbose=False,
+        num_indents=0):
 
+        if order_id not in self.open_orders:
+            if verbose: self.pprint('No open order with order_id: %s' % order_id, num_indents=num_indents)
+            return None, 'Invalid order_id'
+        _, long_or_short, enter_or_exit, _, limit_price, _ = self.open_orders.pop(order_id)
+        self.open_order_book.remove(order_id, OpenOrderBook.side(long_or_short, enter_or_exit), limit_price)
+        self.order_ids.free(order_id)
+        if verbose: self.pprint('Canceled open order. order_id: %s' % order_id, num_indents=num_indents)
+        return order_id, 'Canceled open order'
+    def get_order_id(self):
+        return self.order_ids.allocate()
+
+    def fill_open_orders(self,
+        verbose=False,
+        num_indents=0):
+
+        # execute every open limit order that the current price crossed as a market order
+        # returns a list of (order_id, trade_message) of the filled orders, like the market orders return,
+        # trade_message isn't 'Trade Successful.' if the order couldn't be filled (ex: 'Could not afford trade.')
+        filled_orders = []
+        if len(self.open_order_book) == 0:
+            return filled_orders
+        for order_id in self.open_order_book.pop_crossed(self.price):
+            account_type, long_or_short, enter_or_exit, quantity, limit_price, percent = self.open_orders.pop(order_id)
+            self.order_ids.free(order_id)
+            if verbose: self.pprint('Filling %s %s limit order at %.6f %s/%s (limit_price: %.6f). order_id: %s' % (
+                enter_or_exit, long_or_short, self.price, COIN1, COIN2, limit_price, order_id), num_indents=num_indents)
+            market_order = {
+                ('long',  'enter') : self.enter_long_market_order,
+                ('long',  'exit')  : self.exit_long_market_order,
+                ('short', 'enter') : self.enter_short_market_order,
+                ('short', 'exit')  : self.exit_short_market_order
+            }[(long_or_short, enter_or_exit)]
+            _, trade_message = market_order(
+                account_type, quantity, percent=percent,
+                verbose=verbose, num_indents=num_indents+1)
+            if trade_message != 'Trade Successful.':
+                self.pprint('Limit order %s could not be filled: %s', order_id, trade_message,
+                    num_indents=num_indents, level=WARNING)
+            filled_orders.append((order_id, trade_message))
+        return filled_orders
     def execute_net_trades(self,
         verbose=False,
         num_indents=0):
         if verbose: self.pprint('Executing Net Trades of t=%d' % self.t, num_indents=num_indents)
 
         zero_trades = 0
-        for account_type in ['exchange', 'margin']:
-            for asset in ['collateral', COIN1, COIN2]:
-                if account_type == 'exchange' and asset == 'collateral': continue # skip this combo b/c it doesn't exist
-
-                if self.portfolio_update[account_type][asset] != 0:
-                    if verbose: self.pprint('BEFORE: %.6f %s in %s account' % (
-                        self.portfolio[account_type][asset][-1],
-                        asset, account_type), num_indents=num_indents+1)
-
-                    self.portfolio[account_type][asset].append(
-                        self.portfolio[account_type][asset][-1] + \
-                        self.portfolio_update[account_type][asset])
-
-                    if verbose: self.pprint('AFTER:  %.6f %s in %s account' % (
-                        self.portfolio[account_type][asset][-1],
-                        asset, account_type), num_indents=num_indents+1)
-                else:
-                    zero_trades += 1
+        for account_type, asset in self.portfolio.columns:
+            if self.portfolio_update[account_type][asset] != 0:
+                if verbose: self.pprint('BEFORE: %.6f %s in %s account' % (
+                    self.portfolio.balance(account_type, asset),
+                    asset, account_type), num_indents=num_indents+1)
+
+                self.portfolio.update(
+                    self.t, account_type, asset,
+                    self.portfolio_update[account_type][asset])
+
+                if verbose: self.pprint('AFTER:  %.6f %s in %s account' % (
+                    self.portfolio.balance(account_type, asset),
+                    asset, account_type), num_indents=num_indents+1)
+            else:
+                zero_trades += 1
         if verbose: self.pprint('Successful%s.' % (
-            ', no trades to execute' if zero_trades == 4 else ''),
+            ', no trades to execute' if zero_trades == len(self.portfolio.columns) else ''),
             num_indents=num_indents)
 
+        margin_changed = any(self.portfolio_update['margin'][asset] != 0 for asset in self.portfolio_update['margin'])
         self.portfolio_update_reset(
             verbose=verbose,
             num_indents=num_indents)
+        if margin_changed:
+            self.update_liquidation_price(verbose=verbose, num_indents=num_indents)
+    def update_liquidation_price(self,
+        verbose=False, num_indents=0):
+
+        # the liquidation price only changes when the margin account does, so it's computed here (after trades)
+        # and check_for_forced_liquidation() only compares it to the price every time step
+        position = self.portfolio.balance('margin', COIN2)
+        self.liquidation_price = None if position == 0 else liquidation_price(
+            self.portfolio.balance('margin', 'collateral'),
+            self.portfolio.balance('margin', 'debt_' + COIN1),
+            position)
+        if verbose: self.pprint('Liquidation price: %s %s/%s' % (self.liquidation_price, COIN1, COIN2), num_indents=num_indents)
     def check_for_forced_liquidation(self,
         verbose=False, num_indents=0):
-        
-        # if losses are greater than collateral
-            # do a forced liqidation
-        pass
 
+        # if the price crossed the liquidation price, exit the whole margin position at market
+        if self.liquidation_price is None:
+            return
+        position = self.portfolio.balance('margin', COIN2)
+        if (self.price > self.liquidation_price) if position > 0 else (self.price < self.liquidation_price):
+            return
+        self.pprint('Forced liquidation of %.6f %s at %.6f %s/%s (liquidation price: %.6f)',
+            position, COIN2, self.price, COIN1, COIN2, self.liquidation_price,
+            num_indents=num_indents, level=WARNING)
+        exit_market_order = self.exit_long_market_order if position > 0 else self.exit_short_market_order
+        exit_market_order('margin', abs(position), verbose=verbose, num_indents=num_indents+1)
+        self.liquidation_price = None
+    def first_liquidation(self, t=None):
+
+        # first time step after t (default: now) the price crosses the liquidation price of the current margin position
+        # if no more trades are made, found with one vectorized pass over the rest of the prices, None if it never does
+        if self.liquidation_price is None:
+            return None
+        t = self.t if t is None else t
+        prices = self.prices if COLUMNAR_ENGINE else self.df[COIN2].to_numpy(dtype=np.float64)
+        prices = prices[t+1:min(self.num_periods, self.df.shape[0] - 1)+1]
+        crossed = \
+            prices <= self.liquidation_price if self.portfolio.balance('margin', COIN2) > 0 else \
+            prices >= self.liquidation_price
+        i = int(np.argmax(crossed)) if crossed.shape[0] > 0 else 0
+        return t + 1 + i if crossed.shape[0] > 0 and crossed[i] else None
+
+
+# price at which a margin position is force liquidated: where the equity of the margin account
+# (collateral + unrealized P/L) falls to maintenance_margin of the position's value
+#   long  (position > 0):  collateral + position * price - debt     = maintenance_margin * position * price
+#   short (position < 0):  collateral + debt - |position| * price   = maintenance_margin * |position| * price
+# debt = COIN1 value of the position when it was entered, works on arrays too (ex: a whole sweep of accounts at once)
+# maintenance_margin defaults to MAINTENANCE_FRACTION of the initial margin (0.2 at MAX_LEVERAGE = 2),
+# it's read when it's called so a parameter sweep can change MAX_LEVERAGE
+def liquidation_price(collateral, debt, position, maintenance_margin=None):
+    if maintenance_margin is None:
+        maintenance_margin = MAINTENANCE_FRACTION / MAX_LEVERAGE
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(
+            position > 0,
+            (debt - collateral) / (position * (1 - maintenance_margin)),
+            (collateral + debt) / (np.abs(position) * (1 + maintenance_margin)))[()]
 
 
 def run_unittests(verbose=False):
-    open(UNITTEST_LOGFILE_PATH, 'w').close() # clear log
-    test = StratUnitTests()
+    test = StratUnitTests(clear_log=True)
     test.pprint('Running Unit Tests:', num_indents=0)
 
+    test.test_portfolio_ledger(verbose=verbose, num_indents=1)
+
     test.test_enter_long_market_order(verbose=verbose,  num_indents=1)
     test.test_enter_short_market_order(verbose=verbose, num_indents=1)
 
@@ -1275,37 +1429,60 @@ def run_unittests(verbose=False):
 
     test.test_convert_enter_to_exit_opposite(verbose=verbose, num_indents=1)
 
+    test.test_fill_open_orders(verbose=verbose, num_indents=1)
+    test.test_fill_models(verbose=verbose, num_indents=1)
+
     test.test_leverage(verbose=verbose, num_indents=1)
+    test.test_forced_liquidation(verbose=verbose, num_indents=1)
 
     test.pprint('Unit Tests Complete.', num_indents=0)
+    test.logger.flush()
 class StratUnitTests:
 
-    def __init__(self):
+    def __init__(self, clear_log=False):
 
         self.logfile_path = UNITTEST_LOGFILE_PATH
- 
+        self.logger = Logger(
+            logfile_path=self.logfile_path,
+            level=LOG_LEVEL,
+            to_console=OUTPUT_TO_CONSOLE,
+            to_logfile=OUTPUT_TO_LOGFILE,
+            clear_log=clear_log,
+            indent=INDENT,
+            draw_line=DRAW_LINE)
+
     def pprint(self, string='',
+        *args,
         num_indents=0,
         new_line_start=False,
-        new_line_end=False):
-
-        def output(out_loc):
-            indent = len(INDENT)*' ' if out_loc != sys.stdout else INDENT
-            total_indent0 = ''.join([indent] * num_indents)
-            total_indent1 = ''.join([indent] * (num_indents + 1))
-            if new_line_start:
-                print(total_indent1 if DRAW_LINE else total_indent0, file=out_loc)
-            for s in string.split('\n'):
-                print(total_indent0 + s, file=out_loc)
-            if new_line_end:
-                print(total_indent1 if DRAW_LINE else total_indent0, file=out_loc)
-
-        if OUTPUT_TO_CONSOLE:
-            output(sys.stdout)
-        if OUTPUT_TO_LOGFILE:
-            logfile = open(self.logfile_path, 'a')
-            output(logfile)
-            logfile.close()
+        new_line_end=False,
+        level=INFO):
+
+        # args are only formatted into string if level is being logged, see logger.py
+        self.logger.log(level, string, *args,
+            num_indents=num_indents,
+            new_line_start=new_line_start,
+            new_line_end=new_line_end)
+
+    def test_portfolio_ledger(self,
+        verbose=False,
+        num_indents=0):
+
+        self.pprint('Test Portfolio Ledger', num_indents=num_indents)
+
+        if verbose: self.pprint('test balances are forward filled to the last time step', num_indents=num_indents+1)
+        portfolio = PortfolioLedger({('exchange', COIN1) : 100.0, ('exchange', COIN2) : 0.0}, 10)
+        portfolio.update(3, 'exchange', COIN1, -50.0)
+        portfolio.update(3, 'exchange', COIN2, 1.0)
+        assert(portfolio.balance('exchange', COIN1, t=2) == 100.0 and portfolio.balance('exchange', COIN1) == 50.0)
+        portfolio.forward_fill(10)
+        last_row = portfolio.history[-1]
+        assert(last_row[portfolio.fields[('exchange', COIN1)]] == 50.0 and last_row[portfolio.fields[('exchange', COIN2)]] == 1.0)
+        portfolio.forward_fill(15) # past num_periods the history grows
+        assert(portfolio.history.shape[0] > 15 and portfolio.balance('exchange', COIN2, t=15) == 1.0)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        self.pprint('Test Successful.', num_indents=num_indents)
 
     def test_enter_long_market_order(self,
         verbose=False,
@@ -1332,7 +1509,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['exchange'][COIN2][-1] == 1.5)
+        assert(strat.portfolio.balance('exchange', COIN2) == 1.5)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1371,7 +1548,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['exchange'][COIN1][-1] == 25000)
+        assert(strat.portfolio.balance('exchange', COIN1) == 25000)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1418,7 +1595,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == -1.5)
+        assert(strat.portfolio.balance('margin', COIN2) == -1.5)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1457,7 +1634,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN1][-1] == 50000)
+        assert(strat.portfolio.balance('margin', COIN1) == 50000)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1512,7 +1689,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['exchange'][COIN2][-1] == 1.0)
+        assert(strat.portfolio.balance('exchange', COIN2) == 1.0)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1565,7 +1742,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['exchange'][COIN2][-1] == 0.0)
+        assert(strat.portfolio.balance('exchange', COIN2) == 0.0)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1625,7 +1802,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == -1.0)
+        assert(strat.portfolio.balance('margin', COIN2) == -1.0)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1678,7 +1855,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == 0.0)
+        assert(strat.portfolio.balance('margin', COIN2) == 0.0)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         # test insufficient funds
@@ -1824,7 +2001,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
         assert(order_id == None and trade_message == 'Trade Successful.')
-        assert(strat.portfolio['exchange'][COIN2][-1] == 0)
+        assert(strat.portfolio.balance('exchange', COIN2) == 0)
         if verbose: self.pprint('Test Successful.', num_indents=num_indents+1)
 
         if verbose: self.pprint('test limit_price is more than current price (an open order is created)', num_indents=num_indents+1)
@@ -1884,7 +2061,7 @@ class StratUnitTests:
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
         assert(order_id == None and trade_message == 'Trade Successful.')
-        assert(strat.portfolio['exchange'][COIN2][-1] == 0)
+        assert(strat.portfolio.balance('exchange', COIN2) == 0)
         if verbose: self.pprint('Test Successful.', num_indents=num_indents+1)
 
         if verbose: self.pprint('test limit_price is less than current price (an open order is created)', num_indents=num_indents+1)
@@ -1942,7 +2119,7 @@ class StratUnitTests:
             verbose=verbose,
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == 0.5)
+        assert(strat.portfolio.balance('margin', COIN2) == 0.5)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         if verbose: self.pprint('test convert enter long to exit short opposite (new less than old)', num_indents=num_indents+1)
@@ -1966,7 +2143,7 @@ class StratUnitTests:
             verbose=verbose,
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == -0.5)
+        assert(strat.portfolio.balance('margin', COIN2) == -0.5)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
 
@@ -1991,7 +2168,7 @@ class StratUnitTests:
             verbose=verbose,
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == -0.5)
+        assert(strat.portfolio.balance('margin', COIN2) == -0.5)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         if verbose: self.pprint('test convert enter short to exit long opposite (new less than old)', num_indents=num_indents+1)
@@ -2015,7 +2192,147 @@ class StratUnitTests:
             verbose=verbose,
             num_indents=num_indents+2)
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN2][-1] == 0.5)
+        assert(strat.portfolio.balance('margin', COIN2) == 0.5)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        self.pprint('Test Successful.', num_indents=num_indents)
+
+    def test_fill_open_orders(self,
+        verbose=False,
+        num_indents=0):
+
+        self.pprint('Test Fill Open Orders', num_indents=num_indents)
+
+        if verbose: self.pprint('test only the limit orders the price crosses are filled', num_indents=num_indents+1)
+        strat = Strat(
+            backtesting=True,
+            verbose=verbose,
+            num_indents=num_indents+2,
+            logfile_path=self.logfile_path,
+            clear_log=False)
+        current_price = strat.price
+        for limit_price in [0.99, 0.90, 0.50]: # enter long 1.0 COIN2 at 99%, 90% and 50% of the current price
+            strat.enter_long_limit_order(
+                'exchange',
+                1.0,
+                current_price * limit_price,
+                percent=False,
+                verbose=verbose,
+                num_indents=num_indents+2)
+        assert(len(strat.open_orders) == 3)
+        strat.price = current_price * 0.95
+        filled_orders = strat.fill_open_orders(verbose=verbose, num_indents=num_indents+2)
+        strat.execute_net_trades(verbose=verbose, num_indents=num_indents+2)
+        assert(filled_orders == [(0, 'Trade Successful.')])
+        assert(len(strat.open_orders) == 2 and len(strat.open_order_book) == 2)
+        assert(strat.portfolio.balance('exchange', COIN2) == 1.0)
+        strat.price = current_price * 0.80
+        strat.fill_open_orders(verbose=verbose, num_indents=num_indents+2)
+        strat.execute_net_trades(verbose=verbose, num_indents=num_indents+2)
+        assert(len(strat.open_orders) == 1 and strat.open_order_book.best_bid() == current_price * 0.50)
+        assert(strat.portfolio.balance('exchange', COIN2) == 2.0)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        if verbose: self.pprint('test asks fill lowest first and a canceled order is removed from the book', num_indents=num_indents+1)
+        order_ids = {}
+        for limit_price in [1.20, 1.10, 1.30]: # exit long 0.5 COIN2 at 120%, 110% and 130% of the current price
+            order_ids[limit_price], _ = strat.exit_long_limit_order(
+                'exchange',
+                0.5,
+                current_price * limit_price,
+                percent=False,
+                verbose=verbose,
+                num_indents=num_indents+2)
+        assert(strat.open_order_book.best_ask() == current_price * 1.10)
+        strat.cancel_order(order_ids[1.10], verbose=verbose, num_indents=num_indents+2)
+        assert(strat.open_order_book.best_ask() == current_price * 1.20 and len(strat.open_order_book) == 3)
+        strat.price = current_price * 1.25
+        filled_orders = strat.fill_open_orders(verbose=verbose, num_indents=num_indents+2)
+        strat.execute_net_trades(verbose=verbose, num_indents=num_indents+2)
+        assert(filled_orders == [(order_ids[1.20], 'Trade Successful.')] and strat.open_order_book.best_ask() == current_price * 1.30)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        if verbose: self.pprint('test a limit order that can\'t be afforded returns its failure message', num_indents=num_indents+1)
+        order_id, _ = strat.enter_long_limit_order(
+            'exchange',
+            1000.0,
+            current_price * 0.70,
+            percent=False,
+            verbose=verbose,
+            num_indents=num_indents+2)
+        strat.price = current_price * 0.60
+        filled_orders = strat.fill_open_orders(verbose=verbose, num_indents=num_indents+2)
+        strat.execute_net_trades(verbose=verbose, num_indents=num_indents+2)
+        assert((order_id, 'Could not afford trade.') in filled_orders and order_id not in strat.open_orders)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        self.pprint('Test Successful.', num_indents=num_indents)
+
+    def test_fill_models(self,
+        verbose=False,
+        num_indents=0):
+
+        self.pprint('Test Fill Models', num_indents=num_indents)
+
+        if verbose: self.pprint('test ImpactFill slippage grows with quantity', num_indents=num_indents+1)
+        fill_model = ImpactFill(depth=10.0, coefficient=0.01, exponent=0.5, spread=0.001)
+        quantities = np.array([0.0, 0.1, 1.0, 10.0, 100.0])
+        buy_prices  = fill_model.fill_prices('buy',  quantities, np.full(quantities.shape[0], 100.0))
+        sell_prices = fill_model.fill_prices('sell', quantities, np.full(quantities.shape[0], 100.0))
+        assert(np.all(np.diff(buy_prices) > 0) and np.all(np.diff(sell_prices) < 0))
+        assert(abs(buy_prices[3] - 100.0 * (1 + 0.0005 + 0.01)) < 1e-9) # an order of depth slips by coefficient
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        if verbose: self.pprint('test OrderBookFill walks the book to the vwap of the order', num_indents=num_indents+1)
+        book = {
+            'asks' : [[100.0, 1.0, 0], [101.0, 2.0, 0], [103.0, 5.0, 0]], # [price, volume, time]
+            'bids' : [[99.0, 1.0, 0], [98.0, 3.0, 0]]
+        }
+        fill_model = OrderBookFill([(1000, book), (2000, {'order_book' : book})], max_age=60)
+        # buy 2: 1 at 100 and 1 at 101, the slippage from the best ask (100) is applied to the time step's price (200)
+        assert(abs(fill_model.fill_price('buy', 2.0, 200.0, 1000) - 200.0 * (100.5 / 100.0)) < 1e-9)
+        # buy 10: the whole book (8 for 817) and the last 2 at the worst ask
+        assert(abs(fill_model.fill_price('buy', 10.0, 200.0, 1000) - 200.0 * ((817.0 + 2 * 103.0) / 10 / 100.0)) < 1e-9)
+        # sell 2: 1 at 99 and 1 at 98
+        assert(abs(fill_model.fill_price('sell', 2.0, 200.0, 1000) - 200.0 * (98.5 / 99.0)) < 1e-9)
+        unix_dates = np.array([1000, 1030, 2030, 2000])
+        assert(np.allclose(
+            fill_model.fill_prices('buy', np.full(4, 2.0), np.full(4, 200.0), unix_dates),
+            [fill_model.fill_price('buy', 2.0, 200.0, unix_date) for unix_date in unix_dates]))
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        if verbose: self.pprint('test OrderBookFill fills at the price without a recent enough snapshot', num_indents=num_indents+1)
+        assert(fill_model.fill_price('buy', 2.0, 200.0, 500) == 200.0)  # before the first snapshot
+        assert(fill_model.fill_price('buy', 2.0, 200.0, 1100) == 200.0) # 100 seconds after a snapshot, max_age is 60
+        assert(np.array_equal(fill_model.fill_prices('buy', np.full(2, 2.0), np.full(2, 200.0), np.array([500, 1100])), [200.0, 200.0]))
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
+
+        if verbose: self.pprint('test market orders fill at the fill model\'s price', num_indents=num_indents+1)
+        for percent, quantity in [(False, 1.0), (True, 1.0)]:
+            flat_strat, impact_strat = [
+                Strat(
+                    backtesting=True,
+                    verbose=verbose,
+                    num_indents=num_indents+2,
+                    logfile_path=self.logfile_path,
+                    clear_log=False,
+                    fill_model=fill_model)
+                for fill_model in [FlatFill(), ImpactFill(depth=10.0)]]
+            for strat in [flat_strat, impact_strat]:
+                order_id, status = strat.enter_long_market_order(
+                    'exchange',
+                    quantity,
+                    percent=percent,
+                    verbose=verbose,
+                    num_indents=num_indents+2)
+                assert(order_id == None and status == 'Trade Successful.')
+                strat.execute_net_trades(verbose=verbose, num_indents=num_indents+2)
+            if percent: # all in: the whole COIN1 supply is spent either way, the worse fill buys less COIN2
+                assert(impact_strat.portfolio.balance('exchange', COIN2) < flat_strat.portfolio.balance('exchange', COIN2))
+                assert(0 <= impact_strat.portfolio.balance('exchange', COIN1) < 1e-6)
+            else: # the same COIN2 costs more COIN1
+                assert(impact_strat.portfolio.balance('exchange', COIN2) == flat_strat.portfolio.balance('exchange', COIN2))
+                assert(impact_strat.portfolio.balance('exchange', COIN1) < flat_strat.portfolio.balance('exchange', COIN1))
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         self.pprint('Test Successful.', num_indents=num_indents)
@@ -2026,6 +2343,7 @@ class StratUnitTests:
 
         self.pprint('Test Leverage', num_indents=num_indents)
 
+        # the margin account can borrow collateral * MAX_LEVERAGE = 100000 COIN1, percent is a percent of that
         if verbose: self.pprint('test enter more than collateral but less than MAX_LEVERAGE', num_indents=num_indents+1)
         strat = Strat(
             backtesting=True,
@@ -2035,18 +2353,35 @@ class StratUnitTests:
             clear_log=False)
         order_id, status = strat.enter_long_market_order(
             'margin',
-            1.50,
+            0.75, # 1.5 x the collateral
             percent=True,
             verbose=verbose,
             num_indents=num_indents+2)
         assert(order_id == None and status == 'Trade Successful.')
         strat.update(verbose=verbose, num_indents=num_indents+2)
-        assert(strat.portfolio['margin'][COIN1][-1] == 75000)
+        assert(abs(strat.portfolio.balance('margin', COIN1) - 25000) < 1e-6)
+        assert(abs(strat.portfolio.balance('margin', 'debt_' + COIN1) - 75000) < 1e-6)
         if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
-
-
-        # test enter more than MAX_LEVERAGE
+        if verbose: self.pprint('test enter more than MAX_LEVERAGE', num_indents=num_indents+1)
+        strat = Strat(
+            backtesting=True,
+            verbose=verbose,
+            num_indents=num_indents+2,
+            logfile_path=self.logfile_path,
+            clear_log=False)
+        for enter_market_order in [strat.enter_long_market_order, strat.enter_short_market_order]:
+            order_id, status = enter_market_order(
+                'margin',
+                1.50, # 3 x the collateral
+                percent=True,
+                verbose=verbose,
+                num_indents=num_indents+2)
+            assert(order_id == None and status == 'Could not afford trade.')
+        strat.update(verbose=verbose, num_indents=num_indents+2)
+        assert(strat.portfolio.balance('margin', COIN1) == strat.portfolio_init['margin'][COIN1])
+        assert(strat.portfolio.balance('margin', COIN2) == 0.0)
+        if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         self.pprint('Test Successful.', num_indents=num_indents)
 
@@ -2055,8 +2390,43 @@ class StratUnitTests:
         num_indents=0):
 
         self.pprint('Test Forced Liquidation', num_indents=num_indents)
-        
-        # tbd
+
+        for long_or_short in ['long', 'short']:
+            if verbose: self.pprint('test %s margin position is liquidated past the liquidation price' % long_or_short, num_indents=num_indents+1)
+            strat = Strat(
+                backtesting=True,
+                verbose=verbose,
+                num_indents=num_indents+2,
+                logfile_path=self.logfile_path,
+                clear_log=False)
+            enter_market_order = strat.enter_long_market_order if long_or_short == 'long' else strat.enter_short_market_order
+            order_id, status = enter_market_order(
+                'margin',
+                0.75, # 1.5 x the collateral
+                percent=True,
+                verbose=verbose,
+                num_indents=num_indents+2)
+            assert(order_id == None and status == 'Trade Successful.')
+            strat.update(verbose=verbose, num_indents=num_indents+2)
+            liquidation_price = strat.liquidation_price
+            assert(liquidation_price < strat.price if long_or_short == 'long' else liquidation_price > strat.price)
+
+            # the margin account's equity is MAINTENANCE_FRACTION / MAX_LEVERAGE of the position's value at the liquidation price
+            position = strat.portfolio.balance('margin', COIN2)
+            equity = \
+                strat.portfolio.balance('margin', 'collateral') + \
+                position * liquidation_price - \
+                np.sign(position) * strat.portfolio.balance('margin', 'debt_' + COIN1)
+            assert(abs(equity - MAINTENANCE_FRACTION / MAX_LEVERAGE * abs(position) * liquidation_price) < 1e-6)
+
+            # move the price past the liquidation price, the position is exited on the next update
+            strat.t += 1
+            strat.prices = strat.prices.copy() # the price arrays are read only views of strat.df
+            strat.prices[strat.t] = liquidation_price * (0.99 if long_or_short == 'long' else 1.01)
+            strat.update(verbose=verbose, num_indents=num_indents+2)
+            assert(strat.portfolio.balance('margin', COIN2) == 0.0 and strat.liquidation_price == None)
+            assert(strat.portfolio.balance('margin', 'collateral') < strat.portfolio_init['margin']['collateral'])
+            if verbose: self.pprint('test successful.', num_indents=num_indents+1)
 
         self.pprint('Test Successful.', num_indents=num_indents)
 
@@ -0,0 +1,54 @@
+import numpy as np
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        find the next time step a backtest has to update at, so it can jump straight to it
+        instead of visiting every time step while nothing can happen
+
+        something can only happen when the price crosses a level:
+            below - the price falls to or below it (ex: a resting buy limit order, the liquidation price of a long)
+            above - the price rises to or above it (ex: a resting sell limit order, the liquidation price of a short)
+        or at a time step something was scheduled at (ex: the strategy wants to be updated in an hour)
+
+        crossings are found with vectorized comparisons on the price array, scanning forward from t in windows
+        that double in size, so finding the next event costs about as much as the distance to it
+        and a backtest takes time proportional to its number of events, not its number of time steps
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+FIRST_SCAN = 64 # time steps compared in the first window, the windows after it double
+
+#########################################################################################################################
+
+
+# first time step after t, up to and including t_last, where prices[t'] <= below or prices[t'] >= above (None if there isn't one)
+def next_crossing(prices, t, t_last, below=None, above=None, first_scan=FIRST_SCAN):
+    if below is None and above is None:
+        return None
+    start, size = t + 1, first_scan
+    while start <= t_last:
+        end = min(start + size, t_last + 1)
+        window = prices[start:end]
+        crossed = \
+            (window <= below) | (window >= above) if below is not None and above is not None else \
+            window <= below if below is not None else \
+            window >= above
+        i = int(np.argmax(crossed))
+        if crossed[i]:
+            return start + i
+        start, size = end, 2 * size
+    return None
+
+# next time step after t something can happen at: the first crossing of the highest of belows or the lowest of aboves,
+# or the earliest of ts (time steps), whichever comes first, t_last if nothing happens before it (None levels are ignored)
+def next_event(prices, t, t_last, belows=(), aboves=(), ts=()):
+    below = max([level for level in belows if level is not None], default=None)
+    above = min([level for level in aboves if level is not None], default=None)
+    t_next = min([t0 for t0 in ts if t0 is not None and t0 > t] + [t_last])
+    crossing = next_crossing(prices, t, t_next - 1, below=below, above=above)
+    return crossing if crossing is not None else t_next
@@ -2,6 +2,11 @@ import sys
 import os
 import subprocess
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import json
 import time
 import numpy as np
@@ -23,17 +28,63 @@ sys.path.append(ORDERBOOK_DATA_PATH)
 # print('API_KEY_PATH       ', API_KEY_PATH)
 # print('DATA_PATH          ', DATA_PATH)
 # print('ORDERBOOK_DATA_PATH', ORDERBOOK_DATA_PATH)
-
+import indicators
+from order_book import OrderBook
+
+BASE_URL       = 'https://api.kraken.com/0'
+TIMEOUT        = (5, 30) # seconds, (connect timeout, read timeout)
+MAX_RETRIES    = 5
+BACKOFF_FACTOR = 0.5 # seconds, the n-th retry waits about BACKOFF_FACTOR * 2^(n-1)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_SIZE      = 32 # connections kept open, also the number of requests AsyncKraken runs at once
+
+
+
+''' create_session
+	Returns:
+		requests.Session that keeps up to pool_size connections to kraken open and reuses them,
+		failed connections and 429/5xx responses are retried with exponential backoff
+		(the Kraken class only calls public endpoints, so retrying its POSTs is safe)
+	Arguments:
+		pool_size - int - max number of connections kept open
+		max_retries - int - max number of times a request is retried
+	'''
+def create_session(pool_size=POOL_SIZE, max_retries=MAX_RETRIES):
+	retry = Retry(
+		total=max_retries,
+		backoff_factor=BACKOFF_FACTOR,
+		status_forcelist=RETRY_STATUSES,
+		allowed_methods=frozenset(['GET', 'POST']))
+	adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+	session = requests.Session()
+	session.mount(BASE_URL, adapter)
+	return session
 
 
 class Kraken:
 
-	def __init__(self, account_name='account1'):
+	def __init__(self, account_name='account1', timeout=TIMEOUT):
 		info = json.load(open(API_KEY_PATH, 'r'))
 		self.api_key      = info['exchanges']['kraken'][account_name]['api_key']
 		self.private_key  = info['exchanges']['kraken'][account_name]['private_key']
-		self.base_url     = 'https://api.kraken.com/0'
+		self.base_url     = BASE_URL
 		self.account_name = account_name
+		self.timeout      = timeout
+		self.session      = create_session() # every request goes through this session so connections are reused
+
+	def close(self):
+		self.session.close()
+
+	''' public_query
+		Returns:
+			the decoded JSON response of the public API method
+		Arguments:
+			method - string - public API method, ex: 'Trades', 'Depth', 'OHLC'
+			data - dictionary - parameters of the method
+		'''
+	def public_query(self, method, data):
+		response = self.session.post(self.base_url + '/public/' + method, params=data, timeout=self.timeout)
+		return json.loads(response.text)
 
 	''' get_current_price
 		Returns:
@@ -53,12 +104,10 @@ class Kraken:
 			currency_pair - string - format: 'X'+coin1+'Z'+coin2, ex: 'XXBTZUSD'
 		'''
 	def get_recent_trades(self, currency_pair):
-		url = self.base_url + '/public/Trades'
 		data = {
 			'pair' : currency_pair,
 		}
-		response = requests.post(url, params=data)
-		recent_trades = json.loads(response.text)['result'][currency_pair]
+		recent_trades = self.public_query('Trades', data)['result'][currency_pair]
 
 		# sorted from most recent to least recent
 		recent_trades = sorted(recent_trades, key=lambda trade : trade[2], reverse=True)
@@ -76,23 +125,32 @@ class Kraken:
 			save_filename - string - json filepath to append orderbook too, leave as None if you don't want to save it
 		'''
 	def get_current_order_book(self, currency_pair, count=100000):
-		url = self.base_url + '/public/Depth'
 		data = {
 			'pair' : currency_pair
 		}
 		if count != None:
 			data['count'] = count
-		response = requests.post(url, params=data)
-		order_book = json.loads(response.text)['result'][currency_pair]
+		order_book = self.public_query('Depth', data)['result'][currency_pair]
 		return order_book
 
+	''' get_order_book
+		Returns:
+			OrderBook (see order_book.py) of the current order book
+		Arguments:
+			currency_pair - string - format: 'X'+coin1+'Z'+coin2, ex: 'XXBTZUSD'
+			count - int - max number of orders to return
+		'''
+	def get_order_book(self, currency_pair, count=100000):
+		return OrderBook.from_dict(self.get_current_order_book(currency_pair, count=count))
+
 	''' get_orderbook_and_recent_trades
 		Returns:
 			{
-				'order_book' : {
-					"asks" : [[<price>, <volume>, <unix_timestamp>], ...],
-					"bids" : [[<price>, <volume>, <unix_timestamp>], ...]
-				},
+				'order_book' : OrderBook (see order_book.py),
+					saved to the recorder as {
+						"asks" : [[<price>, <volume>, <unix_timestamp>], ...],
+						"bids" : [[<price>, <volume>, <unix_timestamp>], ...]
+					},
 				'recent_trades' : {
 					"start_time" : unix_timestamp,
 					"end_time" : unix_timestamp,
@@ -104,17 +162,17 @@ class Kraken:
 			currency_pair - string - format: 'X'+coin1+'Z'+coin2, ex: 'XXBTZUSD'
 			start_time_dt - datetime object - get all trades that occured between start_time_dt and now
 				if the API fails 
+			recorder - SnapshotRecorder - appends the return value to its log (see snapshot_recorder.py),
+				leave as None if you don't want to save it
 		'''
-	def get_orderbook_and_recent_trades(self, currency_pair, start_minutes_timedelta, filename):
+	def get_orderbook_and_recent_trades(self, currency_pair, start_minutes_timedelta, recorder=None):
 
 		# get orderbook and recent trades data
 		now = datetime.now(timezone.utc)
 		start_time_dt = now - timedelta(minutes=start_minutes_timedelta)
 		start_time_unix = start_time_dt.timestamp()
 		recent_trades = self.get_recent_trades(currency_pair)
-		order_book = self.get_current_order_book(currency_pair)
-		order_book['asks'] = [[float(ask[0]), float(ask[1]), int(ask[2])] for ask in order_book['asks']]
-		order_book['bids'] = [[float(bid[0]), float(bid[1]), int(bid[2])] for bid in order_book['bids']]
+		order_book = self.get_order_book(currency_pair)
 		recent_trades = [t for t in recent_trades if start_time_unix <= t[2]] # filter out trades before start time
 		recent_trades = [[float(t[0]), float(t[1]), float(t[2]), t[3], t[4]] for t in recent_trades] # filter out miscellaneous data and convert numeric data from string to float
 		ret = {
@@ -126,17 +184,9 @@ class Kraken:
 			'current_price'  : recent_trades[0][0]
 		}
 
-		# save data to filename
-		filepath = os.path.join(ORDERBOOK_DATA_PATH, filename)
-		try:
-			f = open(filepath, 'r')
-		except FileNotFoundError:
-			f = open(filepath, 'w+')
-			json.dump({}, f, indent=4)
-			f.close()
-		j = json.load(open(filepath, 'r'))
-		j[now.strftime('%Y/%m/%d %H:%M:%S %z')] = ret
-		json.dump(j, open(filepath, 'w'), indent=4)
+		# append data to the recorder's snapshot log
+		if recorder is not None:
+			recorder.record(dict(ret, order_book=order_book.to_dict()), now.timestamp())
 
 		# return data
 		return ret
@@ -166,14 +216,12 @@ class Kraken:
 		# get the data from the kraken API, and parse the information you actually want
 		# source: https://www.kraken.com/en-us/features/api#get-ohlc-data
 		# raw format: [[<time>, <open>, <high>, <low>, <close>, <vwap>, <volume>, <count>], ...]
-		url = self.base_url + '/public/OHLC'
 		data = {
 			'pair'     : currency_pair,
 			'interval' : interval,
 			'since'    : start_time_dt.timestamp()
 		}
-		response = requests.post(url, params=data)
-		price_data = json.loads(response.text)['result'][currency_pair]
+		price_data = self.public_query('OHLC', data)['result'][currency_pair]
 		price_data = {data[0] : list(map(lambda p : float(p), data[1:])) for data in price_data}
 
 		# kraken's get OHLC API call gets data from start_time to present
@@ -229,6 +277,51 @@ class Kraken:
 
 		return percent_change_data
 
+	''' get_indicators
+		Returns:
+			dictionary of numpy arrays all aligned to 'unix_date' (NaN where the window isn't full yet)
+				'unix_date'                    - unixtime of each price
+				'price'                        - volume_weighted_average_price
+				'pct_chng'                     - percent change from the previous price
+				'stochastic_oscillator_<w>'    - stochastic oscillator of the price window of each w in windows
+				'relative_strength_index_<w>'  - relative strength index of the percent change window of each w in windows
+			computed with the vectorized functions of indicators.py, use this instead of get_price_windows,
+			get_percent_change_windows and indicator_historic (they keep a list of every window in memory)
+		Arguments:
+			price_data - see return of get_price_history
+			windows - list of ints - time window frames to return
+		'''
+	def get_indicators(self, price_data, windows):
+		unix_dates = np.fromiter(price_data.keys(), dtype=np.int64, count=len(price_data))
+		prices     = np.fromiter((data[4] for data in price_data.values()), dtype=np.float64, count=len(price_data)) # use data[4]: volume_weighted_average_price
+		pct_chngs  = indicators.percent_change(prices)
+		ret = {
+			'unix_date' : unix_dates,
+			'price'     : prices,
+			'pct_chng'  : pct_chngs
+		}
+		for w in windows:
+			ret['stochastic_oscillator_%d' % w]   = indicators.stochastic_oscillator(prices, w)
+			ret['relative_strength_index_%d' % w] = indicators.relative_strength_index(pct_chngs, w)
+		return ret
+
+	''' indicator_table
+		Returns:
+			pandas DataFrame
+				index - int - unixtime
+				columns - (indicator, window) - one column for every indicator at every window in windows
+			computed in one pass by indicators.indicator_table, use this instead of calling indicator_historic for each indicator
+		Arguments:
+			price_data - see return of get_price_history
+			indicator_names - list of strings - names of the indicators, see indicators.INDICATORS
+				ex: ['stochastic_oscillator', 'relative_strength_index']
+			windows - list of ints - time window frames to return
+		'''
+	def indicator_table(self, price_data, indicator_names, windows):
+		unix_dates = np.fromiter(price_data.keys(), dtype=np.int64, count=len(price_data))
+		prices     = np.fromiter((data[4] for data in price_data.values()), dtype=np.float64, count=len(price_data)) # use data[4]: volume_weighted_average_price
+		return indicators.indicator_table(prices, indicator_names, windows, index=unix_dates)
+
 	''' get_price_windows
 		Returns:
 			dictionary
@@ -265,7 +358,7 @@ class Kraken:
 			windows - list of ints - time window frames to return
 			verbose - boolean - whether to price the return value to the console or not
 		'''
-	def get_percent_change_windows(self, percent_change_data, window, verbose=False):
+	def get_percent_change_windows(self, percent_change_data, windows, verbose=False):
 		pct_chng_dta = [[dt, data[0]] for dt, data in percent_change_data.items()]
 		percent_change_windows = {w : \
 			{pct_chng_dta[i-1][0] : \
@@ -348,6 +441,91 @@ class Kraken:
 
 
 
+''' AsyncKraken
+
+	asyncio version of the Kraken client with the same methods as coroutines, so the order books and
+	price history of many pairs can be fetched concurrently in one event loop, ex:
+
+		async_kraken = AsyncKraken()
+		order_books = await asyncio.gather(*[
+			async_kraken.get_current_order_book(currency_pair) for currency_pair in currency_pairs])
+
+	the requests are made by the pooled session of a Kraken client in a pool of threads
+	(so there's no extra dependency), up to max_workers requests are in flight at once
+	'''
+class AsyncKraken:
+
+	def __init__(self, account_name='account1', kraken=None, max_workers=POOL_SIZE):
+		self.kraken   = kraken if kraken is not None else Kraken(account_name)
+		self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+	def close(self):
+		self.executor.shutdown(wait=True)
+		self.kraken.close()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, *exc_info):
+		self.close()
+		return False
+
+	# run function of the Kraken client in the thread pool without blocking the event loop
+	async def run(self, function, *args, **kwargs):
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, functools.partial(function, *args, **kwargs))
+
+	async def get_current_price(self, currency_pair):
+		return await self.run(self.kraken.get_current_price, currency_pair)
+
+	async def get_recent_trades(self, currency_pair):
+		return await self.run(self.kraken.get_recent_trades, currency_pair)
+
+	async def get_current_order_book(self, currency_pair, count=100000):
+		return await self.run(self.kraken.get_current_order_book, currency_pair, count=count)
+
+	async def get_order_book(self, currency_pair, count=100000):
+		return await self.run(self.kraken.get_order_book, currency_pair, count=count)
+
+	async def get_orderbook_and_recent_trades(self, currency_pair, start_minutes_timedelta, recorder=None):
+		return await self.run(self.kraken.get_orderbook_and_recent_trades, currency_pair, start_minutes_timedelta, recorder=recorder)
+
+	async def get_price_history(self, currency_pair, start_time_dt, end_time_dt, interval, verbose=False):
+		return await self.run(self.kraken.get_price_history, currency_pair, start_time_dt, end_time_dt, interval, verbose=verbose)
+
+	async def get_percent_change_history(self, currency_pair, start_time_dt, end_time_dt, interval, verbose=False):
+		return await self.run(self.kraken.get_percent_change_history, currency_pair, start_time_dt, end_time_dt, interval, verbose=verbose)
+
+	''' get_current_order_books
+		Returns:
+			dictionary
+				key - string - currency pair
+				value - see return of get_current_order_book
+		Arguments:
+			currency_pairs - list of strings - format: 'X'+coin1+'Z'+coin2, ex: 'XXBTZUSD'
+			count - int - max number of orders to return
+		'''
+	async def get_current_order_books(self, currency_pairs, count=100000):
+		order_books = await asyncio.gather(*[
+			self.get_current_order_book(currency_pair, count=count) for currency_pair in currency_pairs])
+		return dict(zip(currency_pairs, order_books))
+
+	''' get_price_histories
+		Returns:
+			dictionary
+				key - string - currency pair
+				value - see return of get_price_history
+		Arguments:
+			currency_pairs - list of strings - format: 'X'+coin1+'Z'+coin2, ex: 'XXBTZUSD'
+			start_time_dt, end_time_dt, interval - see get_price_history
+		'''
+	async def get_price_histories(self, currency_pairs, start_time_dt, end_time_dt, interval):
+		price_histories = await asyncio.gather(*[
+			self.get_price_history(currency_pair, start_time_dt, end_time_dt, interval) for currency_pair in currency_pairs])
+		return dict(zip(currency_pairs, price_histories))
+
+
+
 
 
 if __name__ == '__main__':
@@ -356,15 +534,17 @@ if __name__ == '__main__':
 
 	coin1, coin2 = 'XBT', 'USD'
 	currency_pair = 'X' + coin1 + 'Z' + coin2 # ex: 'XXBTZEUR'
-	filename = '%s_%s_order_books_and_trades.json' % (coin1, coin2)
+	recorder_name = '%s_%s_order_books_and_trades' % (coin1, coin2)
 
 	# # test get_orderbook_and_recent_trades
+	# from snapshot_recorder import SnapshotRecorder
 	# start_minutes_timedelta = 5
+	# recorder = SnapshotRecorder(ORDERBOOK_DATA_PATH, recorder_name)
 	# ret = kraken.get_orderbook_and_recent_trades(
 	# 		currency_pair,
 	# 		start_minutes_timedelta,
-	# 		filename)
-	# json.dump(ret, sys.stdout, indent=4)
+	# 		recorder=recorder)
+	# print(ret['order_book'].mid_price(), ret['order_book'].spread(), ret['order_book'].imbalance(within=0.01))
 
 
 	# test get_price_history() and get_percent_change_history()
@@ -384,21 +564,8 @@ if __name__ == '__main__':
 		interval,
 		verbose=False)
 
-	# test get_price_windows() and get_percent_change_windows()
+	# test get_indicators() (stochastic oscillator and relative strength index)
 	windows = [10, 100]
-	price_windows = kraken.get_price_windows(
+	indicator_data = kraken.get_indicators(
 		price_data, windows)
-	percent_change_windows = kraken.get_percent_change_windows(
-		percent_change_data, windows, verbose=False)
-
-	# test stochastic_oscillator
-	so = kraken.indicator_historic(
-		price_windows,
-		lambda price_w : kraken.stochastic_oscillator(price_w),
-		verbose=False)
-
-	# test relative_strength_index()
-	rsi = kraken.indicator_historic(
-		percent_change_windows,
-		lambda pct_chng_w : kraken.relative_strength_index(pct_chng_w),
-		verbose=True)
+	print(pd.DataFrame(indicator_data).set_index('unix_date'))
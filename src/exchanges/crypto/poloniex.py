@@ -1,19 +1,80 @@
-from urllib.request import urlopen
-from urllib.parse import urlencode
-import json
+import sys
+import os
 import time
 import hmac, hashlib
+from urllib.parse import urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import pathlib
+SCRIPT_PATH = pathlib.Path(__file__).resolve()
+ROOT_PATH   = SCRIPT_PATH.parent.parent.parent.parent
+SRC_PATH    = os.path.join(ROOT_PATH.absolute(), 'src')
+sys.path.append(SRC_PATH)
+
+from rate_limiter import RateLimiter
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        every request of a Poloniex client goes through one requests.Session, so the TCP and TLS connection
+        to poloniex.com is kept alive and reused instead of being set up again for every call
+
+        the public and trading endpoints share the session, each endpoint has its own token bucket rate limiter,
+        the rate limiters are shared by every Poloniex client in the process (poloniex limits calls per IP)
+
+        failed connections, and public requests that fail with a 429 or 5xx status, are retried with exponential backoff
+        (trading requests aren't retried once they're sent, so an order is never placed twice)
 
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+BASE_URL    = 'https://poloniex.com'
+PUBLIC_URL  = BASE_URL + '/public'
+TRADING_URL = BASE_URL + '/tradingApi'
+TIMEOUT = (5, 30) # seconds, (connect timeout, read timeout)
+MAX_RETRIES = 5
+BACKOFF_FACTOR = 0.5 # seconds, the n-th retry waits about BACKOFF_FACTOR * 2^(n-1)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+POOL_SIZE = 16 # connections kept open (enough for the threads of a chunked download)
+RATE_LIMITS = { # calls per second of each endpoint
+    'public'     : 6,
+    'tradingApi' : 6
+}
+
+#########################################################################################################################
+
+
+rate_limiters = {endpoint : RateLimiter(rate) for endpoint, rate in RATE_LIMITS.items()}
 
 def createTimeStamp(datestr, format="%Y-%m-%d %H:%M:%S"):
     return time.mktime(time.strptime(datestr, format))
 
+def create_session(pool_size=POOL_SIZE, max_retries=MAX_RETRIES):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount(BASE_URL, adapter)
+    return session
+
 
 class Poloniex:
 
-    def __init__(self, APIKey, Secret):
+    def __init__(self, APIKey, Secret, timeout=TIMEOUT):
         self.APIKey = APIKey
         self.Secret = Secret
+        self.timeout = timeout
+        self.session = create_session()
+
+    def close(self):
+        self.session.close()
 
     def post_process(self, before):
         after = before
@@ -21,45 +82,56 @@ class Poloniex:
         # Add timestamps if there isnt one but is a datetime
         if('return' in after):
             if(isinstance(after['return'], list)):
-                for x in xrange(0, len(after['return'])):
+                for x in range(0, len(after['return'])):
                     if(isinstance(after['return'][x], dict)):
                         if('datetime' in after['return'][x] and 'timestamp' not in after['return'][x]):
                             after['return'][x]['timestamp'] = float(createTimeStamp(after['return'][x]['datetime']))
 
         return after
 
+    def public_query(self, params):
+        rate_limiters['public'].acquire()
+        ret = self.session.get(PUBLIC_URL, params=params, timeout=self.timeout)
+        ret.raise_for_status()
+        return ret.json()
+
     def api_query(self, command, req={}):
 
         if (command == "returnTicker" or command == "return24Volume"):
-            ret = urlopen('https://poloniex.com/public?command=' + command)
-            return json.loads(ret.read())
+            return self.public_query({'command': command})
 
         elif(command == "returnOrderBook"):
-            ret = urlopen('https://poloniex.com/public?command=' + command + '&currencyPair=' + str(req['currencyPair']))
-            return json.loads(ret.read())
+            return self.public_query({'command': command, 'currencyPair': str(req['currencyPair'])})
 
         elif(command == "returnMarketTradeHistory"):
-            ret = urlopen('https://poloniex.com/public?command=' + "returnTradeHistory" + '&currencyPair=' + str(req['currencyPair']))
-            return json.loads(ret.read())
+            return self.public_query({'command': "returnTradeHistory", 'currencyPair': str(req['currencyPair'])})
 
         elif(command == "returnChartData"):
-            ret = urlopen('https://poloniex.com/public?command=returnChartData&currencyPair=' + str(req['currencyPair']) + '&start=' + str(req['start']) + '&end=' + str(req['end']) + '&period=' + str(req['period']))
-            return json.loads(ret.read())
+            return self.public_query({
+                'command': command,
+                'currencyPair': str(req['currencyPair']),
+                'start': req['start'],
+                'end': req['end'],
+                'period': req['period']
+            })
 
         else:
+            req = dict(req)
             req['command'] = command
             req['nonce'] = int(time.time()*1000)
             post_data = urlencode(req)
 
-            sign = hmac.new(self.Secret, post_data, hashlib.sha512).hexdigest()
+            sign = hmac.new(self.Secret.encode('utf-8'), post_data.encode('utf-8'), hashlib.sha512).hexdigest()
             headers = {
                 'Sign': sign,
-                'Key': self.APIKey
+                'Key': self.APIKey,
+                'Content-Type': 'application/x-www-form-urlencoded'
             }
 
-            ret = urlopen('https://poloniex.com/tradingApi', post_data, headers)
-            jsonRet = json.loads(ret.read())
-            return self.post_process(jsonRet)
+            rate_limiters['tradingApi'].acquire()
+            ret = self.session.post(TRADING_URL, data=post_data, headers=headers, timeout=self.timeout)
+            ret.raise_for_status()
+            return self.post_process(ret.json())
 
     def returnTicker(self):
         return self.api_query("returnTicker")
@@ -0,0 +1,121 @@
+import bisect
+import numpy as np
+
+from order_book import OrderBook
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        fill models decide what price a market order of a quantity fills at in a backtest,
+        so the size of an order moves its price like it would on the exchange
+
+        every fill model has:
+            fill_price(side, quantity, price, unix_date) - returns the average price a market order fills at
+                side      - 'buy' or 'sell' (enter long and exit short buy, exit long and enter short sell)
+                quantity  - quantity of COIN2 in the order, a float or an array of them
+                price     - price of the time step (ex: the close), what the order would fill at if it didn't move the book
+                unix_date - unix_date of the time step
+            fill_prices(side, quantities, prices, unix_dates) - fill_price of many time steps at once, arrays of the same length
+
+        FlatFill       - fills everything at price (no slippage), what the backtester did before
+        ImpactFill     - parametric market impact: slippage = coefficient * (quantity / depth) ^ exponent
+                         (exponent 0.5 is the square root law), plus half the spread
+        OrderBookFill  - walks the recorded order book snapshot at (or right before) unix_date (see snapshot_recorder.py),
+                         the slippage of the order on that book is applied to price
+
+        slippage is relative: the book or curve says how much worse than the best price the order fills,
+        and price is moved by that fraction, so the fill lines up with the backtest's price data
+        even when the snapshots were recorded on another exchange or aren't exactly at the time step
+
+    '''
+
+
+class FlatFill:
+
+    def fill_price(self, side, quantity, price, unix_date=None):
+        return price
+
+    def fill_prices(self, side, quantities, prices, unix_dates=None):
+        return np.asarray(prices, dtype=np.float64)
+
+class ImpactFill:
+
+    def __init__(self, depth, coefficient=0.01, exponent=0.5, spread=0.0):
+        self.depth = depth             # quantity of COIN2 that moves the price by coefficient
+        self.coefficient = coefficient # slippage (fraction of price) of an order of depth
+        self.exponent = exponent       # how fast slippage grows with quantity
+        self.spread = spread           # bid-ask spread (fraction of price), half of it is paid on every order
+
+    def slippage(self, quantity):
+        return self.spread / 2.0 + self.coefficient * (np.abs(quantity) / self.depth) ** self.exponent
+
+    def fill_price(self, side, quantity, price, unix_date=None):
+        slippage = self.slippage(quantity)
+        return price * (1.0 + slippage if side == 'buy' else 1.0 - slippage)
+
+    def fill_prices(self, side, quantities, prices, unix_dates=None):
+        return self.fill_price(side, np.asarray(quantities, dtype=np.float64), np.asarray(prices, dtype=np.float64))
+
+class OrderBookFill:
+
+    def __init__(self, snapshots, max_age=None):
+
+        # snapshots = list of (unix_time, snapshot) sorted by time, ex: SnapshotRecorder.read()
+        # snapshot = an order book ({'asks' : ..., 'bids' : ...}) or a dict with one in 'order_book'
+        # like the snapshots Kraken.get_orderbook_and_recent_trades records
+        self.times = np.array([unix_time for unix_time, _ in snapshots], dtype=np.float64)
+        self.snapshots = [snapshot.get('order_book', snapshot) for _, snapshot in snapshots]
+        self.books = {} # key = index of snapshot, value = OrderBook, parsed the first time it's used
+        self.max_age = max_age # seconds, snapshots older than this at unix_date aren't used (the order fills at price)
+
+    @classmethod
+    def from_recorder(cls, recorder, start_unix=None, end_unix=None, max_age=None):
+        return cls(recorder.read(start_unix, end_unix), max_age=max_age)
+
+    # index of the snapshot recorded last at or before unix_date, None if there isn't one (or it's older than max_age)
+    def snapshot_index(self, unix_date):
+        i = bisect.bisect_right(self.times, unix_date) - 1
+        if i < 0 or (self.max_age is not None and unix_date - self.times[i] > self.max_age):
+            return None
+        return i
+
+    def book(self, i):
+        if i not in self.books:
+            self.books[i] = OrderBook.from_dict(self.snapshots[i])
+        return self.books[i]
+
+    def fill_price(self, side, quantity, price, unix_date):
+        i = self.snapshot_index(unix_date)
+        if i is None:
+            return price
+        return price * (1.0 + book_slippage(self.book(i), side, quantity))
+
+    def fill_prices(self, side, quantities, prices, unix_dates):
+
+        # the time steps are grouped by snapshot so every book is walked once, for all its quantities at once
+        quantities = np.asarray(quantities, dtype=np.float64)
+        fill_prices = np.array(prices, dtype=np.float64)
+        snapshot_indexes = np.searchsorted(self.times, unix_dates, side='right') - 1
+        if self.max_age is not None:
+            too_old = np.asarray(unix_dates) - self.times[np.maximum(snapshot_indexes, 0)] > self.max_age
+            snapshot_indexes[too_old] = -1
+        for i in np.unique(snapshot_indexes[snapshot_indexes >= 0]):
+            time_steps = snapshot_indexes == i
+            fill_prices[time_steps] *= 1.0 + book_slippage(self.book(i), side, quantities[time_steps])
+        return fill_prices
+
+# slippage of a market order of quantity on book, signed so price * (1 + slippage) is the fill price
+# an order bigger than the whole book fills the rest at the worst price in the book
+def book_slippage(book, side, quantity):
+    prices, cum_volumes, cum_notionals = book.side(side)
+    if prices.shape[0] == 0:
+        return np.zeros_like(quantity, dtype=np.float64)[()]
+    quantity = np.asarray(quantity, dtype=np.float64)
+    vwap = book.vwap(side, quantity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rest = (cum_notionals[-1] + (quantity - cum_volumes[-1]) * prices[-1]) / quantity
+        vwap = np.where(quantity > cum_volumes[-1], rest, vwap)
+        slippage = np.where(quantity > 0, vwap / prices[0] - 1.0, 0.0)
+    return slippage[()]
@@ -0,0 +1,337 @@
+import os
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+from price_store import PriceStore, INDEX_COLUMN
+from history_downloader import download_history, poloniex_chart_data, DEFAULT_MAX_WORKERS
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        cache of exchange price history in front of the price store, keyed by (exchange, pair, period)
+
+        the price data of each exchange is kept in the PriceStore at <root_path>/<exchange>/price_store
+        next to the columns of each (pair, period) is a coverage.json file, the sorted list of
+        [first_unix_date, last_unix_date] ranges that have already been fetched from the exchange
+        (a range is covered even if the exchange had no prices in it, so it isn't asked for again)
+
+        when a range is requested only the gaps in the coverage are fetched, they are merged into the store
+        and the coverage is updated, so refreshing a range that is mostly stored takes a request or two
+
+        update_pairs() updates many pairs of an exchange at the same time (ex: every coin of a multi coin backtest)
+
+        time ranges are lined up on the period (unix_date of every bar is a multiple of period),
+        the most recent bar isn't marked as covered until it has closed
+
+        a source is what fetches price history from one exchange, see PoloniexHistory and KrakenHistory:
+            source.exchange - string - name of the exchange, the directory its data is stored in
+            source.fills_whole_range - bool - True if fetch returns every bar of the range it is asked for,
+                False if it can return less (ex: kraken only has the most recent 720 bars),
+                then only the range from the first bar returned is marked as covered
+            source.fetch(pair, period, start_unix, end_unix, verbose) - returns a DataFrame with columns: unix_date, datetime, close
+
+    USAGE
+
+        python history_cache.py    # runs the unit tests
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+STORE_DIRNAME = 'price_store'
+COVERAGE_FILENAME = 'coverage.json'
+
+#########################################################################################################################
+
+
+class PoloniexHistory:
+
+    exchange = 'poloniex'
+    fills_whole_range = True
+
+    def __init__(self, conn, rate_limiter=None, max_workers=DEFAULT_MAX_WORKERS):
+        self.conn = conn
+        self.rate_limiter = rate_limiter
+        self.max_workers = max_workers
+
+    def fetch(self, pair, period, start_unix, end_unix, verbose=False):
+        return download_history(
+            poloniex_chart_data(self.conn, pair, period),
+            start_unix,
+            end_unix,
+            period,
+            max_workers=self.max_workers,
+            rate_limiter=self.rate_limiter,
+            verbose=verbose)
+
+class KrakenHistory:
+
+    exchange = 'kraken'
+    fills_whole_range = False
+
+    def __init__(self, kraken):
+        self.kraken = kraken
+
+    def fetch(self, pair, period, start_unix, end_unix, verbose=False):
+
+        # price_data = dict, key = unix_date, value = [open, high, low, close, vwap, volume, count]
+        price_data = self.kraken.get_price_history(
+            pair,
+            datetime.fromtimestamp(start_unix, timezone.utc),
+            datetime.fromtimestamp(end_unix,   timezone.utc),
+            period // 60)
+        unix_dates = [int(unix_date) for unix_date in price_data.keys() if start_unix <= unix_date]
+        df = pd.DataFrame({
+            INDEX_COLUMN : unix_dates,
+            'close'      : [price_data[unix_date][3] for unix_date in unix_dates]
+        })
+        df.insert(1, 'datetime', df[INDEX_COLUMN].map(datetime.fromtimestamp))
+        return df
+
+
+class HistoryCache:
+
+    def __init__(self, root_path, sources=()):
+        self.root_path = root_path
+        self.sources = {} # key = exchange, value = source
+        for source in sources:
+            self.add_source(source)
+
+    def add_source(self, source):
+        self.sources[source.exchange] = source
+
+    def price_store(self, exchange):
+        return PriceStore(os.path.join(self.root_path, exchange, STORE_DIRNAME))
+
+    def coverage_path(self, exchange, pair, period):
+        return os.path.join(self.price_store(exchange).path(pair, period), COVERAGE_FILENAME)
+
+    # returns the sorted list of [first_unix_date, last_unix_date] ranges fetched so far
+    def coverage(self, exchange, pair, period):
+        coverage_path = self.coverage_path(exchange, pair, period)
+        if os.path.isfile(coverage_path):
+            return json.load(open(coverage_path, 'r'))
+
+        # data put in the store without the cache (ex: an imported CSV file) counts as covered from its first to last bar
+        time_range = self.price_store(exchange).time_range(pair, period)
+        return [list(time_range)] if time_range is not None else []
+
+    def save_coverage(self, exchange, pair, period, coverage):
+        coverage_path = self.coverage_path(exchange, pair, period)
+        os.makedirs(os.path.dirname(coverage_path), exist_ok=True)
+        with open(coverage_path + '.tmp', 'w') as f:
+            json.dump(coverage, f)
+        os.replace(coverage_path + '.tmp', coverage_path)
+
+    # returns the list of [gap_start_unix, gap_end_unix] ranges from start_unix to end_unix that aren't covered yet
+    def gaps(self, exchange, pair, period, start_unix, end_unix):
+        gap_start = int(np.ceil(start_unix / period)) * period
+        end_unix  = int(end_unix // period) * period
+        gaps = []
+        for covered_start, covered_end in self.coverage(exchange, pair, period):
+            if covered_end < gap_start:
+                continue
+            if covered_start > end_unix:
+                break
+            if gap_start <= covered_start - period:
+                gaps.append([gap_start, covered_start - period])
+            gap_start = covered_end + period
+        if gap_start <= end_unix:
+            gaps.append([gap_start, end_unix])
+        return gaps
+
+    # fetch the gaps from start_unix to end_unix from the exchange and merge them into the store
+    # returns the list of gaps that were fetched
+    def update(self, exchange, pair, period, start_unix, end_unix, verbose=False):
+
+        gaps = self.gaps(exchange, pair, period, start_unix, end_unix)
+        if len(gaps) == 0:
+            return gaps
+        source = self.sources[exchange]
+        price_store = self.price_store(exchange)
+        coverage = self.coverage(exchange, pair, period)
+        last_closed_bar = int(time.time() // period) * period - period
+        for gap_start, gap_end in gaps:
+            if verbose: print('fetching %s %s %d s bars: %s to %s' % (
+                exchange, pair, period,
+                datetime.fromtimestamp(gap_start),
+                datetime.fromtimestamp(gap_end)))
+            df = source.fetch(pair, period, gap_start, gap_end, verbose=verbose)
+            if df.shape[0] > 0:
+                price_store.merge(pair, period, df[[INDEX_COLUMN, 'datetime', 'close']])
+            if not source.fills_whole_range:
+                if df.shape[0] == 0:
+                    continue
+                gap_start = max(gap_start, int(df[INDEX_COLUMN].min()))
+            gap_end = min(gap_end, last_closed_bar)
+            if gap_start <= gap_end:
+                coverage.append([gap_start, gap_end])
+        self.save_coverage(exchange, pair, period, merge_ranges(coverage, period))
+        return gaps
+
+    # update() every pair in pairs at the same time, one thread per pair (each pair is in its own files)
+    # the exchange's rate limit is kept by the source's client (ex: poloniex.rate_limiters is shared by every Poloniex)
+    # returns a dict, key = pair, value = list of gaps that were fetched
+    def update_pairs(self, exchange, pairs, period, start_unix, end_unix, max_workers=DEFAULT_MAX_WORKERS, verbose=False):
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs)))) as executor:
+            gaps = executor.map(lambda pair : self.update(exchange, pair, period, start_unix, end_unix, verbose=verbose), pairs)
+            return dict(zip(pairs, gaps))
+
+    # returns a DataFrame with columns [unix_date, datetime, <price_column>] of pair at period
+    # from start_time_dt to end_time_dt, fetching whatever part of it isn't stored yet
+    def load_prices(self,
+        exchange,
+        pair,
+        period,
+        price_column,
+        start_time_dt,
+        end_time_dt,
+        verbose=False):
+
+        self.update(exchange, pair, period, start_time_dt.timestamp(), end_time_dt.timestamp(), verbose=verbose)
+        price_store = self.price_store(exchange)
+        if not price_store.exists(pair, period):
+            return pd.DataFrame({INDEX_COLUMN : [], 'datetime' : [], price_column : []})
+        return price_store.load_prices(pair, period, price_column, start_time_dt, end_time_dt)
+
+# combine overlapping and touching [start, end] ranges (ranges one period apart touch)
+def merge_ranges(ranges, period):
+    merged = []
+    for start, end in sorted(ranges):
+        if len(merged) > 0 and start <= merged[-1][1] + period:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+
+# stands in for an exchange in the unit tests: fetch returns a bar for every multiple of period from start_unix
+# (or first_unix if it's later, like kraken's limited history) to end_unix with close = unix_date / period
+class FakeHistory:
+
+    exchange = 'fake'
+
+    def __init__(self, fills_whole_range=True, first_unix=None):
+        self.fills_whole_range = fills_whole_range
+        self.first_unix = first_unix
+        self.calls = [] # (start_unix, end_unix) of every fetch
+
+    def fetch(self, pair, period, start_unix, end_unix, verbose=False):
+        self.calls.append((start_unix, end_unix))
+        if self.first_unix is not None:
+            start_unix = max(start_unix, self.first_unix)
+        unix_dates = np.arange(start_unix, end_unix + 1, period, dtype=np.int64)
+        return pd.DataFrame({
+            INDEX_COLUMN : unix_dates,
+            'datetime'   : pd.to_datetime(unix_dates, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+            'close'      : unix_dates / period
+        })
+
+def test_merge_ranges(verbose=False):
+    period = 300
+    assert(merge_ranges([], period) == [])
+    assert(merge_ranges([[0, 600], [300, 900]], period) == [[0, 900]])                # overlapping
+    assert(merge_ranges([[600, 900], [0, 300]], period) == [[0, 900]])                # touching (one period apart), unsorted
+    assert(merge_ranges([[0, 900], [300, 600]], period) == [[0, 900]])                # one inside the other
+    assert(merge_ranges([[0, 300], [900, 1200]], period) == [[0, 300], [900, 1200]])  # a bar missing between them
+    assert(merge_ranges([[0, 0], [300, 300], [600, 600]], period) == [[0, 600]])      # single bars
+    if verbose: print('test_merge_ranges successful.')
+
+def test_gaps(verbose=False):
+    period, t0 = 300, 1574294400
+    with tempfile.TemporaryDirectory() as root_path:
+        cache = HistoryCache(root_path)
+        assert(cache.gaps('fake', 'USDT_BTC', period, t0, t0 + 10 * period) == [[t0, t0 + 10 * period]])
+
+        # covered: bars 10 to 20 and 30 to 40
+        cache.save_coverage('fake', 'USDT_BTC', period, [[t0 + 10 * period, t0 + 20 * period], [t0 + 30 * period, t0 + 40 * period]])
+        def gaps(first_bar, last_bar):
+            return [[(start - t0) // period, (end - t0) // period]
+                for start, end in cache.gaps('fake', 'USDT_BTC', period, t0 + first_bar * period, t0 + last_bar * period)]
+        assert(gaps(0, 50)  == [[0, 9], [21, 29], [41, 50]]) # gaps before, between and after the covered ranges
+        assert(gaps(10, 40) == [[21, 29]])                   # the edges of the request are covered
+        assert(gaps(12, 18) == [])                           # inside a covered range
+        assert(gaps(15, 35) == [[21, 29]])
+        assert(gaps(9, 41)  == [[9, 9], [21, 29], [41, 41]]) # one bar gaps at the edges
+        assert(gaps(45, 50) == [[45, 50]])                   # past the coverage
+        assert(gaps(0, 5)   == [[0, 5]])                     # before the coverage
+
+        # the request is lined up on the period, bars strictly inside it
+        assert(cache.gaps('fake', 'USDT_BTC', period, t0 + 1, t0 + 10 * period - 1) == [[t0 + period, t0 + 9 * period]])
+    if verbose: print('test_gaps successful.')
+
+def test_update(verbose=False):
+    period, t0 = 300, 1574294400
+    with tempfile.TemporaryDirectory() as root_path:
+        source = FakeHistory()
+        cache = HistoryCache(root_path, sources=[source])
+
+        # an empty cache fetches the whole range
+        assert(cache.update('fake', 'USDT_BTC', period, t0 + 10 * period, t0 + 20 * period) == [[t0 + 10 * period, t0 + 20 * period]])
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [[t0 + 10 * period, t0 + 20 * period]])
+
+        # a wider range only fetches the gaps at its edges, the coverage becomes one range
+        cache.update('fake', 'USDT_BTC', period, t0, t0 + 30 * period)
+        assert(source.calls[1:] == [(t0, t0 + 9 * period), (t0 + 21 * period, t0 + 30 * period)])
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [[t0, t0 + 30 * period]])
+        df = cache.price_store('fake').load('USDT_BTC', period)
+        assert(df[INDEX_COLUMN].tolist() == (t0 + period * np.arange(31)).tolist())
+        assert(np.allclose(df['close'].to_numpy(), df[INDEX_COLUMN].to_numpy() / period))
+
+        # a new cache on the same directory reloads the coverage from coverage.json and fetches nothing
+        source = FakeHistory()
+        cache = HistoryCache(root_path, sources=[source])
+        assert(cache.update('fake', 'USDT_BTC', period, t0, t0 + 30 * period) == [])
+        assert(source.calls == [])
+
+        # a stale coverage.json (data added to the store without the cache) is what gaps are read from
+        cache.price_store('fake').merge('USDT_BTC', period, source.fetch('USDT_BTC', period, t0 + 31 * period, t0 + 40 * period))
+        source.calls = []
+        assert(cache.update('fake', 'USDT_BTC', period, t0, t0 + 40 * period) == [[t0 + 31 * period, t0 + 40 * period]])
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [[t0, t0 + 40 * period]])
+
+        # without coverage.json the store's first to last bar counts as covered
+        os.remove(cache.coverage_path('fake', 'USDT_BTC', period))
+        cache.price_store('fake').merge('USDT_BTC', period, source.fetch('USDT_BTC', period, t0 + 41 * period, t0 + 50 * period))
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [[t0, t0 + 50 * period]])
+        assert(cache.gaps('fake', 'USDT_BTC', period, t0, t0 + 60 * period) == [[t0 + 51 * period, t0 + 60 * period]])
+    if verbose: print('test_update successful.')
+
+    with tempfile.TemporaryDirectory() as root_path:
+
+        # a source that only has history from bar 20 on: only what it returned is covered, an empty fetch covers nothing
+        source = FakeHistory(fills_whole_range=False, first_unix=t0 + 20 * period)
+        cache = HistoryCache(root_path, sources=[source])
+        cache.update('fake', 'USDT_BTC', period, t0, t0 + 10 * period)
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [])
+        cache.update('fake', 'USDT_BTC', period, t0, t0 + 30 * period)
+        assert(cache.coverage('fake', 'USDT_BTC', period) == [[t0 + 20 * period, t0 + 30 * period]])
+
+        # the bar that hasn't closed yet isn't covered, so it's fetched again next time
+        source = FakeHistory()
+        cache = HistoryCache(root_path, sources=[source])
+        last_closed_bar = int(time.time() // period) * period - period
+        cache.update('fake', 'USDT_ETH', period, last_closed_bar - 10 * period, last_closed_bar + 3 * period)
+        assert(cache.coverage('fake', 'USDT_ETH', period) == [[last_closed_bar - 10 * period, last_closed_bar]]
+            or time.time() >= last_closed_bar + 2 * period) # the clock reached the next bar during the test
+        assert(cache.gaps('fake', 'USDT_ETH', period, last_closed_bar - 10 * period, last_closed_bar + 3 * period) != [])
+    if verbose: print('test_update partial sources successful.')
+
+def run_unittests(verbose=False):
+    test_merge_ranges(verbose=verbose)
+    test_gaps(verbose=verbose)
+    test_update(verbose=verbose)
+    if verbose: print('Unit Tests Complete.')
+
+
+
+if __name__ == '__main__':
+    run_unittests(verbose=True)
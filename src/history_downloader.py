@@ -0,0 +1,196 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from rate_limiter import RateLimiter
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        download a long range of price history in chunks, fetching the chunks concurrently
+
+        the range is split into chunks of periods_per_chunk time steps, a pool of threads fetches them
+        (all threads share one RateLimiter, if one is given, so the exchange's API limit is kept), the chunks
+        are collected in a list and concatenated once at the end, then duplicate unix_dates (where chunks overlap) are dropped
+
+        the Poloniex client keeps to Poloniex's rate limit itself, pass a rate_limiter for clients that don't
+
+        fetch_chunk(chunk_start_unix, chunk_end_unix) is what gets one chunk, it returns a DataFrame
+        with a unix_date column (ex: the one made by poloniex_chart_data())
+
+    USAGE
+
+        python history_downloader.py    # runs the unit tests
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+DEFAULT_PERIODS_PER_CHUNK = 10000 # time steps requested per API call
+DEFAULT_MAX_WORKERS = 8           # threads fetching chunks at the same time
+
+#########################################################################################################################
+
+
+# split start_unix to end_unix into a list of (chunk_start_unix, chunk_end_unix)
+def chunk_ranges(start_unix, end_unix, period, periods_per_chunk=DEFAULT_PERIODS_PER_CHUNK):
+    chunk_duration = period * periods_per_chunk
+    ranges = []
+    chunk_start_unix = start_unix
+    while chunk_start_unix < end_unix:
+        chunk_end_unix = min(chunk_start_unix + chunk_duration, end_unix)
+        ranges.append((chunk_start_unix, chunk_end_unix))
+        chunk_start_unix = chunk_end_unix
+    return ranges
+
+# returns a DataFrame of everything fetch_chunk returned from start_unix to end_unix, sorted by unix_date
+def download_history(
+    fetch_chunk,
+    start_unix,
+    end_unix,
+    period,
+    periods_per_chunk=DEFAULT_PERIODS_PER_CHUNK,
+    max_workers=DEFAULT_MAX_WORKERS,
+    rate_limiter=None,
+    verbose=False):
+
+    ranges = chunk_ranges(start_unix, end_unix, period, periods_per_chunk)
+    if len(ranges) == 0:
+        return pd.DataFrame({'unix_date' : []})
+
+    def fetch(chunk_range):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        return fetch_chunk(*chunk_range)
+
+    chunks = []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+        for chunk_index, (chunk_range, chunk) in enumerate(zip(ranges, executor.map(fetch, ranges))):
+            chunks.append(chunk)
+            if verbose: print('chunk %d of %d:\t%s to %s\t%d rows' % (
+                chunk_index + 1, len(ranges),
+                datetime.fromtimestamp(chunk_range[0]),
+                datetime.fromtimestamp(chunk_range[1]),
+                chunk.shape[0]))
+
+    df = pd.concat(chunks, ignore_index=True)
+    df.drop_duplicates(subset='unix_date', keep='last', inplace=True)
+    df.sort_values('unix_date', inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    if verbose: print('total rows (aka periods) collected: %d' % df.shape[0])
+    return df
+
+# returns a fetch_chunk function that gets the close prices of pair from Poloniex's returnChartData
+# as a DataFrame with columns: unix_date, datetime, <price_column>
+def poloniex_chart_data(conn, pair, period, price_column='close'):
+
+    def fetch_chunk(chunk_start_unix, chunk_end_unix):
+        prices = conn.api_query('returnChartData', {
+                'currencyPair': pair,
+                'start': chunk_start_unix,
+                'end': chunk_end_unix,
+                'period': period
+            })
+        if isinstance(prices, dict) and 'error' in prices:
+            raise RuntimeError('Poloniex returnChartData failed for %s: %s' % (pair, prices['error']))
+
+        # poloniex returns one row with date 0 if there's no data in the range
+        prices = [price_data for price_data in prices if price_data['date'] != 0]
+        df = pd.DataFrame({
+            'unix_date'  : [price_data['date']  for price_data in prices],
+            price_column : [price_data['close'] for price_data in prices]
+        })
+        df.insert(1, 'datetime', df['unix_date'].map(datetime.fromtimestamp))
+        return df
+
+    return fetch_chunk
+
+
+
+# stands in for the Poloniex client in the unit tests: returnChartData returns a bar for every multiple of period
+# from start to end (both included, like Poloniex, so chunks that touch overlap by one bar) with close = unix_date / period,
+# the first chunks asked for take the longest, so the chunks finish in the reverse order they were asked for
+class FakeChartClient:
+
+    def __init__(self, first_unix, delay=0.0, response=None):
+        self.first_unix = first_unix
+        self.delay = delay
+        self.response = response # returned instead of the bars if it isn't None
+        self.calls = []          # (start, end) of every returnChartData call
+        self.lock = threading.Lock()
+
+    def api_query(self, command, req):
+        with self.lock:
+            self.calls.append((req['start'], req['end']))
+        time.sleep(self.delay * max(0, 1 - (req['start'] - self.first_unix) / (req['end'] - self.first_unix + 1)))
+        if self.response is not None:
+            return self.response
+        first_bar = -(-req['start'] // req['period']) * req['period']
+        return [{'date' : unix_date, 'close' : unix_date / req['period']}
+            for unix_date in range(first_bar, req['end'] + 1, req['period'])]
+
+def test_download_history(verbose=False):
+
+    period, periods_per_chunk = 300, 10
+    start_unix = 1574294400
+    end_unix = start_unix + 25 * period
+
+    # the range is split into 3 chunks of at most 10 periods, every chunk is fetched once
+    client = FakeChartClient(start_unix, delay=0.1)
+    df = download_history(poloniex_chart_data(client, 'USDT_BTC', period), start_unix, end_unix, period,
+        periods_per_chunk=periods_per_chunk, max_workers=3)
+    assert(sorted(client.calls) == chunk_ranges(start_unix, end_unix, period, periods_per_chunk))
+    assert(len(client.calls) == 3)
+
+    # chunks finished out of order and overlap at their edges: the frame is sorted with one row per bar
+    unix_dates = start_unix + period * np.arange(26)
+    assert(list(df.columns) == ['unix_date', 'datetime', 'close'])
+    assert(df['unix_date'].tolist() == unix_dates.tolist())
+    assert(np.allclose(df['close'].to_numpy(), unix_dates / period))
+    assert(df.index.tolist() == list(range(26)))
+    if verbose: print('test chunking and merging successful.')
+
+    # the threads share the rate limiter: 5 chunks with a 1 token bucket refilled 20 times a second take at least 4 / 20 s
+    client = FakeChartClient(start_unix)
+    start_time = time.monotonic()
+    df = download_history(poloniex_chart_data(client, 'USDT_BTC', period), start_unix, start_unix + 50 * period, period,
+        periods_per_chunk=periods_per_chunk, max_workers=5, rate_limiter=RateLimiter(20, capacity=1))
+    assert(time.monotonic() - start_time >= 4 / 20 - 0.01)
+    assert(len(client.calls) == 5)
+    assert(df['unix_date'].tolist() == (start_unix + period * np.arange(51)).tolist())
+    if verbose: print('test rate limit successful.')
+
+    # an empty range makes no calls
+    client = FakeChartClient(start_unix)
+    df = download_history(poloniex_chart_data(client, 'USDT_BTC', period), start_unix, start_unix, period)
+    assert(df.shape[0] == 0 and len(client.calls) == 0)
+
+    # poloniex's date 0 row (no data in the range) is dropped
+    client = FakeChartClient(start_unix, response=[{'date' : 0, 'close' : 0}])
+    df = download_history(poloniex_chart_data(client, 'USDT_BTC', period), start_unix, end_unix, period,
+        periods_per_chunk=periods_per_chunk)
+    assert(df.shape[0] == 0 and len(client.calls) == 3)
+
+    # an error from the API is raised to the caller
+    client = FakeChartClient(start_unix, response={'error' : 'Invalid currency pair.'})
+    try:
+        download_history(poloniex_chart_data(client, 'USDT_XXX', period), start_unix, end_unix, period,
+            periods_per_chunk=periods_per_chunk)
+        assert(False)
+    except RuntimeError as e:
+        assert('Invalid currency pair.' in str(e))
+    if verbose: print('test empty and failed chunks successful.')
+
+def run_unittests(verbose=False):
+    test_download_history(verbose=verbose)
+    if verbose: print('Unit Tests Complete.')
+
+
+
+if __name__ == '__main__':
+    run_unittests(verbose=True)
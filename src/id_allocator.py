@@ -0,0 +1,25 @@
+import heapq
+
+
+class IdAllocator:
+
+    # hands out the lowest non-negative integer id that isn't in use
+    # freed ids are kept on a min-heap, so allocate() and free() are O(log n)
+    # instead of scanning every id in use
+    def __init__(self):
+        self.next_id = 0    # lowest id that has never been handed out
+        self.free_ids = []  # min-heap of ids that were handed out and then freed
+
+    def allocate(self):
+        if self.free_ids:
+            return heapq.heappop(self.free_ids)
+        new_id = self.next_id
+        self.next_id += 1
+        return new_id
+
+    def free(self, freed_id):
+        heapq.heappush(self.free_ids, freed_id)
+
+    def reset(self):
+        self.next_id = 0
+        self.free_ids = []
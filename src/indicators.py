@@ -0,0 +1,436 @@
+from collections import deque
+import itertools
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        technical indicators of a whole price history at once, computed with numpy instead of
+        building a python list of the window at every time step (like Kraken.get_price_windows does)
+
+        every function takes a 1D array (ex: the price at each time step) and a window size w
+        and returns an array of the same length aligned to the input, element i is the indicator
+        of the window ending at (and including) time step i, the first w-1 elements are NaN
+
+        windows are strided views of the input (no copies), running sums or block prefix min/max, so memory is O(n)
+
+    USAGE
+
+        python indicators.py    # runs the unit tests, they check the indicators against pandas rolling windows
+
+    '''
+
+
+# returns an (n-w+1, w) read only view of x, row j is the window x[j:j+w] (oldest to most recent)
+def windows(x, w):
+    return sliding_window_view(np.asarray(x, dtype=np.float64), w)
+
+# put values (one per full window) in an array aligned to the n time steps of the input
+def align(values, n, w):
+    aligned = np.full(n, np.nan)
+    aligned[w-1:] = values
+    return aligned
+
+# running sum of x with a 0 in front, so the sum of the window ending at time step i is c[i+1] - c[i+1-w]
+def running_sum(x):
+    return np.concatenate(([0.0], np.cumsum(np.asarray(x, dtype=np.float64))))
+
+# sum of each window of the values whose running sum is c
+def window_sums(c, w):
+    n = c.shape[0] - 1
+    if n < w:
+        return np.full(n, np.nan)
+    return align(c[w:] - c[:-w], n, w)
+
+# sum of each window, from a running sum (O(n))
+def rolling_sum(x, w):
+    return window_sums(running_sum(x), w)
+
+def simple_moving_average(x, w):
+    return rolling_sum(x, w) / w
+
+# min or max of each window in O(n) (van Herk / Gil-Werman): x is cut into blocks of w, a window covers
+# the end of one block and the start of the next, so its extreme is ufunc(suffix extreme, prefix extreme)
+def rolling_extreme(x, w, ufunc):
+    x = np.asarray(x, dtype=np.float64)
+    n = x.shape[0]
+    if n < w:
+        return np.full(n, np.nan)
+    fill = np.inf if ufunc is np.minimum else -np.inf
+    blocks = np.concatenate((x, np.full(-n % w, fill))).reshape(-1, w)
+    prefix = ufunc.accumulate(blocks, axis=1).ravel()
+    suffix = ufunc.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return align(ufunc(suffix[:n-w+1], prefix[w-1:n]), n, w)
+
+def rolling_min(x, w):
+    return rolling_extreme(x, w, np.minimum)
+
+def rolling_max(x, w):
+    return rolling_extreme(x, w, np.maximum)
+
+# percent change of each price from the previous price (the first element is NaN)
+def percent_change(prices):
+    prices = np.asarray(prices, dtype=np.float64)
+    pct_chngs = np.full(prices.shape[0], np.nan)
+    pct_chngs[1:] = 100.0 * (prices[1:] - prices[:-1]) / prices[:-1]
+    return pct_chngs
+
+# stochastic oscillator of each window of prices: where the most recent price is between the low and high of the window
+# how to calculate it: https://www.investopedia.com/terms/s/stochasticoscillator.asp
+def stochastic_oscillator(prices, w):
+    return stochastic_oscillator_from_extremes(prices, rolling_min(prices, w), rolling_max(prices, w))
+
+def stochastic_oscillator_from_extremes(prices, low, high):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100.0 * (np.asarray(prices, dtype=np.float64) - low) / (high - low)
+
+# relative strength index of each window of percent changes, calculated like Kraken.relative_strength_index:
+# the average gain is the mean of the positive percent changes in the window and
+# the average loss is the mean of the negative ones (NaN if the window has none)
+# how to calculate it: https://www.fidelity.com/learning-center/trading-investing/technical-analysis/technical-indicator-guide/RSI
+def relative_strength_index(pct_chngs, w):
+    return rsi_from_running_sums(rsi_running_sums(pct_chngs), w)
+
+# running sums of the gains, losses and missing values of pct_chngs that the RSI of any window is computed from
+def rsi_running_sums(pct_chngs):
+    pct_chngs = np.asarray(pct_chngs, dtype=np.float64)
+    gains, losses = pct_chngs > 0.0, pct_chngs < 0.0
+    return {
+        'sum_gains'    : running_sum(np.where(gains,  pct_chngs, 0.0)),
+        'num_gains'    : running_sum(gains),
+        'sum_losses'   : running_sum(np.where(losses, pct_chngs, 0.0)),
+        'num_losses'   : running_sum(losses),
+        'num_missing'  : running_sum(np.isnan(pct_chngs))
+    }
+
+def rsi_from_running_sums(sums, w):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        average_gain = window_sums(sums['sum_gains'],  w) / window_sums(sums['num_gains'],  w)
+        average_loss = window_sums(sums['sum_losses'], w) / window_sums(sums['num_losses'], w)
+        rs = average_gain / np.abs(average_loss)
+        rsi = 100.0 - (100.0 / (1.0 + rs))
+    rsi[window_sums(sums['num_missing'], w) != 0] = np.nan # windows with a missing percent change (ex: the first one)
+    return rsi
+
+# indicators indicator_table() can compute
+INDICATORS = [
+    'simple_moving_average',
+    'rolling_min',
+    'rolling_max',
+    'stochastic_oscillator',
+    'relative_strength_index'
+]
+
+# every indicator in indicators at every window size in windows of one price history, in one pass
+# returns a DataFrame (index = index, ex: the unix_dates of the prices) with one column per (indicator, window)
+# the running sums and rolling min/max are computed once and shared, every column costs O(n)
+def indicator_table(prices, indicators, windows, index=None):
+
+    unknown = [indicator for indicator in indicators if indicator not in INDICATORS]
+    if len(unknown) > 0:
+        raise ValueError('unknown indicators: %s, valid indicators: %s' % (unknown, INDICATORS))
+
+    prices = np.asarray(prices, dtype=np.float64)
+    price_sums = running_sum(prices)
+    rsi_sums = rsi_running_sums(percent_change(prices)) if 'relative_strength_index' in indicators else None
+    lows, highs = {}, {} # key = w, value = rolling min/max, shared by rolling_min/max and stochastic_oscillator
+    def low(w):
+        if w not in lows:
+            lows[w] = rolling_min(prices, w)
+        return lows[w]
+    def high(w):
+        if w not in highs:
+            highs[w] = rolling_max(prices, w)
+        return highs[w]
+
+    columns = list(itertools.product(indicators, windows))
+    table = np.empty((prices.shape[0], len(columns)), order='F') # column major so each column is contiguous and the DataFrame doesn't copy it
+    for j, (indicator, w) in enumerate(columns):
+        if indicator == 'simple_moving_average':
+            table[:, j] = window_sums(price_sums, w) / w
+        elif indicator == 'rolling_min':
+            table[:, j] = low(w)
+        elif indicator == 'rolling_max':
+            table[:, j] = high(w)
+        elif indicator == 'stochastic_oscillator':
+            table[:, j] = stochastic_oscillator_from_extremes(prices, low(w), high(w))
+        elif indicator == 'relative_strength_index':
+            table[:, j] = rsi_from_running_sums(rsi_sums, w)
+
+    return pd.DataFrame(table,
+        index=index,
+        copy=False,
+        columns=pd.MultiIndex.from_tuples(columns, names=['indicator', 'window']))
+
+
+
+''' INCREMENTAL INDICATORS
+
+        the classes below compute the same indicators one price at a time, for live trading and Strat.update
+        (they don't recompute the window each time step like Kraken.stochastic_oscillator and relative_strength_index do)
+
+        update(price) adds the next price and returns the indicator, which is also kept in .value
+        (NaN until the window is full), each update takes O(1) amortized time
+
+        the running sums are recomputed from the window once every w updates so rounding errors can't build up
+
+    '''
+
+# min of the last w values, kept with a monotonic deque: the values left in it are increasing,
+# so the min is at the front and each value is pushed and popped at most once
+class RollingMin:
+
+    def __init__(self, w):
+        self.w = w
+        self.t = -1         # index of the last value added
+        self.deque = deque() # (index, value)
+        self.value = np.nan
+
+    def better(self, a, b):
+        return a <= b
+
+    def update(self, x):
+        self.t += 1
+        while len(self.deque) > 0 and not self.better(self.deque[-1][1], x):
+            self.deque.pop()
+        self.deque.append((self.t, x))
+        if self.deque[0][0] <= self.t - self.w:
+            self.deque.popleft()
+        self.value = self.deque[0][1] if self.t >= self.w - 1 else np.nan
+        return self.value
+
+# max of the last w values
+class RollingMax(RollingMin):
+
+    def better(self, a, b):
+        return a >= b
+
+# sum of the last w values
+class RollingSum:
+
+    def __init__(self, w):
+        self.w = w
+        self.window = deque(maxlen=w)
+        self.total = 0.0
+        self.num_updates = 0
+        self.value = np.nan
+
+    def update(self, x):
+        if len(self.window) == self.w:
+            self.total -= self.window[0]
+        self.window.append(x)
+        self.total += x
+        self.num_updates += 1
+        if self.num_updates % self.w == 0:
+            self.total = float(sum(self.window))
+        self.value = self.total if len(self.window) == self.w else np.nan
+        return self.value
+
+class SimpleMovingAverage(RollingSum):
+
+    def update(self, x):
+        self.value = RollingSum.update(self, x) / self.w
+        return self.value
+
+# same as stochastic_oscillator()
+class StochasticOscillator:
+
+    def __init__(self, w):
+        self.w = w
+        self.low = RollingMin(w)
+        self.high = RollingMax(w)
+        self.value = np.nan
+
+    def update(self, price):
+        low, high = self.low.update(price), self.high.update(price)
+        self.value = 100.0 * (price - low) / (high - low) if high > low else np.nan
+        return self.value
+
+# relative strength index of the percent changes of the last w prices
+#   wilder=False - same as relative_strength_index(): mean of the positive and mean of the negative percent changes in the window
+#   wilder=True  - Wilder's smoothing: the average gain and loss start as the mean gain and loss (zero for the other direction)
+#                  of the first w percent changes, then each new one is weighted 1/w
+class RelativeStrengthIndex:
+
+    def __init__(self, w, wilder=False):
+        self.w = w
+        self.wilder = wilder
+        self.prev_price = None
+        self.sum_gains,  self.num_gains  = RollingSum(w), RollingSum(w)
+        self.sum_losses, self.num_losses = RollingSum(w), RollingSum(w)
+        self.average_gain = self.average_loss = np.nan
+        self.num_pct_chngs = 0
+        self.value = np.nan
+
+    def update(self, price):
+        if self.prev_price is None:
+            self.prev_price = price
+            return self.value
+        pct_chng = 100.0 * (price - self.prev_price) / self.prev_price
+        self.prev_price = price
+        self.num_pct_chngs += 1
+        gain, loss = max(pct_chng, 0.0), min(pct_chng, 0.0)
+
+        if self.wilder:
+            if self.num_pct_chngs <= self.w:
+                self.sum_gains.update(gain)
+                self.sum_losses.update(loss)
+                if self.num_pct_chngs < self.w:
+                    return self.value
+                self.average_gain = self.sum_gains.value / self.w
+                self.average_loss = self.sum_losses.value / self.w
+            else:
+                self.average_gain = (self.average_gain * (self.w - 1) + gain) / self.w
+                self.average_loss = (self.average_loss * (self.w - 1) + loss) / self.w
+        else:
+            sum_gains,  num_gains  = self.sum_gains.update(gain),  self.num_gains.update(float(gain > 0.0))
+            sum_losses, num_losses = self.sum_losses.update(loss), self.num_losses.update(float(loss < 0.0))
+            self.average_gain = sum_gains  / num_gains  if num_gains  > 0 else np.nan
+            self.average_loss = sum_losses / num_losses if num_losses > 0 else np.nan
+
+        if self.average_loss == 0.0:
+            self.value = 100.0
+        else:
+            self.value = 100.0 - (100.0 / (1.0 + self.average_gain / abs(self.average_loss)))
+        return self.value
+
+
+
+# random walk prices for the unit tests, rounded so some windows have equal prices (ties, flat windows, zero percent changes)
+def random_prices(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.round(100.0 + np.cumsum(rng.normal(0.0, 1.0, n)), 0)
+
+# relative strength index of each window of pct_chngs computed one window at a time like Kraken.relative_strength_index
+def rsi_of_window(window):
+    gains, losses = window[window > 0.0], window[window < 0.0]
+    average_gain = gains.mean()  if gains.shape[0]  > 0 else np.nan
+    average_loss = losses.mean() if losses.shape[0] > 0 else np.nan
+    return 100.0 - (100.0 / (1.0 + average_gain / abs(average_loss)))
+
+def test_vectorized_indicators(verbose=False):
+
+    for n in [1, 7, 100, 1000]:
+        prices = random_prices(n, seed=n)
+        series = pd.Series(prices)
+        assert(np.allclose(percent_change(prices), 100.0 * series.pct_change().to_numpy(), equal_nan=True))
+        pct_chngs = percent_change(prices)
+        for w in [1, 2, 3, 7, 10, 14, 100, 101]:
+            rolling = series.rolling(w)
+            assert(np.allclose(rolling_sum(prices, w), rolling.sum().to_numpy(), equal_nan=True))
+            assert(np.allclose(simple_moving_average(prices, w), rolling.mean().to_numpy(), equal_nan=True))
+            assert(np.array_equal(rolling_min(prices, w), rolling.min().to_numpy(), equal_nan=True))
+            assert(np.array_equal(rolling_max(prices, w), rolling.max().to_numpy(), equal_nan=True))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                stochastic = 100.0 * (series - rolling.min()) / (rolling.max() - rolling.min())
+            assert(np.allclose(stochastic_oscillator(prices, w), stochastic.to_numpy(), equal_nan=True))
+            rsi = pd.Series(pct_chngs).rolling(w).apply(rsi_of_window, raw=True)
+            assert(np.allclose(relative_strength_index(pct_chngs, w), rsi.to_numpy(), equal_nan=True))
+    if verbose: print('test vectorized indicators against pandas successful.')
+
+    # van Herk / Gil-Werman edge cases: n a multiple of w, n one more or less than one, a window as long as the input,
+    # monotonic prices (the extreme is always at one end of the window), negative and infinite prices
+    # (pandas treats inf as missing, so these are checked against the min/max of every window)
+    for prices in [
+        np.arange(12.0), np.arange(12.0)[::-1],
+        np.arange(13.0), np.arange(11.0),
+        -random_prices(50), np.array([1.0, np.inf, -np.inf, 2.0, 3.0, -1.0]),
+        np.full(9, 5.0)]:
+        for w in [1, 2, 3, 4, 6, 11, 12, 13]:
+            if w > prices.shape[0]:
+                assert(np.isnan(rolling_min(prices, w)).all() and np.isnan(rolling_max(prices, w)).all())
+                continue
+            assert(np.array_equal(rolling_min(prices, w), align(windows(prices, w).min(axis=1), prices.shape[0], w), equal_nan=True))
+            assert(np.array_equal(rolling_max(prices, w), align(windows(prices, w).max(axis=1), prices.shape[0], w), equal_nan=True))
+    if verbose: print('test rolling min and max edge cases successful.')
+
+# values of an incremental indicator after each update
+def incremental(indicator, prices):
+    return np.array([indicator.update(price) for price in prices])
+
+def test_incremental_indicators(verbose=False):
+
+    for n in [1, 7, 100, 1000]:
+        prices = random_prices(n, seed=n)
+        rolling_prices = pd.Series(prices)
+        pct_chngs = percent_change(prices)
+        for w in [1, 2, 3, 7, 10, 14, 100, 101]:
+            rolling = rolling_prices.rolling(w)
+            assert(np.allclose(incremental(RollingSum(w), prices), rolling.sum().to_numpy(), equal_nan=True))
+            assert(np.allclose(incremental(SimpleMovingAverage(w), prices), rolling.mean().to_numpy(), equal_nan=True))
+            assert(np.array_equal(incremental(RollingMin(w), prices), rolling.min().to_numpy(), equal_nan=True))
+            assert(np.array_equal(incremental(RollingMax(w), prices), rolling.max().to_numpy(), equal_nan=True))
+            assert(np.allclose(incremental(StochasticOscillator(w), prices), stochastic_oscillator(prices, w), equal_nan=True))
+            assert(np.allclose(incremental(RelativeStrengthIndex(w), prices), relative_strength_index(pct_chngs, w), equal_nan=True))
+    if verbose: print('test incremental indicators against the vectorized ones successful.')
+
+    # Wilder's smoothing is an exponential moving average (alpha = 1/w, not adjusted) started at the mean of the first w values
+    for w in [1, 2, 14]:
+        prices = random_prices(500, seed=w)
+        gains, losses = np.maximum(percent_change(prices)[1:], 0.0), np.minimum(percent_change(prices)[1:], 0.0)
+        average_gain, average_loss = [
+            pd.Series(np.concatenate(([values[:w].mean()], values[w:]))).ewm(alpha=1.0/w, adjust=False).mean().to_numpy()
+            for values in [gains, losses]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(average_loss == 0.0, 100.0, 100.0 - (100.0 / (1.0 + average_gain / np.abs(average_loss))))
+        values = incremental(RelativeStrengthIndex(w, wilder=True), prices)
+        assert(np.isnan(values[:w]).all())
+        assert(np.allclose(values[w:], rsi))
+    if verbose: print('test Wilder RSI against pandas ewm successful.')
+
+    # the running sums are recomputed from the window, so a long history doesn't build up rounding errors
+    prices = 1e6 + np.random.default_rng(0).normal(0.0, 1.0, 100000)
+    sma = incremental(SimpleMovingAverage(10), prices)
+    assert(np.allclose(sma[9:], windows(prices, 10).mean(axis=1), rtol=0.0, atol=1e-8))
+    if verbose: print('test incremental rounding successful.')
+
+def test_indicator_table(verbose=False):
+
+    # every column is the same as its indicator's function, computed on its own
+    prices = random_prices(1000)
+    index = 1574294400 + 300 * np.arange(prices.shape[0])
+    window_sizes = [1, 5, 14, 14, 2000]
+    table = indicator_table(prices, INDICATORS, window_sizes, index=index)
+    assert(table.shape == (prices.shape[0], len(INDICATORS) * len(window_sizes)))
+    assert(table.index.tolist() == index.tolist())
+    assert(table.columns.names == ['indicator', 'window'])
+    assert(list(table.columns) == [(indicator, w) for indicator in INDICATORS for w in window_sizes])
+    functions = {
+        'simple_moving_average'   : lambda w : simple_moving_average(prices, w),
+        'rolling_min'             : lambda w : rolling_min(prices, w),
+        'rolling_max'             : lambda w : rolling_max(prices, w),
+        'stochastic_oscillator'   : lambda w : stochastic_oscillator(prices, w),
+        'relative_strength_index' : lambda w : relative_strength_index(percent_change(prices), w)
+    }
+    for j, (indicator, w) in enumerate(table.columns):
+        assert(np.array_equal(table.iloc[:, j].to_numpy(), functions[indicator](w), equal_nan=True))
+    assert(table.iloc[:, -1].isna().all()) # a window longer than the history
+    if verbose: print('test indicator_table columns successful.')
+
+    # a subset of the indicators, in the order they're asked for, and no index
+    table = indicator_table(prices, ['relative_strength_index', 'rolling_max'], [3])
+    assert(list(table.columns) == [('relative_strength_index', 3), ('rolling_max', 3)])
+    assert(table.index.tolist() == list(range(prices.shape[0])))
+    assert(np.array_equal(table[('rolling_max', 3)].to_numpy(), pd.Series(prices).rolling(3).max().to_numpy(), equal_nan=True))
+
+    try:
+        indicator_table(prices, ['simple_moving_average', 'macd'], [3])
+        assert(False)
+    except ValueError as e:
+        assert('macd' in str(e))
+    if verbose: print('test indicator_table subsets and unknown indicators successful.')
+
+def run_unittests(verbose=False):
+    test_vectorized_indicators(verbose=verbose)
+    test_incremental_indicators(verbose=verbose)
+    test_indicator_table(verbose=verbose)
+    if verbose: print('Unit Tests Complete.')
+
+
+
+if __name__ == '__main__':
+    run_unittests(verbose=True)
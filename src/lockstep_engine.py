@@ -0,0 +1,116 @@
+import time
+import numpy as np
+import pandas as pd
+
+import simple_backtester_one_coin
+from simple_backtester_one_coin import LONG, SHORT
+from parameter_sweep import RESULT_COLUMNS
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        backtest N variants of one strategy (ex: the same rule with 5000 different thresholds) at the same time,
+        each variant is a row of the state arrays and every time step updates all of them with one numpy operation per step,
+        so N variants cost about as much as a few single backtests instead of N of them
+
+        the P/L works like simple_backtester_one_coin.Strat: a variant holds at most one position at a time,
+        exiting it makes pl_pct * quantity - 2 * quantity * TF (see Strat.exit), tot_pl is the sum of the exit P/Ls
+        (TF and INCLUDE_TF are read from simple_backtester_one_coin every step, so overriding them there changes both engines)
+
+        state of every variant (arrays of length N):
+            positions    - quantity of COIN2 held: + is long, - is short, 0 is out of the market
+            enter_prices - price the position was entered at (NaN if out of the market)
+            exit_pl      - P/L of the position exited this time step (0 if none was)
+            tot_pl       - total P/L so far
+            num_trades   - number of positions exited
+            max_drawdown - largest drop in tot_pl from a previous high
+
+        a rule decides the position of every variant each time step:
+            rule(engine, t, price) - returns an array of N positions to hold after time step t
+        when a variant's position changes, the position it held is exited and the new one is entered at price
+        (the same as calling Strat.exit() then Strat.enter()), see threshold_rule() for an example
+
+    '''
+
+
+class LockstepEngine:
+
+    def __init__(self, num_variants, tf=None):
+
+        self.num_variants = num_variants
+        self.tf = tf # trading fee, None = the one simple_backtester_one_coin.Strat uses
+        self.positions    = np.zeros(num_variants)
+        self.enter_prices = np.full(num_variants, np.nan)
+        self.exit_pl      = np.zeros(num_variants)
+        self.tot_pl       = np.zeros(num_variants)
+        self.num_trades   = np.zeros(num_variants, dtype=np.int64)
+        self.peak_pl      = np.zeros(num_variants)
+        self.max_drawdown = np.zeros(num_variants)
+
+    # move every variant to new_positions at price
+    def step(self, price, new_positions):
+
+        new_positions = np.asarray(new_positions, dtype=np.float64)
+        trades = new_positions != self.positions
+        exits  = trades & (self.positions != 0)
+        enters = trades & (new_positions != 0)
+
+        # P/L of the exited positions, the same as Strat.exit()
+        quantity = np.abs(self.positions)
+        with np.errstate(invalid='ignore'):
+            pl_pct = np.sign(self.positions) * (price - self.enter_prices) / self.enter_prices
+        tf = self.tf if self.tf is not None else \
+            simple_backtester_one_coin.TF if simple_backtester_one_coin.INCLUDE_TF else 0
+        self.exit_pl = np.where(exits, pl_pct * quantity - 2 * quantity * tf, 0.0)
+        self.tot_pl += self.exit_pl
+        self.num_trades += exits
+        np.maximum(self.peak_pl, self.tot_pl, out=self.peak_pl)
+        np.maximum(self.max_drawdown, self.peak_pl - self.tot_pl, out=self.max_drawdown)
+
+        self.enter_prices = np.where(enters, price, np.where(exits, np.nan, self.enter_prices))
+        self.positions = new_positions
+
+    # open positions of variant i like Strat.open_positions (key = position_id, value = dict of long_or_short, enter_price and enter_value)
+    def open_positions(self, i):
+        if self.positions[i] == 0:
+            return {}
+        return {0 : {
+            'long_or_short' : LONG if self.positions[i] > 0 else SHORT,
+            'enter_price'   : self.enter_prices[i],
+            'enter_value'   : abs(self.positions[i])
+        }}
+
+    # DataFrame with a row per variant: its params (dict of arrays of length N) and tot_pl, max_drawdown and num_trades
+    def results(self, params=None):
+        params = params or {}
+        return pd.DataFrame(dict(
+            {name : np.asarray(values) for name, values in params.items()},
+            tot_pl=self.tot_pl,
+            max_drawdown=self.max_drawdown,
+            num_trades=self.num_trades),
+            columns=list(params.keys()) + RESULT_COLUMNS)
+
+# run rule over prices (from time step start_t + 1 to the end, like Strat.backtest), returns the engine
+def backtest(prices, rule, num_variants, start_t=0, tf=None, verbose=False):
+
+    prices = np.asarray(prices, dtype=np.float64)
+    engine = LockstepEngine(num_variants, tf=tf)
+    if verbose: print('Backtesting %d variants over %d time steps ...' % (num_variants, prices.shape[0] - start_t - 1))
+    start_time = time.time()
+    for t in range(start_t + 1, prices.shape[0]):
+        price = prices[t]
+        engine.step(price, rule(engine, t, price))
+    if verbose: print('Backtest Complete. %.1f seconds' % (time.time() - start_time))
+    return engine
+
+# example rule with one threshold per variant: be long quantity, exit when the price is thresholds away
+# from the enter price (take profit or stop loss) and enter again on the next time step
+def threshold_rule(thresholds, quantity=1.0):
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    def rule(engine, t, price):
+        with np.errstate(invalid='ignore'):
+            moved = np.abs(price / engine.enter_prices - 1) >= thresholds
+        return np.where(engine.positions == 0, quantity, np.where(moved, 0.0, engine.positions))
+    return rule
@@ -0,0 +1,146 @@
+import sys
+import atexit
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        leveled logging shared by the backtesters (replaces the pprint functions that
+        opened and closed the logfile for every line)
+
+        each logfile is opened once and kept open with a large write buffer,
+        every Logger writing to the same path shares that one file handle (so lines stay in order)
+
+        messages below the Logger's level return before anything is formatted,
+        so pass the format arguments to log() instead of formatting the string yourself:
+            logger.debug('t = %d, price = %.6f', t, price)    <-- costs nothing when level > DEBUG
+            logger.debug('t = %d, price = %.6f' % (t, price))  <-- always formats the string
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+DEBUG   = 10 # per time step trace messages
+INFO    = 20 # verbose output
+WARNING = 30
+ERROR   = 40
+QUIET   = 100 # log nothing
+LEVEL_NAMES = {
+    'debug'   : DEBUG,
+    'info'    : INFO,
+    'warning' : WARNING,
+    'error'   : ERROR,
+    'quiet'   : QUIET
+}
+
+LOGFILE_BUFFER_SIZE = 1024 * 1024 # bytes written to the logfile at a time
+DEFAULT_INDENT = '|   '
+
+#########################################################################################################################
+
+
+logfiles = {} # key = logfile path, value = open file handle shared by all Loggers writing to it
+
+# open logfile_path (or get it if its already open), clear_log empties the file
+def open_logfile(logfile_path, clear_log=False):
+    logfile = logfiles.get(logfile_path)
+    if logfile is None or logfile.closed:
+        logfile = open(logfile_path, 'w' if clear_log else 'a', buffering=LOGFILE_BUFFER_SIZE)
+        logfiles[logfile_path] = logfile
+    elif clear_log:
+        logfile.seek(0)
+        logfile.truncate()
+    return logfile
+
+# write whatever is still buffered in every open logfile
+def flush_logfiles():
+    for logfile in logfiles.values():
+        if not logfile.closed:
+            logfile.flush()
+
+def close_logfiles():
+    for logfile in logfiles.values():
+        if not logfile.closed:
+            logfile.close()
+    logfiles.clear()
+
+atexit.register(close_logfiles)
+
+
+class Logger:
+
+    def __init__(self,
+        logfile_path=None,
+        level=INFO,
+        to_console=True,
+        to_logfile=True,
+        clear_log=False,
+        indent=DEFAULT_INDENT,
+        draw_line=False):
+
+        self.level      = LEVEL_NAMES[level] if isinstance(level, str) else level
+        self.to_console = to_console
+        self.logfile    = open_logfile(logfile_path, clear_log=clear_log) \
+            if to_logfile and logfile_path is not None and self.level < QUIET else None
+        self.indent0    = indent              # indent on the console
+        self.indent1    = len(indent) * ' '   # indent in the logfile
+        self.draw_line  = draw_line
+
+    # returns True if a message of the given level would be output
+    def enabled(self, level):
+        return level >= self.level
+
+    # pretty print the string
+    # arguments:
+    #   level = DEBUG, INFO, WARNING or ERROR, nothing is done if its below self.level
+    #   string = what will be printed, formatted with args (if there are any)
+    #   num_indents = number of indents to put in front of the string
+    #   new_line_start = print a new line in before the string
+    #   new_line_end = print a new line in after the string
+    #   draw_line = draw a line on the blank line before or after the string
+    def log(self,
+        level,
+        string='',
+        *args,
+        num_indents=0,
+        new_line_start=False,
+        new_line_end=False,
+        draw_line=None):
+
+        if level < self.level:
+            return
+        if args:
+            string = string % args
+        if draw_line is None:
+            draw_line = self.draw_line
+
+        def output(out_loc, indent):
+            total_indent0 = indent * num_indents
+            total_indent1 = indent * (num_indents + 1)
+            lines = [total_indent0 + s for s in string.split('\n')]
+            if new_line_start:
+                lines.insert(0, total_indent1 if draw_line else total_indent0)
+            if new_line_end:
+                lines.append(total_indent1 if draw_line else total_indent0)
+            out_loc.write('\n'.join(lines) + '\n')
+
+        if self.to_console:
+            output(sys.stdout, self.indent0)
+        if self.logfile is not None:
+            output(self.logfile, self.indent1)
+
+    def debug(self, string='', *args, **kwargs):
+        self.log(DEBUG, string, *args, **kwargs)
+    def info(self, string='', *args, **kwargs):
+        self.log(INFO, string, *args, **kwargs)
+    def warning(self, string='', *args, **kwargs):
+        self.log(WARNING, string, *args, **kwargs)
+    def error(self, string='', *args, **kwargs):
+        self.log(ERROR, string, *args, **kwargs)
+
+    def flush(self):
+        if self.to_console:
+            sys.stdout.flush()
+        if self.logfile is not None:
+            self.logfile.flush()
@@ -0,0 +1,186 @@
+import time
+import argparse
+import numpy as np
+import pandas as pd
+pd.set_option('display.max_rows', 20)
+pd.set_option('display.max_columns', 20)
+
+import simple_backtester_one_coin
+from parameter_sweep import RESULT_COLUMNS
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        Monte Carlo backtest of a vectorized signal strategy over thousands of price paths resampled from
+        the historical pct_chg series, instead of only the one path that happened
+
+        the paths are made by resampling pct_chg in blocks, so the returns keep their short term patterns (ex: volatility clusters):
+            block bootstrap      - blocks of block_size time steps starting at random time steps
+            stationary bootstrap - blocks of random length (geometric, block_size on average) starting at random time steps
+        (the series is wrapped around, so a block that runs past the end continues at the start)
+
+        a path is made of the resampled returns compounded from start_price, the strategy gets a (paths, time steps)
+        array of prices and returns a same shaped array of positions (quantity of COIN2, + is long, - is short, 0 is out)
+        the P/L of the positions is computed like simple_backtester_one_coin.Strat.apply_positions(), along every path at once,
+        with the trading fee of simple_backtester_one_coin (TF, or 0 if INCLUDE_TF is False) unless tf is given
+
+        the paths are made and backtested in chunks that fit in max_chunk_bytes, only the results of each path are kept,
+        so 10,000 paths of 26,000 time steps (2 GB as one float64 array) run in a few hundred MB
+
+    USAGE
+
+        python monte_carlo.py --paths 10000 --block_size 288 --method stationary
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+MAX_CHUNK_BYTES = 256 * 1024 * 1024 # memory one chunk of paths can use
+BYTES_PER_STEP = 96 # bytes a chunk uses per path per time step (indices, returns, prices, positions and the P/L arrays)
+PERCENTILES = [1, 5, 25, 50, 75, 95, 99]
+
+#########################################################################################################################
+
+
+# (num_paths, n) time step indices into the historical series: blocks of block_size consecutive time steps
+def block_bootstrap_indices(n, num_paths, block_size, rng):
+    num_blocks = -(-n // block_size)
+    starts = rng.integers(0, n, size=(num_paths, num_blocks, 1))
+    indices = (starts + np.arange(block_size)).reshape(num_paths, -1)[:, :n]
+    return indices % n
+
+# (num_paths, n) time step indices into the historical series: a new block starts at each time step with
+# probability 1 / block_size (so blocks are block_size long on average), otherwise the block goes on to the next time step
+def stationary_bootstrap_indices(n, num_paths, block_size, rng):
+    t = np.arange(n)
+    new_block = rng.random((num_paths, n)) < 1.0 / block_size
+    new_block[:, 0] = True
+    block_start_t = np.maximum.accumulate(np.where(new_block, t, 0), axis=1) # time step the block of each time step started at
+    starts = rng.integers(0, n, size=(num_paths, n))
+    return (np.take_along_axis(starts, block_start_t, axis=1) + (t - block_start_t)) % n
+
+BOOTSTRAPS = {
+    'block'      : block_bootstrap_indices,
+    'stationary' : stationary_bootstrap_indices
+}
+
+# (num_paths, n + 1) prices starting at start_price, compounded from resampled pct_chgs
+def resample_paths(pct_chgs, num_paths, block_size, method='stationary', start_price=1.0, rng=None):
+    rng = np.random.default_rng() if rng is None else rng
+    pct_chgs = np.asarray(pct_chgs, dtype=np.float64)
+    indices = BOOTSTRAPS[method](pct_chgs.shape[0], num_paths, block_size, rng)
+    prices = np.empty((num_paths, pct_chgs.shape[0] + 1))
+    prices[:, 0] = start_price
+    np.cumprod(1.0 + pct_chgs[indices], axis=1, out=prices[:, 1:])
+    prices[:, 1:] *= start_price
+    return prices
+
+# tot_pl, max_drawdown and num_trades of every path (row) of positions held at prices,
+# whenever a position changes the one held before is exited and the new one is entered (see Strat.apply_positions)
+def positions_results(prices, positions, tf):
+    t = np.arange(prices.shape[1])
+    positions = np.nan_to_num(positions.astype(np.float64, copy=False))
+    positions[:, 0] = 0.0 # the backtest starts out of the market
+    prev_positions = np.zeros_like(positions)
+    prev_positions[:, 1:] = positions[:, :-1]
+    trades = positions != prev_positions
+    exits = trades & (prev_positions != 0)
+
+    # time step each exited position was entered at: the last trade before the exit
+    last_trade = np.maximum.accumulate(np.where(trades, t, 0), axis=1)
+    enter_t = np.zeros_like(last_trade)
+    enter_t[:, 1:] = last_trade[:, :-1]
+    enter_prices = np.take_along_axis(prices, enter_t, axis=1)
+
+    quantity = np.abs(prev_positions)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exit_pl = np.where(exits, np.sign(prev_positions) * (prices - enter_prices) / enter_prices * quantity - 2 * quantity * tf, 0.0)
+    tot_pl = np.cumsum(exit_pl, axis=1)
+    return pd.DataFrame({
+        'tot_pl'       : tot_pl[:, -1],
+        'max_drawdown' : np.max(np.maximum.accumulate(tot_pl, axis=1) - tot_pl, axis=1),
+        'num_trades'   : np.count_nonzero(exits, axis=1)
+    }, columns=RESULT_COLUMNS)
+
+# backtest strategy (function of a (paths, time steps) price array that returns the positions) over num_paths resampled paths
+# returns a DataFrame with a row per path: tot_pl, max_drawdown and num_trades
+def monte_carlo(
+    pct_chgs,
+    strategy,
+    num_paths=10000,
+    block_size=288,
+    method='stationary',
+    start_price=1.0,
+    tf=None,
+    seed=None,
+    max_chunk_bytes=MAX_CHUNK_BYTES,
+    verbose=False):
+
+    if tf is None:
+        tf = simple_backtester_one_coin.TF if simple_backtester_one_coin.INCLUDE_TF else 0
+    pct_chgs = np.asarray(pct_chgs, dtype=np.float64)
+    pct_chgs = pct_chgs[~np.isnan(pct_chgs)]
+    rng = np.random.default_rng(seed)
+    paths_per_chunk = max(1, int(max_chunk_bytes // (BYTES_PER_STEP * (pct_chgs.shape[0] + 1))))
+    if verbose: print('Backtesting %d %s bootstrap paths of %d time steps, %d paths at a time ...' % (
+        num_paths, method, pct_chgs.shape[0], paths_per_chunk))
+    start_time = time.time()
+
+    results = []
+    for chunk_start in range(0, num_paths, paths_per_chunk):
+        prices = resample_paths(pct_chgs, min(paths_per_chunk, num_paths - chunk_start), block_size,
+            method=method, start_price=start_price, rng=rng)
+        results.append(positions_results(prices, strategy(prices), tf))
+    results = pd.concat(results, ignore_index=True)
+
+    if verbose: print('Monte Carlo Complete. %.1f seconds' % (time.time() - start_time))
+    return results
+
+# percentiles of the results of every path (ex: the 5th percentile of tot_pl is the P/L 95 % of the paths beat)
+def distribution(results, percentiles=PERCENTILES):
+    return pd.DataFrame(
+        np.percentile(results.to_numpy(dtype=np.float64), percentiles, axis=0),
+        index=['%d %%' % percentile for percentile in percentiles],
+        columns=results.columns)
+
+# example strategy: long quantity while the fast moving average of the price is above the slow one, short while it's below
+def moving_average_crossover(fast, slow, quantity=1.0):
+    def strategy(prices):
+        running_sums = np.zeros((prices.shape[0], prices.shape[1] + 1))
+        np.cumsum(prices, axis=1, out=running_sums[:, 1:])
+        positions = np.zeros(prices.shape)
+        fast_average = (running_sums[:, slow:] - running_sums[:, slow-fast:-fast]) / fast
+        slow_average = (running_sums[:, slow:] - running_sums[:, :-slow]) / slow
+        positions[:, slow-1:] = np.where(fast_average > slow_average, quantity, -quantity)
+        return positions
+    return strategy
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Monte Carlo backtest of a moving average crossover over bootstrapped price paths')
+    parser.add_argument('--paths',      type=int, default=10000, help='number of paths (default: %(default)s)')
+    parser.add_argument('--block_size', type=int, default=288, help='(average) block length in time steps (default: %(default)s)')
+    parser.add_argument('--method',     default='stationary', choices=list(BOOTSTRAPS.keys()), help='bootstrap (default: %(default)s)')
+    parser.add_argument('--fast',       type=int, default=12, help='fast moving average window (default: %(default)s)')
+    parser.add_argument('--slow',       type=int, default=48, help='slow moving average window (default: %(default)s)')
+    parser.add_argument('--seed',       type=int, default=None, help='random seed')
+    args = parser.parse_args()
+
+    module = simple_backtester_one_coin
+    price_df = module.Strat(verbose=False, logfile_path=None).get_past_prices_from_price_store()
+    pct_chgs = price_df[module.COIN2].pct_change().to_numpy()
+    results = monte_carlo(
+        pct_chgs,
+        moving_average_crossover(args.fast, args.slow),
+        num_paths=args.paths,
+        block_size=args.block_size,
+        method=args.method,
+        start_price=price_df[module.COIN2].iloc[0],
+        tf=module.TF if module.INCLUDE_TF else 0,
+        seed=args.seed,
+        verbose=True)
+    print(distribution(results))
@@ -0,0 +1,169 @@
+import os
+import time
+import argparse
+import json
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+pd.set_option('display.max_rows', 20)
+pd.set_option('display.max_columns', 20)
+import numpy as np
+
+from shared_arrays import create_shared_arrays, attach_shared_arrays
+from parameter_sweep import DEFAULT_STRAT, load_strat_class, strat_module, max_drawdown
+from logger import QUIET
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        backtest a Strat (by default the one in simple_backtester_one_coin) on every coin of a universe,
+        one backtest per coin, spread over a pool of worker processes, and add up the P/L of the coins
+        into the P/L of the whole portfolio
+
+        the prices of all the coins are put in shared memory once as one (time steps, coins) array, column major,
+        so the prices of each coin are contiguous and every worker reads its coin's column as a view of it
+        (nothing but the coin's name is sent to a worker per backtest, and only the coin's P/L is sent back)
+
+        the coins are independent, so the backtests scale with the number of cores
+
+        a coin is only backtested over the time steps it has a price (ex: a coin listed later starts later),
+        the portfolio P/L is the sum of the P/L of every coin, carried forward over the time steps a coin has no price
+
+        params work like in parameter_sweep.py: UPPER CASE names override the constants of the Strat's module,
+        lower case names are set as attributes of the Strat, the same params are used for every coin
+
+    USAGE
+
+        python multi_coin_backtest.py
+        python multi_coin_backtest.py --params '{"TF" : 0.001}' --strat my_strategy:MyStrat --workers 8 --output pl.csv
+
+    '''
+
+
+# state of each worker process, set once by init_worker()
+worker = {}
+
+def init_worker(spec, coins, strat_path, params):
+
+    shm, arrays = attach_shared_arrays(spec)
+    strat_class = load_strat_class(strat_path)
+    module = strat_module(strat_class)
+    module.LOG_LEVEL = QUIET
+    for name, value in params.items():
+        if name.isupper():
+            setattr(module, name, value)
+
+    # datetime strings aren't numeric so they aren't in shared memory, rebuild them once per worker
+    unix_date = arrays['unix_date']
+
+    worker['shm'] = shm
+    worker['strat_class'] = strat_class
+    worker['module'] = module
+    worker['params'] = params
+    worker['unix_date'] = unix_date
+    worker['datetime'] = pd.to_datetime(unix_date, unit='s').strftime('%Y-%m-%d %H:%M:%S').to_numpy()
+    worker['prices'] = arrays['prices']
+    worker['coin_index'] = {coin : j for j, coin in enumerate(coins)}
+
+def run_backtest(coin):
+
+    module = worker['module']
+    prices = worker['prices'][:, worker['coin_index'][coin]] # view of the coin's column in shared memory
+    has_price = ~np.isnan(prices)
+    if np.count_nonzero(has_price) < 2:
+        return coin, np.empty(0, dtype=np.int64), np.empty(0), 0
+
+    module.COIN2 = coin
+    module.PAIR = module.COIN1 + '_' + coin
+    price_df = pd.DataFrame({
+        'unix_date' : worker['unix_date'][has_price],
+        'datetime'  : worker['datetime'][has_price],
+        coin        : prices[has_price]
+    })
+    strat = worker['strat_class'](verbose=False, logfile_path=None)
+    for name, value in worker['params'].items():
+        if not name.isupper():
+            setattr(strat, name, value)
+    strat.backtest(price_df=price_df, verbose=False) # every time step the coin has a price (setup_backtesting counts them)
+
+    return coin, \
+        strat.df['unix_date'].to_numpy(dtype=np.int64), \
+        strat.df['tot_pl'].to_numpy(dtype=np.float64), \
+        strat.num_trades
+
+# backtest every coin in prices_df (columns: unix_date, datetime, <coin>, <coin>, ... like
+# backtest_multiple_coins.get_past_prices_from_price_store returns), returns a DataFrame with columns:
+# unix_date, datetime, the tot_pl of every coin and the tot_pl of the portfolio, and a DataFrame with a row per coin
+def backtest_coins(
+    prices_df,
+    coins,
+    strat_path=DEFAULT_STRAT,
+    params=None,
+    max_workers=None,
+    verbose=False):
+
+    params = params or {}
+    max_workers = max_workers or os.cpu_count()
+    if verbose: print('Backtesting %d coins over %d time steps with %d workers ...' % (
+        len(coins), prices_df.shape[0], max_workers))
+    start_time = time.time()
+
+    shm, spec = create_shared_arrays({
+        'unix_date' : prices_df['unix_date'].to_numpy(dtype=np.int64),
+        'prices'    : np.asfortranarray(prices_df[coins].to_numpy(dtype=np.float64))
+    })
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(spec, coins, strat_path, params)) as executor:
+            results = list(executor.map(run_backtest, coins))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # line the P/L of every coin up on the time steps of prices_df
+    pl_df = prices_df[['unix_date', 'datetime']].reset_index(drop=True)
+    summary = []
+    for coin, unix_dates, tot_pl, num_trades in results:
+        pl = pd.Series(tot_pl, index=unix_dates).reindex(pl_df['unix_date'])
+        pl_df[coin] = pl.ffill().fillna(0.0).to_numpy()
+        summary.append({
+            'coin'         : coin,
+            'tot_pl'       : float(pl_df[coin].iloc[-1]),
+            'max_drawdown' : max_drawdown(tot_pl),
+            'num_trades'   : num_trades
+        })
+    pl_df['portfolio'] = pl_df[coins].sum(axis=1)
+
+    if verbose: print('Backtests Complete. %.1f seconds' % (time.time() - start_time))
+    return pl_df, pd.DataFrame(summary, columns=['coin', 'tot_pl', 'max_drawdown', 'num_trades'])
+
+
+
+if __name__ == '__main__':
+
+    import backtest_multiple_coins
+
+    parser = argparse.ArgumentParser(description='backtest a strategy on every coin of backtest_multiple_coins in parallel')
+    parser.add_argument('--params',  default='{}', help='JSON dict of parameter name to value, or path to a JSON file of one')
+    parser.add_argument('--strat',   default=DEFAULT_STRAT, help='module:Class of the Strat to backtest (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--output',  default=None, help='CSV file to save the P/L of every coin and the portfolio to')
+    args = parser.parse_args()
+
+    params = json.load(open(args.params, 'r')) if os.path.isfile(args.params) else json.loads(args.params)
+    prices_df = backtest_multiple_coins.get_past_prices_from_price_store()
+    pl_df, summary = backtest_coins(
+        prices_df,
+        backtest_multiple_coins.COINS,
+        strat_path=args.strat,
+        params=params,
+        max_workers=args.workers,
+        verbose=True)
+    print(summary)
+    print('portfolio tot_pl: %.6f, max_drawdown: %.6f' % (
+        pl_df['portfolio'].iloc[-1], max_drawdown(pl_df['portfolio'].to_numpy())))
+    if args.output is not None:
+        pl_df.to_csv(args.output, index=False)
@@ -0,0 +1,187 @@
+import numpy as np
+
+from indicators import running_sum
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        an order book kept as numpy arrays, one price array and one volume array per side,
+        asks sorted from lowest to highest price and bids from highest to lowest (best price first)
+
+        the running sums of the volume and the notional (price * volume) of each side are computed once when
+        the book is made, so every query is a binary search (np.searchsorted) and a few array lookups,
+        and the queries take arrays too (ex: the vwap of 100 order sizes in one call)
+
+        side is 'buy' or 'sell', what the taker of the order does:
+            'buy'  - takes the asks
+            'sell' - takes the bids
+
+        the book is parsed with one bulk conversion from the lists Kraken's Depth API returns:
+            {"asks" : [[<price>, <volume>, <unix_timestamp>], ...], "bids" : [...]}
+        (the numbers can be strings, like Kraken sends them, or numbers, like to_dict() returns them)
+
+    USAGE
+
+        python order_book.py    # runs the unit tests
+
+    '''
+
+
+class OrderBook:
+
+    def __init__(self, asks, bids):
+
+        # asks and bids are (n, 3) arrays of [price, volume, unix_timestamp]
+        asks = asks[np.argsort( asks[:, 0], kind='stable')]
+        bids = bids[np.argsort(-bids[:, 0], kind='stable')]
+        self.ask_prices, self.ask_volumes, self.ask_times = asks[:, 0], asks[:, 1], asks[:, 2]
+        self.bid_prices, self.bid_volumes, self.bid_times = bids[:, 0], bids[:, 1], bids[:, 2]
+        self.negative_bid_prices = -self.bid_prices # increasing, so the bids can be binary searched too
+
+        # running sums with a 0 in front: the first k levels hold cum_volumes[k] and cost cum_notionals[k]
+        self.cum_ask_volumes   = running_sum(self.ask_volumes)
+        self.cum_ask_notionals = running_sum(self.ask_prices * self.ask_volumes)
+        self.cum_bid_volumes   = running_sum(self.bid_volumes)
+        self.cum_bid_notionals = running_sum(self.bid_prices * self.bid_volumes)
+
+    @classmethod
+    def from_dict(cls, order_book):
+        return cls(levels_array(order_book['asks']), levels_array(order_book['bids']))
+
+    # the book in the format it was parsed from (with numbers instead of strings), for saving as JSON
+    def to_dict(self):
+        return {
+            'asks' : np.column_stack((self.ask_prices, self.ask_volumes, self.ask_times)).tolist(),
+            'bids' : np.column_stack((self.bid_prices, self.bid_volumes, self.bid_times)).tolist()
+        }
+
+    def side(self, side):
+        if side == 'buy':
+            return self.ask_prices, self.cum_ask_volumes, self.cum_ask_notionals
+        if side == 'sell':
+            return self.bid_prices, self.cum_bid_volumes, self.cum_bid_notionals
+        raise ValueError('invalid side: %s, valid sides: buy, sell' % side)
+
+    def best_ask(self):
+        return self.ask_prices[0] if self.ask_prices.shape[0] > 0 else np.nan
+
+    def best_bid(self):
+        return self.bid_prices[0] if self.bid_prices.shape[0] > 0 else np.nan
+
+    def spread(self):
+        return self.best_ask() - self.best_bid()
+
+    def mid_price(self):
+        return (self.best_ask() + self.best_bid()) / 2.0
+
+    # volume of the asks at or below price (side='buy') or of the bids at or above price (side='sell')
+    def depth(self, side, price):
+        prices, cum_volumes, _ = self.side(side)
+        if side == 'buy':
+            k = np.searchsorted(prices, price, side='right')
+        else:
+            k = np.searchsorted(self.negative_bid_prices, -np.asarray(price), side='right')
+        return cum_volumes[k]
+
+    # volume weighted average price of a market order of size (in the base currency, ex: BTC) on side,
+    # NaN if the book doesn't have enough volume to fill it, the best price if size is 0
+    def vwap(self, side, size):
+        prices, cum_volumes, cum_notionals = self.side(side)
+        size = np.asarray(size, dtype=np.float64)
+        if prices.shape[0] == 0:
+            return np.full(size.shape, np.nan)[()]
+        k = np.clip(np.searchsorted(cum_volumes, size, side='left'), 1, prices.shape[0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = (cum_notionals[k-1] + (size - cum_volumes[k-1]) * prices[k-1]) / size
+        vwap = np.where(size > 0, vwap, prices[0])
+        return np.where(size <= cum_volumes[-1], vwap, np.nan)[()]
+
+    # how much worse than the best price the vwap of a market order of size is, as a fraction of the best price
+    # (ex: 0.002 = the order fills 0.2% worse than the best price), NaN if the book doesn't have enough volume
+    def slippage(self, side, size):
+        prices, _, _ = self.side(side)
+        best_price = prices[0] if prices.shape[0] > 0 else np.nan
+        slippage = (self.vwap(side, size) - best_price) / best_price
+        return slippage if side == 'buy' else -slippage
+
+    # (bid volume - ask volume) / (bid volume + ask volume), from -1 (only asks) to 1 (only bids)
+    # of the levels within a fraction of the mid price (ex: within=0.01 = levels within 1% of the mid price),
+    # or of the whole book if within is None
+    def imbalance(self, within=None):
+        if within is None:
+            bid_volume, ask_volume = self.cum_bid_volumes[-1], self.cum_ask_volumes[-1]
+        else:
+            mid_price = self.mid_price()
+            bid_volume = self.depth('sell', mid_price * (1.0 - within))
+            ask_volume = self.depth('buy',  mid_price * (1.0 + within))
+        total_volume = bid_volume + ask_volume
+        return (bid_volume - ask_volume) / total_volume if total_volume > 0 else np.nan
+
+# one side of an order book as an (n, 3) float array, in one conversion
+def levels_array(levels):
+    return np.array(levels, dtype=np.float64).reshape(-1, 3)
+
+
+
+def test_order_book(verbose=False):
+
+    # levels out of order with string numbers, like Kraken's Depth API sends them
+    book = OrderBook.from_dict({
+        'asks' : [['101.0', '1.0', '1600000000'], ['102.0', '2.0', '1600000000'], ['100.0', '0.5', '1600000000']],
+        'bids' : [['99.0',  '1.0', '1600000000'], ['98.0',  '3.0', '1600000000'], ['99.5',  '0.5', '1600000000']]
+    })
+    assert(book.ask_prices.tolist() == [100.0, 101.0, 102.0])
+    assert(book.bid_prices.tolist() == [99.5, 99.0, 98.0])
+    assert(book.best_ask() == 100.0 and book.best_bid() == 99.5)
+    assert(book.spread() == 0.5 and book.mid_price() == 99.75)
+    assert(OrderBook.from_dict(book.to_dict()).to_dict() == book.to_dict())
+    if verbose: print('test parsing successful.')
+
+    # partial depth: orders that end inside a level and on the edge of one
+    assert(book.depth('buy', 101.0) == 1.5 and book.depth('buy', 100.5) == 0.5 and book.depth('buy', 99.0) == 0.0)
+    assert(book.depth('sell', 99.0) == 1.5 and book.depth('sell', 100.0) == 0.0 and book.depth('sell', 90.0) == 4.5)
+    assert(book.depth('buy', [99.0, 101.0, 110.0]).tolist() == [0.0, 1.5, 3.5])
+    assert(book.vwap('buy', 0.25) == 100.0)
+    assert(book.vwap('buy', 0.5)  == 100.0)
+    assert(np.isclose(book.vwap('buy', 1.0), (100.0 * 0.5 + 101.0 * 0.5) / 1.0))
+    assert(np.isclose(book.vwap('sell', 2.0), (99.5 * 0.5 + 99.0 * 1.0 + 98.0 * 0.5) / 2.0))
+    assert(np.allclose(book.vwap('buy', [0.5, 1.0, 1.5, 3.5]), [100.0, 100.5, 302.0 / 3.0, (50.0 + 101.0 + 204.0) / 3.5]))
+    assert(np.isclose(book.slippage('buy', 1.0), 0.005) and np.isclose(book.slippage('sell', 2.0), (99.5 - 98.875) / 99.5))
+    if verbose: print('test partial depth successful.')
+
+    # exhausted book: orders bigger than a side get NaN, an empty side has no prices
+    assert(np.isclose(book.vwap('buy', 3.5), (50.0 + 101.0 + 204.0) / 3.5))
+    assert(np.isnan(book.vwap('buy', 3.6)) and np.isnan(book.slippage('buy', 3.6)) and np.isnan(book.vwap('sell', 4.6)))
+    assert(np.isnan(book.vwap('sell', [1.0, 5.0])).tolist() == [False, True])
+    empty = OrderBook.from_dict({'asks' : [], 'bids' : [[99.0, 1.0, 0]]})
+    assert(np.isnan(empty.best_ask()) and np.isnan(empty.spread()) and empty.depth('buy', 1e9) == 0.0)
+    assert(np.isnan(empty.vwap('buy', 1.0)) and np.isnan(empty.vwap('buy', [0.0, 1.0])).all())
+    assert(empty.imbalance() == 1.0)
+    assert(np.isnan(OrderBook.from_dict({'asks' : [], 'bids' : []}).imbalance()))
+    if verbose: print('test exhausted book successful.')
+
+    # a zero quantity order fills at the best price
+    assert(book.vwap('buy', 0.0) == 100.0 and book.vwap('sell', 0.0) == 99.5)
+    assert(book.slippage('buy', 0.0) == 0.0 and book.slippage('sell', 0.0) == 0.0)
+    assert(book.vwap('buy', [0.0, 0.5]).tolist() == [100.0, 100.0])
+    if verbose: print('test zero quantity successful.')
+
+    assert(book.imbalance() == (4.5 - 3.5) / 8.0)
+    assert(book.imbalance(within=0.01) == (1.5 - 0.5) / 2.0) # bids at or above 98.7525, asks at or below 100.7475
+    try:
+        book.vwap('short', 1.0)
+        assert(False)
+    except ValueError:
+        pass
+    if verbose: print('test imbalance and sides successful.')
+
+def run_unittests(verbose=False):
+    test_order_book(verbose=verbose)
+    if verbose: print('Unit Tests Complete.')
+
+
+
+if __name__ == '__main__':
+    run_unittests(verbose=True)
@@ -0,0 +1,214 @@
+import sys
+import os
+import json
+import time
+import argparse
+import itertools
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+pd.set_option('display.max_rows', 100)
+pd.set_option('display.max_columns', 20)
+import numpy as np
+
+from shared_arrays import create_shared_arrays, attach_shared_arrays
+from logger import QUIET
+import simple_backtester_one_coin
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        run Strat.backtest of simple_backtester_one_coin once for every combination of a parameter grid,
+        spread over a pool of worker processes (one per core by default)
+
+        parameter names in UPPER CASE override the constants of the Strat's module (ex: TF, MAX_LEVERAGE)
+        parameter names in lower case are set as attributes of the Strat before it backtests
+            (ex: strategy thresholds the Strat reads as self.<name> in strat_init() or update())
+
+        the price data is put in shared memory once, each worker attaches to it when it starts,
+        so it isn't pickled and sent to the workers once per combination
+
+    USAGE
+
+        python parameter_sweep.py --grid '{"TF" : [0.001, 0.0025], "threshold" : [0.01, 0.02, 0.03]}'
+        python parameter_sweep.py --grid grid.json --strat my_strategy:MyStrat --workers 8 --output results.csv
+        python parameter_sweep.py --test
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+DEFAULT_STRAT = 'simple_backtester_one_coin:Strat'
+RESULT_COLUMNS = ['tot_pl', 'max_drawdown', 'num_trades']
+
+#########################################################################################################################
+
+
+# expand a parameter grid (dict, key = parameter name, value = list of values) into a list of parameter dicts
+def grid_combinations(grid):
+    names = list(grid.keys())
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+# largest drop in tot_pl from a previous high
+def max_drawdown(tot_pl):
+    tot_pl = tot_pl[~np.isnan(tot_pl)]
+    if tot_pl.shape[0] == 0:
+        return 0.0
+    return float(np.max(np.maximum.accumulate(tot_pl) - tot_pl))
+
+def load_strat_class(strat_path):
+    module_name, class_name = strat_path.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+# the backtester module the Strat (or the Strat it subclasses) is defined in, this is where its constants are
+# (the module of the class that defines setup_backtesting, a subclass can be defined in another backtester's module)
+def strat_module(strat_class):
+    for cls in strat_class.__mro__:
+        module = sys.modules[cls.__module__]
+        if hasattr(module, 'COIN2') and 'setup_backtesting' in vars(cls):
+            return module
+    raise ValueError('%s is not a backtester Strat' % strat_class.__name__)
+
+
+# state of each worker process, set once by init_worker()
+worker = {}
+
+def init_worker(spec, strat_path):
+
+    shm, arrays = attach_shared_arrays(spec)
+    strat_class = load_strat_class(strat_path)
+    module = strat_module(strat_class)
+    module.LOG_LEVEL = QUIET
+
+    # datetime strings aren't numeric so they aren't in shared memory, rebuild them once per worker
+    unix_date = arrays['unix_date']
+    price_df = pd.DataFrame({
+        'unix_date' : unix_date,
+        'datetime'  : pd.to_datetime(unix_date, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        module.COIN2 : arrays['price']
+    })
+
+    worker['shm'] = shm
+    worker['strat_class'] = strat_class
+    worker['module'] = module
+    worker['price_df'] = price_df
+
+def run_backtest(params):
+
+    for name, value in params.items():
+        if name.isupper():
+            setattr(worker['module'], name, value)
+    strat = worker['strat_class'](verbose=False, logfile_path=None)
+    for name, value in params.items():
+        if not name.isupper():
+            setattr(strat, name, value)
+    strat.backtest(price_df=worker['price_df'], verbose=False)
+
+    tot_pl = strat.df['tot_pl'].to_numpy(dtype=np.float64)
+    finished = tot_pl[~np.isnan(tot_pl)]
+    return dict(params,
+        tot_pl=float(finished[-1]) if finished.shape[0] > 0 else 0.0,
+        max_drawdown=max_drawdown(tot_pl),
+        num_trades=strat.num_trades)
+
+# backtest every combination of grid on price_df, returns a DataFrame with a row per combination
+def sweep(grid,
+    price_df=None,
+    strat_path=DEFAULT_STRAT,
+    max_workers=None,
+    verbose=False):
+
+    strat_class = load_strat_class(strat_path)
+    module = strat_module(strat_class)
+    if price_df is None:
+        price_df = strat_class(verbose=False, logfile_path=None).get_past_prices_from_price_store()
+    combinations = grid_combinations(grid)
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, len(combinations) // (4 * max_workers))
+
+    if verbose: print('Sweeping %d parameter combinations over %d time steps with %d workers ...' % (
+        len(combinations), price_df.shape[0], max_workers))
+    start_time = time.time()
+
+    shm, spec = create_shared_arrays({
+        'unix_date' : price_df['unix_date'].to_numpy(dtype=np.int64),
+        'price'     : price_df[module.COIN2].to_numpy(dtype=np.float64)
+    })
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(spec, strat_path)) as executor:
+            results = list(executor.map(run_backtest, combinations, chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    if verbose: print('Sweep Complete. %.1f seconds' % (time.time() - start_time))
+    return pd.DataFrame(results, columns=list(grid.keys()) + RESULT_COLUMNS)
+
+
+# enters a long position every hold time steps (exiting the one before it), so its number of trades
+# shows how many time steps a backtest covered, used by test_sweep_full_history
+class SweepTestStrat(simple_backtester_one_coin.Strat):
+
+    hold = 1000
+
+    def update(self,
+        pause_on_action=False,
+        verbose=False,
+        num_indents=0):
+
+        simple_backtester_one_coin.Strat.update(self, pause_on_action=pause_on_action, verbose=verbose, num_indents=num_indents)
+        if self.t % self.hold == 0:
+            for position_id in list(self.open_positions.keys()):
+                self.exit(position_id)
+            self.enter(simple_backtester_one_coin.LONG, 1.0)
+
+# a sweep backtests all of a price history longer than the default date range
+def test_sweep_full_history(verbose=False):
+    num_rows = 40001 # the default date range is 26496 time steps
+    unix_date = 1574294400 + 300 * np.arange(num_rows)
+    price_df = pd.DataFrame({
+        'unix_date' : unix_date,
+        'datetime'  : pd.to_datetime(unix_date, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        simple_backtester_one_coin.COIN2 : 8000.0 * np.cumprod(1.0 + np.random.default_rng(0).normal(0.0, 0.003, num_rows))
+    })
+    results = sweep(
+        {'hold' : [1000, 5000]},
+        price_df=price_df,
+        strat_path='parameter_sweep:SweepTestStrat',
+        max_workers=1)
+    num_time_steps = num_rows - 2 # the first row is dropped and the backtest starts at t = 0
+    assert(results['num_trades'].tolist() == [num_time_steps // 1000 - 1, num_time_steps // 5000 - 1])
+    if verbose: print('test_sweep_full_history successful.')
+
+def run_unittests(verbose=False):
+    test_sweep_full_history(verbose=verbose)
+    if verbose: print('Unit Tests Complete.')
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='backtest every combination of a parameter grid in parallel')
+    parser.add_argument('--grid',    default=None, help='JSON dict of parameter name to list of values, or path to a JSON file of one')
+    parser.add_argument('--strat',   default=DEFAULT_STRAT, help='module:Class of the Strat to backtest (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--output',  default=None, help='CSV file to save the results to')
+    parser.add_argument('--test',    action='store_true', help='run the unit tests instead of a sweep')
+    args = parser.parse_args()
+    if args.test:
+        run_unittests(verbose=True)
+        sys.exit()
+    if args.grid is None:
+        parser.error('the following arguments are required: --grid')
+
+    grid = json.load(open(args.grid, 'r')) if os.path.isfile(args.grid) else json.loads(args.grid)
+    results = sweep(grid, strat_path=args.strat, max_workers=args.workers, verbose=True)
+    results.sort_values('tot_pl', ascending=False, inplace=True)
+    print(results)
+    if args.output is not None:
+        results.to_csv(args.output, index=False)
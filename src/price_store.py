@@ -0,0 +1,130 @@
+import os
+import numpy as np
+import pandas as pd
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        columnar on disk store of price data, replaces saving one CSV file per date range
+
+        each (pair, period) gets one directory with one .npy file per column:
+            <root_path>/<pair>-<period>s/unix_date.npy   int64, sorted, no duplicates
+            <root_path>/<pair>-<period>s/datetime.npy    str, 'YYYY-MM-DD HH:MM:SS'
+            <root_path>/<pair>-<period>s/close.npy       float64
+            ...                                           (any other columns saved with it)
+
+        columns are loaded memory-mapped, a date window is found with a binary search of unix_date
+        and only that slice is read, so nothing is re-read or re-parsed from text
+
+        the old price_data_*.csv files can be put in the store once with import_csv()
+
+    '''
+
+INDEX_COLUMN = 'unix_date'
+
+
+class PriceStore:
+
+    def __init__(self, root_path):
+        self.root_path = root_path
+
+    # directory of the columns of pair at period (in seconds)
+    def path(self, pair, period):
+        return os.path.join(self.root_path, '%s-%ds' % (pair, period))
+
+    def exists(self, pair, period):
+        return os.path.isfile(os.path.join(self.path(pair, period), INDEX_COLUMN + '.npy'))
+
+    def columns(self, pair, period):
+        names = [f[:-len('.npy')] for f in os.listdir(self.path(pair, period)) if f.endswith('.npy')]
+        return [INDEX_COLUMN] + sorted(name for name in names if name != INDEX_COLUMN)
+
+    def load_column(self, pair, period, column):
+        return np.load(os.path.join(self.path(pair, period), column + '.npy'), mmap_mode='r')
+
+    # first and last unix_date stored (None if nothing is stored)
+    def time_range(self, pair, period):
+        if not self.exists(pair, period):
+            return None
+        unix_date = self.load_column(pair, period, INDEX_COLUMN)
+        if unix_date.shape[0] == 0:
+            return None
+        return int(unix_date[0]), int(unix_date[-1])
+
+    # returns a DataFrame of the rows with start_unix <= unix_date <= end_unix (the whole history if they're None)
+    def load(self,
+        pair,
+        period,
+        start_unix=None,
+        end_unix=None,
+        columns=None):
+
+        if not self.exists(pair, period):
+            raise FileNotFoundError('the price store %s has no %s prices at %d s intervals' % (self.root_path, pair, period))
+        unix_date = self.load_column(pair, period, INDEX_COLUMN)
+        i0 = 0                  if start_unix is None else int(np.searchsorted(unix_date, start_unix, side='left'))
+        i1 = unix_date.shape[0] if end_unix   is None else int(np.searchsorted(unix_date, end_unix,   side='right'))
+        if columns is None:
+            columns = self.columns(pair, period)
+        elif INDEX_COLUMN not in columns:
+            columns = [INDEX_COLUMN] + list(columns)
+        return pd.DataFrame({
+            column : np.array(self.load_column(pair, period, column)[i0:i1])
+            for column in columns
+        })
+
+    # returns a DataFrame with columns [unix_date, datetime, <price_column>] of pair at period
+    # from start_time_dt to end_time_dt (the whole history if they're None), like the CSV files had
+    def load_prices(self,
+        pair,
+        period,
+        price_column,
+        start_time_dt=None,
+        end_time_dt=None):
+
+        df = self.load(pair, period,
+            start_unix=None if start_time_dt is None else start_time_dt.timestamp(),
+            end_unix=  None if end_time_dt   is None else end_time_dt.timestamp(),
+            columns=['datetime', 'close'])
+        return df.rename(columns={'close' : price_column})
+
+    # replace everything stored for pair at period with df (must have a unix_date column)
+    def save(self, pair, period, df):
+
+        df = df.sort_values(INDEX_COLUMN, kind='stable')
+        df = df.drop_duplicates(subset=INDEX_COLUMN, keep='last')
+        path = self.path(pair, period)
+        os.makedirs(path, exist_ok=True)
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if column == INDEX_COLUMN:
+                values = values.astype(np.int64)
+            elif values.dtype.kind == 'M':
+                values = df[column].dt.strftime('%Y-%m-%d %H:%M:%S').to_numpy().astype(str)
+            elif values.dtype == object:
+                values = values.astype(str)
+
+            # write to a temporary file first so a crash can't leave a half written column
+            column_path = os.path.join(path, column + '.npy')
+            with open(column_path + '.tmp', 'wb') as f:
+                np.save(f, values, allow_pickle=False)
+            os.replace(column_path + '.tmp', column_path)
+
+    # add the rows of df to what is stored for pair at period, rows of df replace stored rows with the same unix_date
+    def merge(self, pair, period, df):
+        if self.exists(pair, period):
+            df = pd.concat([self.load(pair, period), df], ignore_index=True)
+        self.save(pair, period, df)
+
+    # save the price data of a CSV file made by get_past_prices_from_poloniex
+    # (columns: unix_date, datetime, <price_column>, ...) to the store, the price column is saved as 'close'
+    # the period is the most common time between rows of the file, it is returned
+    def import_csv(self, csv_path, pair, price_column):
+        df = pd.read_csv(csv_path, index_col=[0])
+        df = df[[INDEX_COLUMN, 'datetime', price_column]].rename(columns={price_column : 'close'})
+        df = df.dropna(subset=['close'])
+        period = int(pd.Series(np.diff(df[INDEX_COLUMN].to_numpy())).mode()[0])
+        self.merge(pair, period, df)
+        return period
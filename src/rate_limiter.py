@@ -0,0 +1,51 @@
+import time
+import threading
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        token bucket rate limiter that can be shared by many threads
+
+        the bucket holds up to capacity tokens and is refilled at rate tokens per second,
+        each call takes a token (waiting for one if the bucket is empty),
+        so calls can burst up to capacity at once but average at most rate per second
+
+    USAGE
+
+        rate_limiter = RateLimiter(6) # 6 calls per second
+        rate_limiter.acquire()        # blocks until the call is allowed
+        conn.api_query(...)
+
+    '''
+
+
+class RateLimiter:
+
+    def __init__(self, rate, capacity=None):
+        self.rate     = float(rate)                                        # tokens added per second
+        self.capacity = float(capacity if capacity is not None else max(rate, 1)) # max tokens in the bucket
+        self.tokens   = self.capacity
+        self.last     = time.monotonic()
+        self.lock     = threading.Lock()
+
+    # take tokens from the bucket, waiting until there are enough
+    def acquire(self, tokens=1):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
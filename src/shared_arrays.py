@@ -0,0 +1,44 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        put numpy arrays in one block of shared memory so worker processes can read them without copying
+        the parent creates the block with create_shared_arrays() and passes the (small, picklable) spec to the workers,
+        each worker calls attach_shared_arrays(spec) once to get numpy arrays backed by the same memory
+
+        the parent owns the block and must close() and unlink() it when the workers are done
+
+    '''
+
+ALIGNMENT = 64 # bytes, start every array on a cache line
+
+
+def create_shared_arrays(arrays):
+
+    # arrays = dict, key = name, value = numeric numpy array
+    # returns the SharedMemory block and the spec to attach to it with
+    arrays = {name : np.asarray(array) for name, array in arrays.items()}
+    layout, size = {}, 0
+    for name, array in arrays.items():
+        order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous else 'C'
+        layout[name] = (size, array.shape, array.dtype.str, order)
+        size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    for name, array in arrays.items():
+        offset, shape, dtype, order = layout[name]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset, order=order)[...] = array
+    return shm, {'name' : shm.name, 'layout' : layout}
+
+def attach_shared_arrays(spec):
+
+    # returns the SharedMemory block (keep a reference to it while using the arrays) and a dict of the arrays
+    shm = shared_memory.SharedMemory(name=spec['name'])
+    arrays = {}
+    for name, (offset, shape, dtype, order) in spec['layout'].items():
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset, order=order)
+        arrays[name].flags.writeable = False
+    return shm, arrays
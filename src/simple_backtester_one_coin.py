@@ -14,6 +14,11 @@ POLONIEX_PATH = os.path.join(ROOT_PATH.absolute(), 'src', 'exchanges', 'crypto')
 # sys.exit()
 sys.path.insert(0, POLONIEX_PATH)
 from poloniex import Poloniex
+from logger import Logger, DEBUG, INFO
+from id_allocator import IdAllocator
+from price_store import PriceStore
+from history_cache import HistoryCache, PoloniexHistory
+from event_scheduler import next_event
 
 import time
 import json
@@ -39,6 +44,10 @@ import numpy as np
         it takes the percentage change minus TF to get PL
         super simple, unrealistic but close enough
 
+        backtest_vectorized() is a much faster mode for strategies that can decide every position up front:
+        strat_positions() returns the position held after each time step and
+        exit_pl, tot_pl, the fees and the trade markers are computed from it with numpy, without stepping through time
+
     SOURCES
 
         https://docs.bokeh.org/en/latest/docs/user_guide/layout.html
@@ -59,7 +68,9 @@ MAX_LEVERAGE = 2.0
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_DAY-02-20-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_MONTH-01-21-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_QUARTER-11-21-2019-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
-BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME)
+BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME) # imported into the price store the first time the store doesn't have PAIR
+HISTORY_CACHE_PATH = os.path.dirname(DATA_PATH) # price data of each exchange is in <HISTORY_CACHE_PATH>/<exchange>/price_store
+PRICE_STORE_PATH = os.path.join(DATA_PATH, 'price_store')
 
 
 cur_pl = [0] # cur_pl = current p/l from this time step
@@ -82,9 +93,9 @@ SHORT = 'short'
 # pprint constants
 OUTPUT_TO_CONSOLE = True
 OUTPUT_TO_LOGFILE = True
+LOG_LEVEL = INFO # DEBUG also logs every time step (even when verbose=False), QUIET logs nothing
 STRATEGY_LOGFILE_PATH  = os.path.join(ROOT_PATH.absolute(), 'logs', 'backtest_log.txt')
 UNITTEST_LOGFILE_PATH  = os.path.join(ROOT_PATH.absolute(), 'logs', 'unittest_log.txt')
-LOGFILE_PATH = None # set by Strat class or StratUnitTests class
 INDENT = '|   '
 DRAW_LINE = False
 
@@ -103,36 +114,34 @@ class Strat:
         clear_log=True):
 
         self.logfile_path = logfile_path
-        if clear_log:
-            open(self.logfile_path, 'w').close()
+        self.logger = Logger(
+            logfile_path=logfile_path,
+            level=LOG_LEVEL,
+            to_console=OUTPUT_TO_CONSOLE,
+            to_logfile=OUTPUT_TO_LOGFILE,
+            clear_log=clear_log,
+            indent=INDENT,
+            draw_line=DRAW_LINE)
+        self.indicator_cache = None # DataFrame of indicators precomputed over the whole price history (row i = time step i of self.df), set by walk_forward.py
 
         if verbose: self.pprint('Strategy Initialized.', num_indents=num_indents)
     
     # create strategy setup
     def pprint(self,
         string='',
+        *args,
         num_indents=0,
         new_line_start=False,
         new_line_end=False,
-        draw_line=DRAW_LINE):
-
-        def output(out_loc):
-            indent = len(INDENT)*' ' if out_loc != sys.stdout else INDENT
-            total_indent0 = ''.join([indent] * num_indents)
-            total_indent1 = ''.join([indent] * (num_indents + 1))
-            if new_line_start:
-                print(total_indent1 if draw_line else total_indent0, file=out_loc)
-            for s in string.split('\n'):
-                print(total_indent0 + s, file=out_loc)
-            if new_line_end:
-                print(total_indent1 if draw_line else total_indent0, file=out_loc)
-
-        if OUTPUT_TO_CONSOLE:
-            output(sys.stdout)
-        if OUTPUT_TO_LOGFILE:
-            logfile = open(self.logfile_path, 'a')
-            output(logfile)
-            logfile.close()
+        draw_line=DRAW_LINE,
+        level=INFO):
+
+        # args are only formatted into string if level is being logged, see logger.py
+        self.logger.log(level, string, *args,
+            num_indents=num_indents,
+            new_line_start=new_line_start,
+            new_line_end=new_line_end,
+            draw_line=draw_line)
 
     # connect to Poloniex Exchange server
     def poloniex_server(self):
@@ -154,86 +163,152 @@ class Strat:
         end_time_dt,
         period,
         num_periods,
-        save_to_csv=False,
         verbose=False,
         num_indents=0):
 
-        # get history data from startTime to endTime
-        start_time_unix = time.mktime(start_time_dt.timetuple())
-        end_time_unix   = time.mktime(end_time_dt.timetuple())
-
-        conn = self.poloniex_server()
-
-        # get history data of this currency into the dictionary
-        prices = conn.api_query("returnChartData", {
-                'currencyPair': PAIR,
-                'start': start_time_unix,
-                'end': end_time_unix,
-                'period': period
-            })
-
-        prices2 = []
-        for t in range(num_periods):  # remove unneeded data
-            price = prices[t]['close']
-            prices2.append({'unix_date': prices[t]['date'], COIN2: price})
-
-        # create 'unix_date' and 'datetime' columns
-        df = pd.DataFrame(prices2)
-        df['datetime'] = df['unix_date'].apply(
-            lambda unix_timestamp : \
-            datetime.fromtimestamp(unix_timestamp))
-
-        # reorder columns
-        df = df[['unix_date', 'datetime', COIN2]]
-
-        if save_to_csv:
-    
-            # USE THIS AS A TEMPLATE TO CREATE new_data_filename (replace "APPROX_DURATION" with the approximate duration of the backtest)
-            new_data_filename = 'price_data_one_coin-%s_%s-5min_intervals-APPROX_DURATION-%S_to_%s.csv' % (
-                COIN2, COIN1,
-                start_time_dt.strftime('%Y-%m-%d-%I%p'),
-                end_time_dt.strftime('%Y-%m-%d-%I%p'))
-            new_backtest_data_file = os.path.join(DATA_PATH, new_data_filename)
-            df.to_csv(new_backtest_data_file)
+        # only the part of the range that isn't in the price store yet is fetched from poloniex
+        history_cache = HistoryCache(HISTORY_CACHE_PATH, [PoloniexHistory(self.poloniex_server())])
+        df = history_cache.load_prices('poloniex', PAIR, period, COIN2, start_time_dt, end_time_dt, verbose=verbose)
 
         if verbose: self.pprint('Successfully aquired price data from poloniex API.', num_indents=num_indents, new_line_start=True)
         return df
-    def get_past_prices_from_csv_file(self,
+    def get_past_prices_from_price_store(self,
+        start_time_dt=None,
+        end_time_dt=None,
+        period=5 * 60,
         verbose=False,
         num_indents=0):
-        if verbose: self.pprint('Successfully aquired price data from CSV file.', num_indents=num_indents, new_line_start=True)
-        return pd.read_csv(BACKTEST_DATA_FILE, index_col=[0])
+        price_store = PriceStore(PRICE_STORE_PATH)
+        if not price_store.exists(PAIR, period) and os.path.isfile(BACKTEST_DATA_FILE):
+            price_store.import_csv(BACKTEST_DATA_FILE, PAIR, COIN2)
+        df = price_store.load_prices(PAIR, period, COIN2, start_time_dt, end_time_dt)
+        if verbose: self.pprint('Successfully aquired price data from price store.', num_indents=num_indents, new_line_start=True)
+        return df
 
     # run backtest
     def backtest(self,
         num_periods='all',
         pause_on_action=False,
         plot=False,
+        price_df=None,
         verbose=False,
         num_indents=0):
 
-        self.setup_backtesting(verbose=verbose, num_indents=num_indents+1)
+        self.setup_backtesting(price_df=price_df, verbose=verbose, num_indents=num_indents+1)
 
         if num_periods == 'all':
             num_periods = self.num_periods
 
         # iterate over each timestep starting at t
+        # if the strategy set self.triggers it's idle until one of them fires, and the time steps until then are skipped
         self.pprint('Iterating Over price data.', num_indents=num_indents)
+        t_last = min(num_periods, self.t_last)
         while self.t < num_periods and self.t <= self.t_last - 1: # -1 b/c we increment t BEFORE we update
-            self.t += 1
+            self.t = self.next_update_t(t_last)
             self.update(
                 pause_on_action=pause_on_action,
                 verbose=verbose,
                 num_indents=num_indents+1)
         self.pprint('Backtest Complete.', num_indents=num_indents)
+        self.logger.flush()
+
+        if plot:
+            self.plot(verbose=verbose, num_indents=num_indents)
+    def next_update_t(self, t_last):
+
+        # self.triggers = dict with any of (None or missing = not used):
+        #     'below' - update when the price falls to or below this price
+        #     'above' - update when the price rises to or above this price
+        #     't'     - update at this time step
+        # nothing is exited over the skipped time steps, so their exit_pl is 0 and their tot_pl stays the same
+        # strategies with self.indicators need every price, so they're updated every time step
+        if self.triggers is None or len(self.indicators) > 0:
+            return self.t + 1
+        t_next = next_event(self.prices, self.t, t_last,
+            belows=[self.triggers.get('below')],
+            aboves=[self.triggers.get('above')],
+            ts=[self.triggers.get('t')])
+        if t_next > self.t + 1:
+            self.df.loc[self.t+1:t_next-1, 'exit_pl'] = 0.0
+            self.df.loc[self.t+1:t_next-1, 'tot_pl']  = self.df.at[self.t, 'tot_pl']
+        return t_next
+    def backtest_vectorized(self,
+        num_periods='all',
+        plot=False,
+        price_df=None,
+        verbose=False,
+        num_indents=0):
+
+        self.setup_backtesting(price_df=price_df, verbose=verbose, num_indents=num_indents+1)
+
+        if num_periods == 'all':
+            num_periods = self.num_periods
+        t_end = min(num_periods, self.t_last) # last time step updated, like backtest()
+
+        self.pprint('Computing P/L of strat_positions().', num_indents=num_indents)
+        positions = np.zeros(self.df.shape[0])
+        positions[self.start_t+1:t_end+1] = np.nan_to_num(np.asarray(self.strat_positions(), dtype=np.float64)[self.start_t+1:t_end+1])
+        self.apply_positions(positions, t_end)
+        self.t = t_end
+        self.pprint('Backtest Complete.', num_indents=num_indents)
+        self.logger.flush()
 
         if plot:
             self.plot(verbose=verbose, num_indents=num_indents)
+    def apply_positions(self, positions, t_end):
+
+        # positions[t] = quantity of COIN2 held after time step t (+ is long, - is short, 0 is out of the market)
+        # whenever the position changes, the position held before is exited and the new one is entered at that time step's price
+        # (the same as calling exit() then enter() in update()), a position still open at t_end isn't exited
+        prices = self.df[COIN2].to_numpy(dtype=np.float64)
+        t = np.arange(positions.shape[0])
+        prev_positions = np.concatenate(([0.0], positions[:-1]))
+        trades = (positions != prev_positions) & (t > self.start_t) & (t <= t_end)
+        exits  = trades & (prev_positions != 0)
+        enters = trades & (positions != 0)
+
+        # time step each exited position was entered at: the last trade before the exit
+        last_trade = np.maximum.accumulate(np.where(trades, t, 0))
+        enter_t = np.concatenate(([0], last_trade[:-1]))[exits]
+
+        # P/L of each exit, the same as exit()
+        quantity = np.abs(prev_positions[exits])
+        pl_pct = np.sign(prev_positions[exits]) * (prices[exits] - prices[enter_t]) / prices[enter_t]
+        tf = TF if INCLUDE_TF else 0
+        pl_value = pl_pct * quantity - 2 * quantity * tf
+
+        exit_pl = np.full(positions.shape[0], np.nan)
+        exit_pl[self.start_t+1:t_end+1] = 0.0
+        exit_pl[exits] = pl_value
+        tot_pl = np.full(positions.shape[0], np.nan)
+        tot_pl[self.start_t:t_end+1] = np.cumsum(np.nan_to_num(exit_pl[self.start_t:t_end+1]))
+        self.df['exit_pl'] = exit_pl
+        self.df['tot_pl'] = tot_pl
+        self.num_trades = int(np.count_nonzero(exits))
+
+        # trade markers for plot(), in the order update() would have made them (exit before enter at the same time step)
+        marker_t = np.concatenate((t[exits], t[enters]))
+        marker_color = np.concatenate((np.where(pl_value > 0, 'green', 'red'), np.full(np.count_nonzero(enters), 'blue')))
+        order = np.argsort(marker_t, kind='stable')
+        self.plot_params['trades'] = [
+            {'x' : int(x), 'y' : prices[x], 'color' : str(color)}
+            for x, color in zip(marker_t[order], marker_color[order])]
+
+        # the position still open at t_end
+        self.open_positions = {}
+        self.position_ids = IdAllocator()
+        if positions[t_end] != 0:
+            self.open_positions[self.position_ids.allocate()] = {
+                'long_or_short' : LONG if positions[t_end] > 0 else SHORT,
+                'enter_price'   : prices[last_trade[t_end]],
+                'enter_value'   : abs(positions[t_end])
+            }
     def setup_backtesting(self,
         start_time_dt=datetime(2019, 11, 21, 0, 0, 0),  # year, month, day, hour, minute, second
         end_time_dt=datetime(  2020,  2, 21, 0, 0, 0),
         period= 5 * 60, # 5 min intervals between timesteps
         t=0, # timestep to start strategy at
+        price_df=None, # DataFrame with columns: unix_date, datetime, COIN2, if given its used instead of getting the price data
         verbose=True,
         num_indents=0):
 
@@ -253,7 +328,11 @@ class Strat:
         }
 
         # determine the proper number of time steps from start_time_dt to end_time_dt for the given period
-        self.num_periods = int((end_time_dt - start_time_dt).total_seconds() / period)
+        # (price_df decides it when it's given, its first row is only the previous price of the first time step)
+        self.num_periods = \
+            int((end_time_dt - start_time_dt).total_seconds() / period) \
+            if price_df is None else \
+            price_df.shape[0] - 1
 
         if verbose:
             self.pprint('Start Time ......................... %s' % start_time_dt.strftime('%Y-%m-%d-%I%p'), num_indents=num_indents+1)
@@ -263,16 +342,22 @@ class Strat:
 
         # import backtest price data of COIN1 and COIN2 pair
         df = \
+            price_df[['unix_date', 'datetime', COIN2]].reset_index(drop=True) \
+            if price_df is not None else \
             self.get_past_prices_from_poloniex(
                 start_time_dt,
                 end_time_dt,
                 period,
                 self.num_periods,
                 verbose=verbose,
-                num_indends=num_indends+1) \
+                num_indents=num_indents+1) \
             if QUERI_POLONIEX else \
-            self.get_past_prices_from_csv_file(
-                verbose=verbose, num_indents=num_indents+1)
+            self.get_past_prices_from_price_store(
+                start_time_dt,
+                end_time_dt,
+                period,
+                verbose=verbose,
+                num_indents=num_indents+1)
 
         # get percent change of price each time step
         # https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.pct_change.html
@@ -290,8 +375,13 @@ class Strat:
         df['exit_pl'] = np.nan # the P/L of an investment at time of exit (percent change of investment after fees)
         df['tot_pl'] = np.nan # the total P/L of the strategy (percentage change of strategy)
         df.at[t, 'tot_pl'] = 0
-        self.open_positions = {}
+        self.open_positions = {} # key = position_id (int), value = dict of long_or_short, enter_price and enter_value
+        self.position_ids = IdAllocator() # reuses the lowest position_id freed by an exit
+        self.indicators = {} # key = name, value = incremental indicator (see indicators.py) updated with the price every time step, add them in the strategy init
+        self.triggers = None # set by the strategy to skip time steps until one fires, see next_update_t()
+        self.prices = df[COIN2].to_numpy(dtype=np.float64) # price of each time step, searched by next_update_t()
         self.pl_update = 0
+        self.num_trades = 0 # number of positions exited
 
         self.df = df
         self.t = t
@@ -324,6 +414,19 @@ class Strat:
 
         pass
 
+        ########################################################################################################################################
+    def strat_positions(self):
+
+        ########################################################## VECTORIZED STRATEGY GOES HERE ###############################################
+
+        # return an array with the position to hold after each time step of self.df (used by backtest_vectorized)
+        # in quantity of COIN2: + is long, - is short, 0 is out of the market, ex: a moving average crossover
+        #     fast = indicators.simple_moving_average(self.df[COIN2], 12)
+        #     slow = indicators.simple_moving_average(self.df[COIN2], 48)
+        #     return np.where(fast > slow, 1.0, -1.0)
+        # or read them from self.indicator_cache if it was given one, ex: self.indicator_cache[('simple_moving_average', 12)]
+        return np.zeros(self.df.shape[0])
+
         ########################################################################################################################################
     def update(self,
         pause_on_action=False,
@@ -336,10 +439,10 @@ class Strat:
         # if verbose: self.pprint('%d   %s   %s   %.6f %s/%s    %.1f %%' % (
         #     t, unix_date, date, price, COIN1, COIN2, (100*pct_chg)), num_indents=num_indents)
 
-        self.pprint('Updating Backtest: t = %d / %d' % (
-            t, self.t_last),
+        self.pprint('Updating Backtest: t = %d / %d', t, self.t_last,
             new_line_start=True, draw_line=True,
-            num_indents=num_indents)
+            num_indents=num_indents,
+            level=INFO if verbose else DEBUG)
         if verbose:
             self.pprint('t ..................... %s' % t, num_indents=num_indents+1)
             self.pprint('unix_date ............. %s' % unix_date, num_indents=num_indents+1)
@@ -358,10 +461,14 @@ class Strat:
                         data['enter_price'], COIN2, COIN1)
                     self.pprint(s, num_indents=num_indents+2)
 
+        # add this time step's price to the indicators, read them in the strategy as self.indicators[name].value
+        for indicator in self.indicators.values():
+            indicator.update(price)
 
         ########################################################## STRATEGY UPDATE GOES HERE ###################################################
 
         # tbd
+        # to sleep until something happens set self.triggers (ex: {'below' : 0.95 * price, 'above' : 1.05 * price}), to wake up every time step set it to None
         paused = True
 
         # ############################# test ############################
@@ -389,11 +496,12 @@ class Strat:
                         data['enter_value'], COIN2,
                         data['enter_price'], COIN2, COIN1)
                     self.pprint(s, num_indents=num_indents+2)
-        self.pprint('Update Complete. exit_pl = %.6f %s, tot_pl = %.6f %s' % (
-            self.df.at[t, 'exit_pl'], COIN2, self.df.at[t, 'tot_pl'], COIN2),
+        self.pprint('Update Complete. exit_pl = %.6f %s, tot_pl = %.6f %s',
+            self.df.at[t, 'exit_pl'], COIN2, self.df.at[t, 'tot_pl'], COIN2,
             num_indents=num_indents+1,
             new_line_start=verbose,
-            draw_line=verbose)
+            draw_line=verbose,
+            level=INFO if verbose else DEBUG)
         if pause_on_action and paused: input()
     def plot(self,
         verbose=False,
@@ -411,7 +519,6 @@ class Strat:
         mng.resize(*mng.window.maxsize()) # go fullscreen
         # _legend_loc, _b2a = 'center left', (1, 0.5) # puts legend ouside plot
         dot_size = 3.0
-        for _i, trade in enumerate(self.plot_params['trades']):
         for _i, trade in enumerate(self.plot_params['trades'][::-1]):
             axes[0].scatter(
                 [trade['x']],
@@ -509,7 +616,7 @@ class Strat:
             'color' : 'blue'
         })
 
-        if verbose: self.pprint('Entered a %s position of %.2f %ss at a price of %.6f %s/%s. position_id = \'%s\'' % (
+        if verbose: self.pprint('Entered a %s position of %.2f %ss at a price of %.6f %s/%s. position_id = %d' % (
             long_or_short, quantity, COIN2, self.price, COIN1, COIN2, position_id),
             num_indents=num_indents)
         return position_id
@@ -526,11 +633,13 @@ class Strat:
         tf = TF if INCLUDE_TF else 0
         pl_value -= 2 * self.open_positions[position_id]['enter_value'] * tf
         self.pl_update += pl_value
+        self.num_trades += 1
 
         position = self.open_positions[position_id]
         long_or_short = position['long_or_short']
         quantity = position['enter_value']
         del self.open_positions[position_id]
+        self.position_ids.free(position_id)
 
         self.plot_params['trades'].append({
             'x'     : self.t,
@@ -538,24 +647,14 @@ class Strat:
             'color' : 'green' if pl_value > 0 else 'red'
         })
 
-        if verbose: self.pprint('Exited a %s position (with position_id: \'%s\') of %.2f %ss at a price of %.6f %s/%s for a profit of %.6f %s (%.2f %%)' % (
+        if verbose: self.pprint('Exited a %s position (with position_id: %d) of %.2f %ss at a price of %.6f %s/%s for a profit of %.6f %s (%.2f %%)' % (
             long_or_short, position_id,
             quantity, COIN2,
             self.price, COIN1, COIN2,
             pl_value, COIN2, (100 * pl_pct)),
             num_indents=num_indents)
     def get_position_id(self):
-        i = 0
-        sorted_int_ids = sorted(list(map(
-            lambda pos_id : int(pos_id.split('_')[1]),
-            self.open_positions.keys())))
-        for int_id in sorted_int_ids:
-            if int_id > i:
-                return 'id_%d' % i
-            else:
-                i += 1
-
-        return 'id_%d' % i
+        return self.position_ids.allocate()
 
 
 
@@ -8,6 +8,8 @@ DATA_PATH     = os.path.join(ROOT_PATH.absolute(), 'data', 'crypto', 'poloniex')
 POLONIEX_PATH = os.path.join(ROOT_PATH.absolute(), 'src', 'exchanges', 'crypto')
 sys.path.insert(0, POLONIEX_PATH)
 from poloniex import Poloniex
+from price_store import PriceStore
+from history_cache import HistoryCache, PoloniexHistory
 
 import time
 import json
@@ -34,7 +36,9 @@ MAX_LEVERAGE = 2.0
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_DAY-02-20-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 # DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_MONTH-01-21-2020-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
 DATA_FILENAME = 'price_data_one_coin-%s_%s-5min_intervals-ONE_QUARTER-11-21-2019-12am_to_02-21-2020-12am.csv' % (COIN2, COIN1)
-BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME)
+BACKTEST_DATA_FILE = os.path.join(DATA_PATH, DATA_FILENAME) # imported into the price store the first time the store doesn't have PAIR
+HISTORY_CACHE_PATH = os.path.dirname(DATA_PATH) # price data of each exchange is in <HISTORY_CACHE_PATH>/<exchange>/price_store
+PRICE_STORE_PATH = os.path.join(DATA_PATH, 'price_store')
 
 #########################################################################################################################
 
@@ -56,52 +60,25 @@ def get_past_prices_from_poloniex(
     end_time_dt,
     period,
     num_periods,
-    save_to_csv=False,
     verbose=False):
 
-    # get history data from startTime to endTime
-    start_time_unix = time.mktime(start_time_dt.timetuple())
-    end_time_unix   = time.mktime(end_time_dt.timetuple())
-
-    conn = self.poloniex_server()
-
-    # get history data of this currency into the dictionary
-    prices = conn.api_query("returnChartData", {
-            'currencyPair': PAIR,
-            'start': start_time_unix,
-            'end': end_time_unix,
-            'period': period
-        })
-
-    prices2 = []
-    for t in range(num_periods):  # remove unneeded data
-        price = prices[t]['close']
-        prices2.append({'unix_date': prices[t]['date'], COIN2: price})
-
-    # create 'unix_date' and 'datetime' columns
-    df = pd.DataFrame(prices2)
-    df['datetime'] = df['unix_date'].apply(
-        lambda unix_timestamp : \
-        datetime.fromtimestamp(unix_timestamp))
-
-    # reorder columns
-    df = df[['unix_date', 'datetime', COIN2]]
-
-    if save_to_csv:
-
-        # USE THIS AS A TEMPLATE TO CREATE new_data_filename (replace "APPROX_DURATION" with the approximate duration of the backtest)
-        new_data_filename = 'price_data_one_coin-%s_%s-5min_intervals-APPROX_DURATION-%S_to_%s.csv' % (
-            COIN2, COIN1,
-            start_time_dt.strftime('%Y-%m-%d-%I%p'),
-            end_time_dt.strftime('%Y-%m-%d-%I%p'))
-        new_backtest_data_file = os.path.join(DATA_PATH, new_data_filename)
-        df.to_csv(new_backtest_data_file)
+    # only the part of the range that isn't in the price store yet is fetched from poloniex
+    history_cache = HistoryCache(HISTORY_CACHE_PATH, [PoloniexHistory(poloniex_server())])
+    df = history_cache.load_prices('poloniex', PAIR, period, COIN2, start_time_dt, end_time_dt, verbose=verbose)
 
     if verbose: print('Successfully aquired price data from poloniex API.')
     return df
-def get_past_prices_from_csv_file(verbose=False):
-    if verbose: print('Successfully aquired price data from CSV file.')
-    return pd.read_csv(BACKTEST_DATA_FILE, index_col=[0])
+def get_past_prices_from_price_store(
+    start_time_dt=None,
+    end_time_dt=None,
+    period=5 * 60,
+    verbose=False):
+    price_store = PriceStore(PRICE_STORE_PATH)
+    if not price_store.exists(PAIR, period) and os.path.isfile(BACKTEST_DATA_FILE):
+        price_store.import_csv(BACKTEST_DATA_FILE, PAIR, COIN2)
+    df = price_store.load_prices(PAIR, period, COIN2, start_time_dt, end_time_dt)
+    if verbose: print('Successfully aquired price data from price store.')
+    return df
 
 def setup_backtest(
     start_time_dt=datetime(2019, 11, 21, 0, 0, 0),  # year, month, day, hour, minute, second
@@ -141,7 +118,11 @@ def setup_backtest(
             num_periods,
             verbose=verbose) \
         if QUERI_POLONIEX else \
-        get_past_prices_from_csv_file(verbose=verbose)
+        get_past_prices_from_price_store(
+            start_time_dt,
+            end_time_dt,
+            period,
+            verbose=verbose)
 
     # get percent change of price each time step
     # https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.pct_change.html
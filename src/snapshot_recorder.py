@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import bisect
+from datetime import datetime, timezone
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        append only recorder of snapshots (ex: an order book and the recent trades every minute)
+
+        each snapshot is written as one line of JSON at the end of the current segment file, nothing that's
+        already written is ever read or rewritten, so recording costs the same no matter how much is recorded,
+        and a crash can at most cut off the last line (readers skip it)
+
+        segments are rotated: a new one is started when the current one is bigger than rotate_bytes or older than
+        rotate_seconds, and every time a recorder is opened
+
+        the index file has one line per snapshot: unix time, segment filename and byte offset of the snapshot,
+        so the snapshots of a time range are found with a binary search and read by seeking straight to them
+
+        files, for a recorder named <name> in <root_path>:
+            <root_path>/<name>.index                          "<unix_time> <segment_filename> <offset>" per line
+            <root_path>/<name>-<YYYYmmdd-HHMMSS>.jsonl        {"time" : <unix_time>, "snapshot" : <snapshot>} per line
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+ROTATE_BYTES   = 256 * 1024 * 1024 # start a new segment when the current one is bigger than this
+ROTATE_SECONDS = 24 * 60 * 60      # start a new segment when the current one is older than this
+
+#########################################################################################################################
+
+
+class SnapshotRecorder:
+
+    def __init__(self,
+        root_path,
+        name,
+        rotate_bytes=ROTATE_BYTES,
+        rotate_seconds=ROTATE_SECONDS,
+        fsync=False):
+
+        self.root_path      = root_path
+        self.name           = name
+        self.rotate_bytes   = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.fsync          = fsync # also force every snapshot to disk (survives a power loss, not just a crash)
+        os.makedirs(root_path, exist_ok=True)
+
+        self.index_path = os.path.join(root_path, name + '.index')
+        self.times, self.locations = self.load_index() # locations[i] = (segment_filename, offset) of the snapshot at times[i]
+        self.index_file = open(self.index_path, 'a')
+        self.segment = None # open segment file
+        self.segment_filename = None
+        self.segment_start_time = None
+
+    def load_index(self):
+        times, locations = [], []
+        if os.path.isfile(self.index_path):
+            for line in open(self.index_path, 'r'):
+                fields = line.split()
+                if len(fields) != 3: # cut off by a crash
+                    continue
+                times.append(float(fields[0]))
+                locations.append((fields[1], int(fields[2])))
+        return times, locations
+
+    def rotate(self, unix_time):
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_filename = '%s-%s.jsonl' % (self.name,
+            datetime.fromtimestamp(unix_time, timezone.utc).strftime('%Y%m%d-%H%M%S'))
+        self.segment = open(os.path.join(self.root_path, self.segment_filename), 'ab')
+        self.segment_start_time = unix_time
+
+    # append snapshot (anything json can dump) recorded at unix_time (default: now), snapshots must be recorded in time order
+    def record(self, snapshot, unix_time=None):
+
+        unix_time = time.time() if unix_time is None else unix_time
+        if self.segment is None or \
+            self.segment.tell() >= self.rotate_bytes or \
+            unix_time - self.segment_start_time >= self.rotate_seconds:
+            self.rotate(unix_time)
+
+        line = json.dumps({'time' : unix_time, 'snapshot' : snapshot}, separators=(',', ':')) + '\n'
+        offset = self.segment.tell()
+        self.segment.write(line.encode('utf-8'))
+        self.segment.flush()
+        if self.fsync:
+            os.fsync(self.segment.fileno())
+
+        # the snapshot is written before its index line, so the index never points to a snapshot that isn't there
+        self.index_file.write('%.6f %s %d\n' % (unix_time, self.segment_filename, offset))
+        self.index_file.flush()
+        self.times.append(unix_time)
+        self.locations.append((self.segment_filename, offset))
+
+    # returns a list of (unix_time, snapshot) recorded from start_unix to end_unix (everything if they're None)
+    def read(self, start_unix=None, end_unix=None):
+
+        i0 = 0               if start_unix is None else bisect.bisect_left(self.times, start_unix)
+        i1 = len(self.times) if end_unix   is None else bisect.bisect_right(self.times, end_unix)
+        snapshots = []
+        segment, segment_filename = None, None
+        for segment_filename1, offset in self.locations[i0:i1]:
+            if segment_filename1 != segment_filename:
+                if segment is not None:
+                    segment.close()
+                segment_filename = segment_filename1
+                segment = open(os.path.join(self.root_path, segment_filename), 'rb')
+            segment.seek(offset)
+            try:
+                record = json.loads(segment.readline())
+            except ValueError: # cut off by a crash
+                continue
+            snapshots.append((record['time'], record['snapshot']))
+        if segment is not None:
+            segment.close()
+        return snapshots
+
+    # returns the (unix_time, snapshot) recorded last at or before unix_time (None if there isn't one)
+    def read_at(self, unix_time):
+        i = bisect.bisect_right(self.times, unix_time)
+        if i == 0:
+            return None
+        snapshots = self.read(self.times[i-1], self.times[i-1])
+        return snapshots[-1] if len(snapshots) > 0 else None
+
+    def __len__(self):
+        return len(self.times)
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+        self.index_file.close()
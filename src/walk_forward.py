@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+pd.set_option('display.max_rows', 100)
+pd.set_option('display.max_columns', 20)
+import numpy as np
+
+from shared_arrays import create_shared_arrays, attach_shared_arrays
+from parameter_sweep import DEFAULT_STRAT, RESULT_COLUMNS, grid_combinations, load_strat_class, strat_module, max_drawdown
+from indicators import indicator_table
+from logger import QUIET
+
+
+''' NOTES
+
+    DESCRIPTION
+
+        walk-forward optimization: slice the price history into rolling folds, each with a train window followed by a test window,
+        pick the best parameters of a grid on each train window, backtest them on the test window right after it
+        (data the parameters weren't picked with) and stitch the test windows' P/L together into one out-of-sample equity curve
+
+            |----- train 0 -----|-- test 0 --|
+                         |----- train 1 -----|-- test 1 --|
+                                      |----- train 2 -----|-- test 2 --|
+
+        the test windows line up one after the other (step = test_size by default), so every time step
+        after the first train window is out-of-sample exactly once (see walk_forward_folds())
+
+        every (fold, combination) train backtest is independent, they're all spread over one pool of worker processes,
+        then the best combination of each fold is backtested on its test window by the same workers
+
+        the prices are put in shared memory once (like parameter_sweep.py), with the indicators of indicator_grid
+        (see indicators.indicator_table) computed once over the whole history, each backtest gets the rows of its window
+        as self.indicator_cache instead of recomputing them, and they're already warmed up at the start of the window
+
+        params work like in parameter_sweep.py: UPPER CASE names override the constants of the Strat's module,
+        lower case names are set as attributes of the Strat
+
+    USAGE
+
+        python walk_forward.py --grid '{"threshold" : [0.01, 0.02, 0.03]}' --train 25920 --test 8640
+        python walk_forward.py --grid grid.json --indicators '{"simple_moving_average" : [12, 48]}' --vectorized --output oos.csv
+
+    '''
+
+####################################################### CONSTANTS #######################################################
+
+TRAIN_SIZE = 90 * 288 # time steps in a train window (90 days of 5 min time steps)
+TEST_SIZE  = 30 * 288 # time steps in a test window (30 days of 5 min time steps)
+FOLD_COLUMNS = ['fold', 'train_start', 'train_end', 'test_start', 'test_end']
+
+#########################################################################################################################
+
+
+# list of (train_start, test_start, test_end) row ranges of price_df, train = [train_start, test_start), test = [test_start, test_end)
+# row 0 is left out, it's the previous price of the first time step (setup_backtesting drops the first row of the prices it's given)
+# a test window ends where the next fold's test window starts (when step < test_size), so no time step is out-of-sample twice
+def walk_forward_folds(num_rows, train_size=TRAIN_SIZE, test_size=TEST_SIZE, step=None):
+    step = step or test_size
+    folds = []
+    train_start = 1
+    while train_start + train_size < num_rows:
+        test_start = train_start + train_size
+        folds.append((train_start, test_start, min(test_start + test_size, test_start + step, num_rows)))
+        train_start += step
+    return folds
+
+# state of each worker process, set once by init_worker()
+worker = {}
+
+def init_worker(spec, strat_path, indicator_columns):
+
+    shm, arrays = attach_shared_arrays(spec)
+    strat_class = load_strat_class(strat_path)
+    module = strat_module(strat_class)
+    module.LOG_LEVEL = QUIET
+
+    # datetime strings aren't numeric so they aren't in shared memory, rebuild them once per worker
+    unix_date = arrays['unix_date']
+    worker['shm'] = shm
+    worker['strat_class'] = strat_class
+    worker['module'] = module
+    worker['price_df'] = pd.DataFrame({
+        'unix_date' : unix_date,
+        'datetime'  : pd.to_datetime(unix_date, unit='s').strftime('%Y-%m-%d %H:%M:%S'),
+        module.COIN2 : arrays['price']
+    })
+    worker['indicator_cache'] = None if indicator_columns is None else pd.DataFrame(
+        arrays['indicators'],
+        copy=False,
+        columns=pd.MultiIndex.from_tuples(indicator_columns, names=['indicator', 'window']))
+
+# backtest params on rows [start, end) of the prices, returns the Strat's tot_pl and number of trades
+def backtest_window(params, start, end, vectorized):
+
+    for name, value in params.items():
+        if name.isupper():
+            setattr(worker['module'], name, value)
+    strat = worker['strat_class'](verbose=False, logfile_path=None)
+    for name, value in params.items():
+        if not name.isupper():
+            setattr(strat, name, value)
+    if worker['indicator_cache'] is not None:
+        strat.indicator_cache = worker['indicator_cache'].iloc[start:end].reset_index(drop=True)
+
+    # the row before start is the previous price of the first time step, so setup_backtesting counts end - start time steps
+    price_df = worker['price_df'].iloc[start-1:end]
+    backtest = strat.backtest_vectorized if vectorized else strat.backtest
+    backtest(price_df=price_df, verbose=False)
+    return strat.df['tot_pl'].ffill().fillna(0.0).to_numpy(dtype=np.float64), strat.num_trades
+
+def run_train(job):
+    i, params, (train_start, test_start, test_end), vectorized = job
+    tot_pl, num_trades = backtest_window(params, train_start, test_start, vectorized)
+    return dict(params,
+        fold=i,
+        tot_pl=float(tot_pl[-1]),
+        max_drawdown=max_drawdown(tot_pl),
+        num_trades=num_trades)
+
+def run_test(job):
+    i, params, (train_start, test_start, test_end), vectorized = job
+    tot_pl, num_trades = backtest_window(params, test_start, test_end, vectorized)
+    return i, tot_pl, num_trades
+
+# walk-forward optimize grid over price_df (columns: unix_date, datetime, COIN2), the combination with the highest objective
+# (a column of RESULT_COLUMNS, - in front to pick the lowest, ex: '-max_drawdown') on each train window is backtested on its test window
+# indicator_grid = dict, key = indicator name, value = list of windows, computed once and given to every backtest as self.indicator_cache
+# returns a DataFrame of the out-of-sample equity curve (unix_date, datetime, fold, tot_pl of the fold, oos_pl stitched together)
+# and a DataFrame with a row per fold: its windows, best params, and the train and test results
+def walk_forward(grid,
+    price_df=None,
+    strat_path=DEFAULT_STRAT,
+    train_size=TRAIN_SIZE,
+    test_size=TEST_SIZE,
+    step=None,
+    objective='tot_pl',
+    indicator_grid=None,
+    vectorized=False,
+    max_workers=None,
+    verbose=False):
+
+    strat_class = load_strat_class(strat_path)
+    module = strat_module(strat_class)
+    if price_df is None:
+        price_df = strat_class(verbose=False, logfile_path=None).get_past_prices_from_price_store()
+    price_df = price_df.reset_index(drop=True)
+    folds = walk_forward_folds(price_df.shape[0], train_size, test_size, step)
+    if len(folds) == 0:
+        raise ValueError('%d time steps is too short for a train window of %d time steps' % (price_df.shape[0] - 1, train_size))
+    combinations = grid_combinations(grid)
+    max_workers = max_workers or os.cpu_count()
+    sign, objective = (-1, objective[1:]) if objective.startswith('-') else (1, objective)
+
+    if verbose: print('Walking forward %d folds of %d parameter combinations over %d time steps with %d workers ...' % (
+        len(folds), len(combinations), price_df.shape[0] - 1, max_workers))
+    start_time = time.time()
+
+    arrays = {
+        'unix_date' : price_df['unix_date'].to_numpy(dtype=np.int64),
+        'price'     : price_df[module.COIN2].to_numpy(dtype=np.float64)
+    }
+    indicator_columns = None
+    if indicator_grid:
+        table = pd.concat([
+            indicator_table(arrays['price'], [indicator], windows)
+            for indicator, windows in indicator_grid.items()], axis=1)
+        arrays['indicators'] = np.asfortranarray(table.to_numpy(dtype=np.float64))
+        indicator_columns = list(table.columns)
+
+    shm, spec = create_shared_arrays(arrays)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(spec, strat_path, indicator_columns)) as executor:
+
+            train_jobs = [(i, params, fold, vectorized) for i, fold in enumerate(folds) for params in combinations]
+            chunksize = max(1, len(train_jobs) // (4 * max_workers))
+            train_results = pd.DataFrame(list(executor.map(run_train, train_jobs, chunksize=chunksize)),
+                columns=['fold'] + list(grid.keys()) + RESULT_COLUMNS)
+
+            # best combination of each fold, the first one in grid order on a tie
+            scores = sign * train_results[objective].to_numpy(dtype=np.float64)
+            best = train_results.iloc[[
+                np.flatnonzero(train_results['fold'] == i)[np.argmax(scores[train_results['fold'] == i])]
+                for i in range(len(folds))]].reset_index(drop=True)
+            test_jobs = [(i, {name : best.at[i, name] for name in grid.keys()}, fold, vectorized) for i, fold in enumerate(folds)]
+            test_results = list(executor.map(run_test, test_jobs))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # stitch the test windows together, each one starts where the one before it ended
+    equity, summary, offset = [], [], 0.0
+    for (i, tot_pl, num_trades), (train_start, test_start, test_end) in zip(test_results, folds):
+        window = price_df.iloc[test_start:test_end][['unix_date', 'datetime']]
+        window = window.assign(fold=i, tot_pl=tot_pl, oos_pl=offset + tot_pl)
+        equity.append(window)
+        offset = float(window['oos_pl'].iloc[-1])
+        summary.append(dict(
+            {column : value for column, value in zip(FOLD_COLUMNS, [i, train_start, test_start - 1, test_start, test_end - 1])},
+            **{name : best.at[i, name] for name in grid.keys()},
+            train_tot_pl=best.at[i, 'tot_pl'],
+            test_tot_pl=float(tot_pl[-1]),
+            test_max_drawdown=max_drawdown(tot_pl),
+            test_num_trades=num_trades))
+    equity_df = pd.concat(equity).reset_index(drop=True)
+
+    if verbose: print('Walk Forward Complete. %.1f seconds' % (time.time() - start_time))
+    return equity_df, pd.DataFrame(summary,
+        columns=FOLD_COLUMNS + list(grid.keys()) + ['train_tot_pl', 'test_tot_pl', 'test_max_drawdown', 'test_num_trades'])
+
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='walk-forward optimize a parameter grid in parallel')
+    parser.add_argument('--grid',       required=True, help='JSON dict of parameter name to list of values, or path to a JSON file of one')
+    parser.add_argument('--strat',      default=DEFAULT_STRAT, help='module:Class of the Strat to backtest (default: %(default)s)')
+    parser.add_argument('--train',      type=int, default=TRAIN_SIZE, help='time steps in a train window (default: %(default)s)')
+    parser.add_argument('--test',       type=int, default=TEST_SIZE, help='time steps in a test window (default: %(default)s)')
+    parser.add_argument('--step',       type=int, default=None, help='time steps between folds (default: the test window)')
+    parser.add_argument('--objective',  default='tot_pl', help='result to maximize, - in front to minimize (default: %(default)s)')
+    parser.add_argument('--indicators', default=None, help='JSON dict of indicator name to list of windows to precompute')
+    parser.add_argument('--vectorized', action='store_true', help='backtest with backtest_vectorized() instead of backtest()')
+    parser.add_argument('--workers',    type=int, default=None, help='number of worker processes (default: number of cores)')
+    parser.add_argument('--output',     default=None, help='CSV file to save the out-of-sample equity curve to')
+    args = parser.parse_args()
+
+    grid = json.load(open(args.grid, 'r')) if os.path.isfile(args.grid) else json.loads(args.grid)
+    equity_df, summary = walk_forward(grid,
+        strat_path=args.strat,
+        train_size=args.train,
+        test_size=args.test,
+        step=args.step,
+        objective=args.objective,
+        indicator_grid=json.loads(args.indicators) if args.indicators is not None else None,
+        vectorized=args.vectorized,
+        max_workers=args.workers,
+        verbose=True)
+    print(summary)
+    print('out-of-sample tot_pl: %.6f, max_drawdown: %.6f' % (
+        equity_df['oos_pl'].iloc[-1], max_drawdown(equity_df['oos_pl'].to_numpy())))
+    if args.output is not None:
+        equity_df.to_csv(args.output, index=False)